@@ -2,32 +2,81 @@ import json
 import os
 import re
 import sys
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from tempfile import TemporaryDirectory
 
 from pathlib import Path
 from yaml import safe_load
 from yaml.parser import ParserError
 
-from backup_tool.exception import CLIException
-from backup_tool.client import BackupClient
+from backup_tool.exception import BackupToolException, CLIException
+from backup_tool.client import BackupClient, DEFAULT_CLEANUP_WORKERS, DEFAULT_VERIFY_WORKERS
 from backup_tool.cli.common import CommonArgparse
-from backup_tool.database import BackupEntryLocalFile
-from backup_tool import utils
+from backup_tool.cli.server import BackupServer, DEFAULT_SERVER_WORKERS, send_request, server_request_args
+from backup_tool.inotify import Inotify, RecursiveWatcher
+from backup_tool import crypto, utils
+from backup_tool.profiling import DEFAULT_PROFILE_TOP, profile_call
+from backup_tool.scheduler import DEFAULT_SCHEDULE_POLICY, SCHEDULE_POLICIES, schedule
+
+# Database models pull in sqlalchemy, only load them once the database is used
+database = utils.lazy_import('backup_tool.database')
 
 HOME_PATH = Path(os.path.expanduser('~'))
 DEFAULT_SETTINGS_FILE = HOME_PATH / '.backup-tool' / 'config'
+DEFAULT_SERVER_SOCKET = HOME_PATH / '.backup-tool' / 'server.sock'
+# Seconds a changed file must be quiet before directory watch backs it up
+DEFAULT_WATCH_DEBOUNCE = 2.0
+# Files encrypted and uploaded at the same time by directory backup
+DEFAULT_BACKUP_WORKERS = 1
+# Output formats of list commands
+LIST_FORMATS = ['json', 'jsonl']
+# Commands that log a per stage metrics summary when finished
+METRICS_SUMMARY_COMMANDS = ['directory_backup', 'directory_watch', 'directory_restore', 'file_restore']
 
 class ClientCLI():
     '''
     CLI for Backup Client
     '''
-    def __init__(self, **kwargs):
+    def __init__(self, client=None, **kwargs):
         '''
         Backup Client
+
+        client      :   Existing BackupClient to run commands with, such as the warm client of the server
         '''
         general_config = kwargs.pop('general', {})
         oci_config = kwargs.pop('oci', {})
+        # Kept for requests run by the server, which use the same settings
+        self.general_config = dict(general_config)
+        self.command_str = f'{kwargs.pop("module")}_{kwargs.pop("command")}'
+
+        self.temporary_directory = TemporaryDirectory() #pylint:disable=consider-using-with
+
+        self.logging_file = general_config.get('logging_file', None)
+        self.metrics_file = general_config.pop('metrics_file', None)
+        self.metrics_textfile = general_config.pop('metrics_textfile', None)
+        self.server_socket = general_config.pop('server_socket', None)
+        # Extra print args, the server sends output to the client socket instead of stdout
+        self.print_kwargs = {}
+
+        self.client = client or self.__create_client(general_config, oci_config)
+        self.profile = kwargs.pop('profile', None)
+        self.profile_memory = kwargs.pop('profile_memory', None)
+        self.profile_top = kwargs.pop('profile_top', None) or DEFAULT_PROFILE_TOP
+        self.additional_kwargs = kwargs
+        # Cache file may be given later in some functions
+        self.cache_file = None
+        self.cache_json = {
+            'backup': {
+                'pending_upload': {},
+                'processed': [],
+            },
+        }
 
+    def __create_client(self, general_config, oci_config):
         crypto_key = general_config.pop('crypto_key_file', None)
         if crypto_key:
             key_file_path = Path(crypto_key)
@@ -36,33 +85,29 @@ class ClientCLI():
             else:
                 raise CLIException(f'Crypto key file {crypto_key} does not exist')
 
-        self.temporary_directory = TemporaryDirectory() #pylint:disable=consider-using-with
-
         client_kwargs = {
             'database_file': general_config.pop('database_file', None),
             'crypto_key': crypto_key,
             'work_directory': general_config.pop('work_directory', self.temporary_directory.name),
             'logging_file': general_config.pop('logging_file', None),
             'relative_path': general_config.pop('relative_path', None),
+            'metadata_policy': general_config.pop('metadata_policy', None),
+            'metadata_policies': general_config.pop('metadata_policies', None),
+            'staging_budget': general_config.pop('staging_budget', None),
+            'staging_reserve': general_config.pop('staging_reserve', None),
+            'small_file_threshold': general_config.pop('small_file_threshold', None),
 
             'oci_config_file': oci_config.pop('config_file', None),
             'oci_config_section': oci_config.pop('config_section', None),
             'oci_instance_principal': oci_config.pop('instance_principal', None),
             'oci_namespace': oci_config.pop('namespace', None),
             'oci_bucket': oci_config.pop('bucket', None),
+            'oci_max_concurrency': oci_config.pop('max_concurrency', None),
+            'oci_latency_target': oci_config.pop('latency_target', None),
+            # Server runs requests from several threads
+            'scoped_session': self.command_str == 'serve_start',
         }
-
-        self.client = BackupClient(**client_kwargs)
-        self.command_str = f'{kwargs.pop("module")}_{kwargs.pop("command")}'
-        self.additional_kwargs = kwargs
-        # Cache file may be given later in some functions
-        self.cache_file = None
-        self.cache_json = {
-            'backup': {
-                'pending_upload': {},
-                'processed': [],
-            },
-        }
+        return BackupClient(**client_kwargs)
 
     def __enter__(self):
         return self
@@ -78,8 +123,19 @@ class ClientCLI():
 
     def run_command(self):
         '''
-        Run command given in kwargs
+        Run command given in kwargs, under the profiler if requested
         '''
+        if not (self.profile or self.profile_memory):
+            self._run_command()
+            return
+        # Write profile next to the log file, so it can be attached with the logs
+        output_directory = Path(self.logging_file).expanduser().parent if self.logging_file else Path.cwd()
+        output_prefix = output_directory / f'backup-tool-profile-{self.command_str}-{time.strftime("%Y%m%d-%H%M%S")}'
+        profile_call(self._run_command, output_prefix, memory=self.profile_memory, top=self.profile_top,
+                     metrics=self.client.metrics, logger=self.client.logger)
+
+    def _run_command(self):
+        self.client.metrics.mark(self.command_str)
         try:
             command = getattr(self, self.command_str)
             value = command(**self.additional_kwargs)
@@ -87,9 +143,68 @@ class ClientCLI():
             command = getattr(self.client, self.command_str)
             value = command(**self.additional_kwargs)
         if value is not None:
-            print(json.dumps(value, indent=4))
+            print(json.dumps(value, indent=4), **self.print_kwargs)
+        self.client.metrics.mark('report')
+        self.report_metrics()
 
-    def __consume_backup_file(self, local_file_path, overwrite, force_checksum=False):
+    def report_metrics(self):
+        '''
+        Log metrics summary and write metrics files if configured
+        '''
+        if self.command_str in METRICS_SUMMARY_COMMANDS:
+            for line in self.client.metrics.format_summary():
+                self.client.logger.info(line)
+        if self.metrics_file:
+            self.client.metrics.write_json(Path(self.metrics_file).expanduser())
+        if self.metrics_textfile:
+            self.client.metrics.write_prometheus(Path(self.metrics_textfile).expanduser(), self.command_str)
+
+    def _write_stream(self, rows, output_format=None):
+        '''
+        Print rows as they are read, instead of building the whole output in memory
+
+        rows            :   Iterable of dictionaries
+        output_format   :   "json" for a compact json array, "jsonl" for one json object per line
+        '''
+        if output_format == 'jsonl':
+            for row in rows:
+                print(json.dumps(row), **self.print_kwargs)
+            return
+        separator = '['
+        for row in rows:
+            print(separator + json.dumps(row), end='', **self.print_kwargs)
+            separator = ','
+        print('[]' if separator == '[' else ']', **self.print_kwargs)
+
+    def file_list(self, output_format=None, path_prefix=None, min_id=None, max_id=None, has_backup=None):
+        '''
+        Stream local file entries to stdout
+
+        output_format   :   "json" or "jsonl"
+        path_prefix     :   Only list files with local path starting with prefix
+        min_id          :   Only list files with id greater or equal
+        max_id          :   Only list files with id less or equal
+        has_backup      :   Only list files with a backup entry if True, without if False
+        '''
+        self._write_stream(self.client.file_list_iter(path_prefix=path_prefix, min_id=min_id,
+                                                      max_id=max_id, has_backup=has_backup),
+                           output_format=output_format)
+
+    def backup_list(self, output_format=None, min_id=None, max_id=None):
+        '''
+        Stream backup entries to stdout
+
+        output_format   :   "json" or "jsonl"
+        min_id          :   Only list backups with id greater or equal
+        max_id          :   Only list backups with id less or equal
+        '''
+        self._write_stream(self.client.backup_list_iter(min_id=min_id, max_id=max_id), output_format=output_format)
+
+    def __check_backup_file(self, local_file_path, overwrite, force_checksum=False):
+        '''
+        Check metadata and checksum of file against the database
+        Returns status, one of "unchanged", "renamed" or "upload", and local file id and md5 if the file must be uploaded
+        '''
         self.client.logger.debug(f'Backup up file {str(local_file_path)}')
 
         # Get relative path for database
@@ -98,8 +213,8 @@ class ClientCLI():
             relative_file_path = local_file_path.relative_to(self.client.relative_path)
 
         # Get database entry to check metadata
-        local_backup_file = self.client.db_session.query(BackupEntryLocalFile).\
-            filter(BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
+        local_backup_file = self.client.db_session.query(database.BackupEntryLocalFile).\
+            filter(database.BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
 
         # Check metadata first (unless force_checksum)
         if local_backup_file and not force_checksum:
@@ -107,49 +222,331 @@ class ClientCLI():
                 # Metadata unchanged - file likely hasn't changed
                 if local_backup_file.backup_entry_id:
                     self.client.logger.debug(f'File metadata unchanged, skipping backup for "{str(local_file_path)}"')
+                    self.client.metrics.increment('skip', files=1)
                     self.cache_json['backup']['processed'].append(str(local_file_path))
-                    return None
+                    return 'unchanged', None
+        elif not local_backup_file and not force_checksum:
+            # New path, check if it is a renamed file before reading any data
+            if self.client._file_backup_detect_rename(local_file_path): #pylint:disable=protected-access
+                self.cache_json['backup']['processed'].append(str(local_file_path))
+                return 'renamed', None
 
-        local_file_md5 = utils.md5(local_file_path)
+        local_file_md5 = self.client._local_file_md5(local_file_path) #pylint:disable=protected-access
         self.client.logger.debug(f'Local file "{str(local_file_path)}" has md5 {local_file_md5}')
         should_upload_file, local_backup_file = self.client._file_backup_ensure_database_entry(local_file_path, #pylint:disable=protected-access
                                                                                                 local_file_md5,
                                                                                                 overwrite)
         if not should_upload_file:
             # Update metadata cache even if not uploading (md5 matched but metadata changed)
-            self.client._update_metadata_cache(local_file_path, local_backup_file) #pylint:disable=protected-access
+            self.client._update_metadata_cache(local_file_path, local_backup_file, local_file_md5=local_file_md5) #pylint:disable=protected-access
             self.cache_json['backup']['processed'].append(str(local_file_path))
-            return None
-        encryption_data = self.client._file_backup_encrypt(local_file_path, local_file_md5) #pylint:disable=protected-access
+            return 'unchanged', None
+        return 'upload', (local_backup_file.id, local_file_md5)
+
+    def __add_pending_upload(self, encryption_data, local_backup_file_id):
         encryption_data_key = encryption_data.get('local_file')
-        encryption_data['local_backup_file_id'] = local_backup_file.id
+        encryption_data['local_backup_file_id'] = local_backup_file_id
         self.cache_json['backup']['pending_upload'][encryption_data_key] = encryption_data
         return encryption_data
 
-    def __consume_upload_files(self, encryption_data):
-        self.client.logger.debug(f'Uploading crypto of file {str(encryption_data["local_file"])}')
-        local_backup_file = self.client.db_session.get(BackupEntryLocalFile, encryption_data['local_backup_file_id'])
-        resume_upload = False
+    def __upload_object_path(self, encryption_data):
+        '''
+        Return object path of pending upload and whether it resumes an earlier upload
+        '''
         try:
-            object_path = self.cache_json['backup']['pending_upload'][encryption_data['local_file']]['object_path']
-            resume_upload = True
+            return self.cache_json['backup']['pending_upload'][encryption_data['local_file']]['object_path'], True
         except KeyError:
             object_path = self.client._generate_uuid() #pylint:disable=protected-access
             self.cache_json['backup']['pending_upload'][encryption_data['local_file']]['object_path'] = object_path
-        self.client._file_backup_upload(encryption_data['encrypted_file'], #pylint:disable=protected-access
-                                        encryption_data['encrypted_file_md5'],
-                                        encryption_data['local_file_md5'],
-                                        local_backup_file,
-                                        object_path=object_path,
-                                        resume_upload=resume_upload)
+            return object_path, False
+
+    def __finish_upload(self, encryption_data, object_path):
+        local_backup_file = self.client.db_session.get(database.BackupEntryLocalFile, encryption_data['local_backup_file_id'])
+        self.client._file_backup_finalize(encryption_data['encrypted_file'], #pylint:disable=protected-access
+                                          object_path,
+                                          encryption_data['encrypted_file_md5'],
+                                          encryption_data['local_file_md5'],
+                                          local_backup_file,
+                                          original_size=encryption_data.get('local_file_size'))
         # Update metadata cache after successful upload
         self.client._update_metadata_cache(Path(encryption_data['local_file']), local_backup_file) #pylint:disable=protected-access
         self.cache_json['backup']['processed'].append(str(encryption_data['local_file']))
-        del self.cache_json['backup']['pending_upload'][encryption_data['local_file']]
-        Path(encryption_data['encrypted_file']).unlink()
+        # Streamed uploads have no pending entry or encrypted file, they cannot be resumed
+        self.cache_json['backup']['pending_upload'].pop(encryption_data['local_file'], None)
+        if encryption_data['encrypted_file']:
+            Path(encryption_data['encrypted_file']).unlink()
+
+    def __consume_upload_files(self, encryption_data):
+        self.client.logger.debug(f'Uploading crypto of file {str(encryption_data["local_file"])}')
+        object_path, resume_upload = self.__upload_object_path(encryption_data)
+        self.client._file_backup_put(encryption_data['encrypted_file'], #pylint:disable=protected-access
+                                     encryption_data['encrypted_file_md5'],
+                                     object_path,
+                                     resume_upload=resume_upload,
+                                     encryption_data=encryption_data)
+        self.__finish_upload(encryption_data, object_path)
+
+    def __track_hardlink(self, local_file_path, inode_key, hardlink_files):
+        local_backup_file = self.client._get_local_file_entry(local_file_path) #pylint:disable=protected-access
+        if not local_backup_file or not local_backup_file.backup_entry_id:
+            return
+        # First link found is the one other links point to, so it cannot point to another itself
+        if local_backup_file.hardlink_local_file_id:
+            local_backup_file.hardlink_local_file_id = None
+            self.client.db_session.commit()
+        hardlink_files[inode_key] = (local_backup_file.id, local_backup_file.backup_entry_id)
 
-    def directory_backup(self, dir_paths, overwrite=False, #pylint:disable=too-many-locals
-                        skip_files=None, cache_file=None, force_checksum=False):
+    def __scan_directories(self, directory_list, skip_files):
+        '''
+        Return list of files to backup, as tuples of path, inode key of files with several hardlinks and size
+        '''
+        pending_backup_files = []
+        # Set lookup, the processed list of a resumed run can be long
+        processed_files = set(self.cache_json['backup']['processed'])
+        for directory_path in directory_list:
+            self.client.logger.info(f'Generating file list from directory "{str(directory_path)}"')
+            with self.client.metrics.time('scan', files=0) as scan_observation:
+                scanned_before = len(pending_backup_files)
+                for file_name in directory_path.glob('**/*'):
+                    file_path = file_name.resolve()
+                    # Skip if matches any continue
+                    skip = False
+                    for skip_check in skip_files:
+                        if re.match(skip_check, str(file_path)):
+                            self.client.logger.warning(f'Ignoring file "{str(file_path)}" since matches skip check "{skip_check}"')
+                            skip = True
+                            break
+                    if skip:
+                        continue
+
+                    if str(file_path) in processed_files:
+                        self.client.logger.debug(f'Ignoring file "{str(file_path)}" as it is in cache or pending upload')
+                        continue
+                    if file_name.is_dir():
+                        continue
+                    if file_name.is_symlink():
+                        self.client.logger.warning(f'Ignoring symlink file {str(file_name)}')
+                        continue
+                    # Track inode of files with several links, so each inode is only hashed once
+                    inode_key = None
+                    file_stat = file_name.stat()
+                    if file_stat.st_nlink > 1:
+                        inode_key = (file_stat.st_dev, file_stat.st_ino)
+                    self.client.logger.debug(f'Adding file to backup queue "{str(file_path)}"')
+                    pending_backup_files.append((file_path, inode_key, file_stat.st_size))
+                scan_observation.files = len(pending_backup_files) - scanned_before
+        return pending_backup_files
+
+    def __changed_files(self, paths, skip_files):
+        '''
+        Yield (path, inode key, size) of each changed path that is still a regular file and not skipped
+        '''
+        for path in sorted(paths):
+            file_path = Path(path)
+            try:
+                # Changed paths may have been deleted or replaced since the event
+                if file_path.is_symlink() or not file_path.is_file():
+                    continue
+                file_path = file_path.resolve()
+                if any(re.match(skip_check, str(file_path)) for skip_check in skip_files):
+                    continue
+                file_stat = file_path.stat()
+            except OSError as error:
+                self.client.logger.error(f'Unable to backup changed file "{str(file_path)}": {str(error)}')
+                continue
+            self.client.metrics.increment('scan', files=1)
+            # Track inode of files with several links, so each inode is only hashed once
+            inode_key = (file_stat.st_dev, file_stat.st_ino) if file_stat.st_nlink > 1 else None
+            yield file_path, inode_key, file_stat.st_size
+
+    def __backup_changed_files(self, paths, skip_files, overwrite, force_checksum, workers, schedule_policy):
+        '''
+        Backup changed paths through the directory backup pipeline, a file that fails does not stop the others
+        '''
+        def report(_local_file_path, _status, _error=None):
+            # Failures are logged by the pipeline, watching carries on
+            return
+        self.__run_backup_pipeline(self.__changed_files(paths, skip_files), overwrite, force_checksum, workers, schedule_policy,
+                                   report=report)
+        # Processed list is only used to resume a single pass, do not let it grow while watching
+        self.cache_json['backup']['processed'] = []
+
+    def directory_watch(self, dir_paths, overwrite=False, skip_files=None, cache_file=None, force_checksum=False, #pylint:disable=too-many-locals
+                        debounce=DEFAULT_WATCH_DEBOUNCE, duration=None, workers=DEFAULT_BACKUP_WORKERS, schedule_policy=DEFAULT_SCHEDULE_POLICY):
+        '''
+        Backup all files in directory, then watch it with inotify and backup changed files once they settle
+        Falls back to a full rescan when the kernel event queue overflows
+
+        dir_paths           :       Directories to backup
+        overwrite           :       Upload new file if md5 has changed
+        skip_files          :       List of regexes to ignore for backup
+        cache_file          :       Cache File Location, will use default in work directory otherwise
+        force_checksum      :       Force MD5 calculation even if metadata unchanged
+        debounce            :       Seconds a changed file must be quiet before it is backed up
+        duration            :       Stop watching after seconds, watches until interrupted by default
+        workers             :       Files encrypted and uploaded at the same time during full scans
+        schedule_policy     :       Order files are backed up in during full scans, one of SCHEDULE_POLICIES
+        '''
+        try:
+            inotify = Inotify()
+        except OSError as error:
+            raise CLIException(f'Unable to watch directories: {str(error)}') from error
+        debounce = DEFAULT_WATCH_DEBOUNCE if debounce is None else debounce
+        with inotify, self.client.record_run('directory_watch'):
+            watcher = RecursiveWatcher(inotify, logger=self.client.logger)
+            # Watch before the initial scan, so changes made during the scan are not missed
+            for dir_path in dir_paths:
+                watcher.watch(str(Path(dir_path).resolve()))
+            prepared = self.__prepare_directory_backup(dir_paths, skip_files, cache_file)
+            if not prepared:
+                return
+            directory_list, skip_files = prepared
+            self.__backup_directories(directory_list, skip_files, overwrite, force_checksum,
+                                      workers=workers, schedule_policy=schedule_policy)
+            self.cache_json['backup']['processed'] = []
+            self.client.logger.info(f'Watching {len(watcher.directories)} directories for changes')
+
+            deadline = time.monotonic() + duration if duration else None
+            # Changed path to time of its last event
+            dirty = {}
+            try:
+                while deadline is None or time.monotonic() < deadline:
+                    timeout = debounce if dirty else None
+                    if deadline is not None:
+                        remaining = max(deadline - time.monotonic(), 0)
+                        timeout = remaining if timeout is None else min(timeout, remaining)
+                    changed, overflow = watcher.poll(timeout=timeout)
+                    now = time.monotonic()
+                    if overflow:
+                        self.client.logger.warning('Inotify event queue overflowed, rescanning all directories')
+                        dirty.clear()
+                        for directory_path in directory_list:
+                            watcher.watch(str(directory_path))
+                        self.__backup_directories(directory_list, skip_files, overwrite, force_checksum,
+                                                  workers=workers, schedule_policy=schedule_policy)
+                        self.cache_json['backup']['processed'] = []
+                        continue
+                    for path in changed:
+                        dirty[path] = now
+                    ready = [path for path, seen in dirty.items() if now - seen >= debounce]
+                    for path in ready:
+                        del dirty[path]
+                    if ready:
+                        self.client.logger.info(f'Backing up {len(ready)} changed files')
+                        self.__backup_changed_files(ready, skip_files, overwrite, force_checksum, workers, schedule_policy)
+            except KeyboardInterrupt:
+                self.client.logger.info('Stopped watching directories')
+
+    def serve_start(self, socket_path=None, workers=DEFAULT_SERVER_WORKERS):
+        '''
+        Serve file backup, file restore and directory backup requests on a unix socket, with one warm client
+
+        socket_path     :   Path of unix socket, defaults to general.server_socket or ~/.backup-tool/server.sock
+        workers         :   Number of requests run at the same time
+        '''
+        socket_path = Path(socket_path or self.server_socket or DEFAULT_SERVER_SOCKET).expanduser()
+        # Pay for database, storage client and index reads once, instead of on every request
+        self.client.warm()
+
+        # Directory backups read their cache file when they start and write it when done, those sharing one run in turn
+        cache_locks = {}
+        cache_locks_lock = threading.Lock()
+
+        def run_request(request, output):
+            cache_lock = nullcontext()
+            if f'{request.get("module")}_{request.get("command")}' == 'directory_backup':
+                cache_file = str(self.__cache_file_path(request.get('cache_file')))
+                with cache_locks_lock:
+                    cache_lock = cache_locks.setdefault(cache_file, threading.Lock())
+            # Each request has its own metrics, for its summary and run history
+            with cache_lock, ClientCLI(client=self.client.request_client(), general=dict(self.general_config), **request) as client_cli:
+                client_cli.print_kwargs = {'file': output}
+                client_cli.run_command()
+
+        with BackupServer(socket_path, self.client, run_request, workers=workers) as server:
+            self.client.logger.info(f'Serving on "{str(socket_path)}" with {workers} workers')
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                self.client.logger.info('Stopped server')
+
+    def file_backup(self, local_file=None, overwrite=False, force_checksum=False, from_file=None, null=False,
+                    workers=DEFAULT_BACKUP_WORKERS, schedule_policy=DEFAULT_SCHEDULE_POLICY, stdin=False, name=None):
+        '''
+        Backup file, every file listed in from_file, or data piped to stdin
+        Listed files go through the directory backup pipeline as they are read, and a json line with the result is printed per path
+
+        local_file          :       Full path of local file
+        overwrite           :       Upload new file if md5 has changed
+        force_checksum      :       Force MD5 calculation even if metadata unchanged
+        from_file           :       File listing paths to backup, one per line, "-" for stdin
+        null                :       Paths in from_file are separated by NUL instead of newline
+        workers             :       Listed files encrypted and uploaded at the same time
+        schedule_policy     :       Order listed files are backed up in, policies other than fifo read the whole list first
+        stdin               :       Backup data read from stdin, encrypted and uploaded as it arrives
+        name                :       Logical path stdin data is recorded as
+        '''
+        if [local_file is not None, from_file is not None, bool(stdin)].count(True) != 1:
+            raise CLIException('File backup needs one of a local file, --from-file or --stdin')
+        if stdin:
+            if not name:
+                raise CLIException('File backup from stdin needs --name')
+            return self.client.file_backup_stream(sys.stdin.buffer, name, overwrite=overwrite)
+        if local_file is not None:
+            return self.client.file_backup(local_file, overwrite=overwrite, force_checksum=force_checksum)
+        with self.client.record_run('file_backup'):
+            if from_file == '-':
+                self.__backup_file_list(sys.stdin.buffer, null, overwrite, force_checksum, workers, schedule_policy)
+            else:
+                try:
+                    with open(Path(from_file).expanduser(), 'rb') as reader:
+                        self.__backup_file_list(reader, null, overwrite, force_checksum, workers, schedule_policy)
+                except FileNotFoundError as error:
+                    raise CLIException(f'Unable to read file list {from_file}: {str(error)}') from error
+        return None
+
+    def __backup_file_list(self, reader, null, overwrite, force_checksum, workers, schedule_policy):
+        counts = {}
+        def report(local_file_path, status, error=None):
+            counts[status] = counts.get(status, 0) + 1
+            result = {'path': str(local_file_path), 'status': status}
+            if error:
+                result['error'] = error
+            print(json.dumps(result), flush=True, **self.print_kwargs)
+
+        self.client.metrics.mark('backup_files')
+        self.__run_backup_pipeline(self.__listed_files(reader, null, report), overwrite, force_checksum,
+                                   workers, schedule_policy, report=report)
+        self.client.logger.info(f'Backed up listed files: {counts}')
+
+    def __listed_files(self, reader, null, report):
+        '''
+        Yield (path, inode key, size) of each regular file listed in reader, reporting other paths
+        '''
+        for entry in utils.read_delimited(reader, b'\0' if null else b'\n'):
+            # Paths are bytes on disk, decode them the way the filesystem does
+            file_path = Path(os.fsdecode(entry))
+            try:
+                if file_path.is_symlink():
+                    self.client.logger.warning(f'Ignoring symlink file {str(file_path)}')
+                    report(file_path, 'ignored', 'Symlink')
+                    continue
+                if not file_path.is_file():
+                    report(file_path, 'failed', 'Not a regular file or does not exist')
+                    continue
+                file_path = file_path.resolve()
+                file_stat = file_path.stat()
+            except OSError as error:
+                report(file_path, 'failed', str(error))
+                continue
+            self.client.metrics.increment('scan', files=1)
+            # Track inode of files with several links, so each inode is only hashed once
+            inode_key = (file_stat.st_dev, file_stat.st_ino) if file_stat.st_nlink > 1 else None
+            yield file_path, inode_key, file_stat.st_size
+
+    def directory_backup(self, dir_paths, overwrite=False,
+                        skip_files=None, cache_file=None, force_checksum=False,
+                        workers=DEFAULT_BACKUP_WORKERS, schedule_policy=DEFAULT_SCHEDULE_POLICY):
         '''
         Backup all files in directory
 
@@ -158,9 +555,28 @@ class ClientCLI():
         skip_files          :       List of regexes to ignore for backup
         cache_file          :       Cache File Location, will use default in work directory otherwise
         force_checksum      :       Force MD5 calculation even if metadata unchanged
+        workers             :       Files encrypted and uploaded at the same time
+        schedule_policy     :       Order files are backed up in, one of SCHEDULE_POLICIES
+        '''
+        with self.client.record_run('directory_backup'):
+            prepared = self.__prepare_directory_backup(dir_paths, skip_files, cache_file)
+            if prepared:
+                self.__backup_directories(*prepared, overwrite, force_checksum,
+                                          workers=workers, schedule_policy=schedule_policy)
+
+    def __cache_file_path(self, cache_file):
+        '''
+        Path of cache file given, or the default one in the work directory
+        '''
+        return Path(cache_file).expanduser() if cache_file else self.client.work_directory / 'cache_file.json'
+
+    def __prepare_directory_backup(self, dir_paths, skip_files, cache_file):
+        '''
+        Load cache file and finish pending uploads of an interrupted run
+        Returns resolved directories and skip file regexes, None if a directory does not exist
         '''
         # Read cached information if its there
-        self.cache_file = Path(cache_file).expanduser() if cache_file else self.client.work_directory / 'cache_file.json'
+        self.cache_file = self.__cache_file_path(cache_file)
         if self.cache_file.exists():
             self.cache_json = json.loads(self.cache_file.read_text(encoding='utf-8'))
 
@@ -169,7 +585,7 @@ class ClientCLI():
             directory_path = Path(dir_path).resolve()
             if not directory_path.exists():
                 self.client.logger.error(f'Unable to find directory {str(directory_path)}')
-                return
+                return None
             directory_list.append(directory_path)
 
         # Make sure skip files is a string type
@@ -185,41 +601,204 @@ class ClientCLI():
             encryption_data['local_file'] = local_file
             pending_encryption_dicts.append(encryption_data)
 
+        self.client.metrics.mark('resume_pending_uploads')
         for encryption_data in pending_encryption_dicts:
             self.__consume_upload_files(encryption_data)
+        return directory_list, skip_files
 
-        pending_backup_files = []
-        for directory_path in directory_list:
-            self.client.logger.info(f'Generating file list from directory "{str(directory_path)}"')
-            for file_name in directory_path.glob('**/*'):
-                file_path = file_name.resolve()
-                # Skip if matches any continue
-                skip = False
-                for skip_check in skip_files:
-                    if re.match(skip_check, str(file_path)):
-                        self.client.logger.warning(f'Ignoring file "{str(file_path)}" since matches skip check "{skip_check}"')
-                        skip = True
+    def __backup_directories(self, directory_list, skip_files, overwrite, force_checksum,
+                             workers=DEFAULT_BACKUP_WORKERS, schedule_policy=DEFAULT_SCHEDULE_POLICY):
+        self.client.metrics.mark('scan')
+        pending_backup_files = self.__scan_directories(directory_list, skip_files)
+
+        self.client.metrics.mark('backup_files')
+        self.__run_backup_pipeline(pending_backup_files, overwrite, force_checksum, workers, schedule_policy)
+
+    def __run_backup_pipeline(self, backup_files, overwrite, force_checksum, workers, schedule_policy, report=None):
+        '''
+        Backup files, checking them on this thread and encrypting and uploading them on workers
+
+        backup_files    :   Iterable of (path, inode key, size) tuples, read as the pipeline has room
+        report          :   Function called with path, status and error message as the result of each file is known
+                            Errors of single files are reported instead of raised if given
+        '''
+        workers = max(workers or DEFAULT_BACKUP_WORKERS, 1)
+        pipeline = {
+            'source': iter(schedule(backup_files, schedule_policy or DEFAULT_SCHEDULE_POLICY)),
+            # Links put back in front of the source once the first link of their inode is done
+            'files': deque(),
+            # Future of encrypt or upload running on a worker thread, to its job
+            'jobs': {},
+            # Local file id and backup entry of the first link found per inode
+            'hardlink_files': {},
+            # Inode whose first link is still uploading, to the other links waiting for it
+            'hardlink_waiting': {},
+            # Checked file that must be uploaded, waiting for staging space
+            'checked': None,
+            # Bytes of encrypted files reserved in the work directory by jobs in flight
+            'staged': 0,
+            'report': report,
+        }
+        # Database session is only used on this thread, workers only encrypt and upload
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while True:
+                # Bound jobs in flight, so encrypted files waiting for upload do not fill the work directory
+                while len(pipeline['jobs']) < workers * 2:
+                    if pipeline['checked']:
+                        # No new encryptions until staged files are uploaded and make room
+                        if not self.__start_backup_job(executor, pipeline):
+                            break
+                        continue
+                    backup_file = pipeline['files'].popleft() if pipeline['files'] else next(pipeline['source'], None)
+                    if backup_file is None:
                         break
-                if skip:
-                    continue
+                    self.__submit_backup_file(executor, pipeline, backup_file, overwrite, force_checksum)
+                # Links only wait on a job in flight, so nothing is left once there are no jobs
+                if not pipeline['jobs']:
+                    break
+                done, _ = wait(pipeline['jobs'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    self.__complete_backup_job(executor, pipeline, future)
 
-                if str(file_path) in self.cache_json['backup']['processed']:
-                    self.client.logger.debug(f'Ignoring file "{str(file_path)}" as it is in cache or pending upload')
-                    continue
-                if file_name.is_dir():
-                    continue
-                if file_name.is_symlink():
-                    self.client.logger.warning(f'Ignoring symlink file {str(file_name)}')
-                    continue
-                self.client.logger.debug(f'Adding file to backup queue "{str(file_path)}"')
-                pending_backup_files.append(file_path)
+    def __run_on_worker(self, function, *args, **kwargs):
+        '''
+        Run pipeline job on a worker thread, closing the upload session of the thread once done
+        Sessions of worker threads are not closed when the executor shuts down, and would hold connections otherwise
+        '''
+        try:
+            return function(*args, **kwargs)
+        finally:
+            self.client.remove_upload_session()
 
-        for local_file_path in pending_backup_files:
-            # Check if file is within relative_path before processing
-            encryption_data = self.__consume_backup_file(local_file_path, overwrite, force_checksum)
-            if encryption_data:
-                self.__consume_upload_files(encryption_data)
-        self.client.logger.debug('Generating upload file consumer queues')
+    def __report_backup_file(self, pipeline, local_file_path, status, error=None):
+        if pipeline['report']:
+            pipeline['report'](local_file_path, status, error)
+
+    def __fail_backup_file(self, pipeline, local_file_path, inode_key, stage, error, encryption_data=None):
+        '''
+        Report file that could not be backed up, raises error unless the pipeline reports errors
+        Links waiting on the file are backed up on their own
+        '''
+        if not pipeline['report']:
+            raise error
+        if encryption_data:
+            # Reported failures are not resumed, drop the encrypted file and any uploaded parts
+            del self.cache_json['backup']['pending_upload'][encryption_data['local_file']]
+            Path(encryption_data['encrypted_file']).unlink(missing_ok=True)
+            try:
+                if encryption_data.get('object_path'):
+                    self.client._discard_pending_upload(encryption_data['object_path']) #pylint:disable=protected-access
+            except Exception as discard_error: #pylint:disable=broad-exception-caught
+                self.client.logger.warning(f'Unable to discard pending upload of file "{str(local_file_path)}": {str(discard_error)}')
+        self.client.logger.error(f'Unable to backup file "{str(local_file_path)}": {str(error)}')
+        self.client.metrics.increment(stage, errors=1)
+        self.__report_backup_file(pipeline, local_file_path, 'failed', str(error))
+        for link_path in reversed(pipeline['hardlink_waiting'].pop(inode_key, [])):
+            pipeline['files'].appendleft((link_path, inode_key, 0))
+
+    def __submit_backup_file(self, executor, pipeline, backup_file, overwrite, force_checksum):
+        '''
+        Check next scheduled file on this thread, and start encrypting it on a worker if it must be uploaded
+        '''
+        local_file_path, inode_key, _ = backup_file
+        if inode_key in pipeline['hardlink_waiting']:
+            pipeline['hardlink_waiting'][inode_key].append(local_file_path)
+            return
+        if inode_key in pipeline['hardlink_files']:
+            self.client._file_backup_hardlink(local_file_path, *pipeline['hardlink_files'][inode_key]) #pylint:disable=protected-access
+            self.cache_json['backup']['processed'].append(str(local_file_path))
+            self.__report_backup_file(pipeline, local_file_path, 'hardlink')
+            return
+        try:
+            status, checked = self.__check_backup_file(local_file_path, overwrite, force_checksum)
+        except (OSError, ValueError, BackupToolException) as error:
+            self.__fail_backup_file(pipeline, local_file_path, inode_key, 'md5', error)
+            return
+        if not checked:
+            if inode_key:
+                self.__track_hardlink(local_file_path, inode_key, pipeline['hardlink_files'])
+            self.__report_backup_file(pipeline, local_file_path, status)
+            return
+        if inode_key:
+            pipeline['hardlink_waiting'][inode_key] = []
+        pipeline['checked'] = (local_file_path, inode_key, *checked)
+        self.__start_backup_job(executor, pipeline)
+
+    def __start_backup_job(self, executor, pipeline):
+        '''
+        Start encrypting checked file on a worker, if its encrypted copy fits the staging budget and free space of the work directory
+        Small files are encrypted in memory, and files that never fit are encrypted while uploaded instead
+        Returns False if the file waits for staged files to be done
+        '''
+        local_file_path, inode_key, local_backup_file_id, local_file_md5 = pipeline['checked']
+        job = {'local_file_path': local_file_path, 'inode_key': inode_key, 'local_backup_file_id': local_backup_file_id,
+               'encryption_data': None, 'staged': 0}
+        try:
+            local_file_size = local_file_path.stat().st_size
+        except OSError as error:
+            pipeline['checked'] = None
+            self.__fail_backup_file(pipeline, local_file_path, inode_key, 'encrypt', error)
+            return True
+        # Reserved bytes of files still encrypting are not taken from free space yet
+        unwritten = sum(other['staged'] for other in pipeline['jobs'].values() if 'object_path' not in other)
+        decision = self.client._staging_decision(local_file_size, pipeline['staged'], unwritten) #pylint:disable=protected-access
+        if decision == 'wait' and pipeline['jobs']:
+            return False
+        pipeline['checked'] = None
+        if decision in ('memory', 'stream'):
+            job['object_path'] = self.client._generate_uuid() #pylint:disable=protected-access
+            put = self.client._file_backup_put_memory if decision == 'memory' else self.client._file_backup_put_stream #pylint:disable=protected-access
+            future = executor.submit(self.__run_on_worker, put, local_file_path, local_file_md5, job['object_path'])
+        else:
+            job['staged'] = crypto.encrypted_size(local_file_size)
+            pipeline['staged'] += job['staged']
+            future = executor.submit(self.__run_on_worker, self.client._file_backup_encrypt, local_file_path, local_file_md5) #pylint:disable=protected-access
+        pipeline['jobs'][future] = job
+        return True
+
+    def __complete_backup_job(self, executor, pipeline, future):
+        '''
+        Start upload of an encrypted file, or record a finished upload in the database
+        '''
+        job = pipeline['jobs'].pop(future)
+        if 'object_path' not in job:
+            try:
+                encryption_data = future.result()
+            except (OSError, BackupToolException) as error:
+                pipeline['staged'] -= job['staged']
+                self.__fail_backup_file(pipeline, job['local_file_path'], job['inode_key'], 'encrypt', error)
+                return
+            # Encrypted, record it so an interrupted run resumes the upload, then upload on a worker
+            job['encryption_data'] = self.__add_pending_upload(encryption_data, job['local_backup_file_id'])
+            job['object_path'], resume_upload = self.__upload_object_path(job['encryption_data'])
+            upload = executor.submit(self.__run_on_worker, self.client._file_backup_put, #pylint:disable=protected-access
+                                     job['encryption_data']['encrypted_file'],
+                                     job['encryption_data']['encrypted_file_md5'],
+                                     job['object_path'],
+                                     resume_upload=resume_upload,
+                                     encryption_data=job['encryption_data'])
+            pipeline['jobs'][upload] = job
+            return
+        try:
+            result = future.result()
+        except (OSError, BackupToolException) as error:
+            pipeline['staged'] -= job['staged']
+            self.__fail_backup_file(pipeline, job['local_file_path'], job['inode_key'], 'upload', error,
+                                    encryption_data=job['encryption_data'])
+            return
+        if job['encryption_data'] is None:
+            # Encrypted in memory or while uploaded, nothing was staged
+            job['encryption_data'] = result
+            job['encryption_data']['local_backup_file_id'] = job['local_backup_file_id']
+        self.__finish_upload(job['encryption_data'], job['object_path'])
+        pipeline['staged'] -= job['staged']
+        self.__report_backup_file(pipeline, job['local_file_path'], 'uploaded')
+        inode_key = job['inode_key']
+        if inode_key:
+            self.__track_hardlink(Path(job['encryption_data']['local_file']), inode_key, pipeline['hardlink_files'])
+            # Waiting links now point to this file, or are backed up on their own if it has no entry
+            for link_path in reversed(pipeline['hardlink_waiting'].pop(inode_key)):
+                pipeline['files'].appendleft((link_path, inode_key, 0))
 
 
 def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
@@ -229,6 +808,12 @@ def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
     parser = CommonArgparse(description='Backup Tool CLI')
     parser.add_argument('-s', '--settings-file', default=str(DEFAULT_SETTINGS_FILE),
                         help='Settings file')
+    parser.add_argument('--profile', action='store_true', default=None,
+                        help='Profile command with cProfile, output written next to the log file')
+    parser.add_argument('--profile-memory', action='store_true', default=None,
+                        help='Profile command with cProfile and trace memory allocations with tracemalloc')
+    parser.add_argument('--profile-top', type=int,
+                        help=f'Number of entries listed in the profile summary, defaults to {DEFAULT_PROFILE_TOP}')
 
 
     # Sub parsers
@@ -236,23 +821,54 @@ def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
     file_parser = sub_parser.add_parser('file', help='File Module')
     backup_parser = sub_parser.add_parser('backup', help='Backup Module')
     dir_parser = sub_parser.add_parser('directory', help='Directory Module')
+    run_parser = sub_parser.add_parser('run', help='Run History Module')
+    serve_parser = sub_parser.add_parser('serve', help='Serve backup and restore requests on a unix socket with a warm client')
+    serve_parser.set_defaults(command='start')
+    serve_parser.add_argument('--socket', dest='socket_path',
+                              help=f'Unix socket path, defaults to general.server_socket or {str(DEFAULT_SERVER_SOCKET)}')
+    serve_parser.add_argument('--workers', '-w', type=int, default=DEFAULT_SERVER_WORKERS,
+                              help='Number of requests run at the same time')
 
     # File Arguments
     file_sub_parser = file_parser.add_subparsers(dest='command', description='Command')
 
     # File List
-    file_sub_parser.add_parser('list', help='List files')
+    file_list = file_sub_parser.add_parser('list', help='List files')
+    file_list.add_argument('--format', dest='output_format', choices=LIST_FORMATS,
+                           help='Output format, compact json array by default or json lines')
+    file_list.add_argument('--path-prefix', '-p', help='Only list files with local path starting with prefix')
+    file_list.add_argument('--min-id', type=int, help='Only list files with id greater or equal')
+    file_list.add_argument('--max-id', type=int, help='Only list files with id less or equal')
+    file_list_backup = file_list.add_mutually_exclusive_group()
+    file_list_backup.add_argument('--has-backup', dest='has_backup', action='store_const', const=True,
+                                  help='Only list files with a backup entry')
+    file_list_backup.add_argument('--no-backup', dest='has_backup', action='store_const', const=False,
+                                  help='Only list files without a backup entry')
 
     # File duplicates
-    file_sub_parser.add_parser('duplicates', help='Find duplicate files')
+    file_duplicates = file_sub_parser.add_parser('duplicates', help='Find duplicate files')
+    file_duplicates.add_argument('--dir-paths', nargs='+',
+                                 help='Find duplicates on disk in directories instead of the database, only hashing files with matching sizes')
 
     # File cleanup
     file_cleanup = file_sub_parser.add_parser('cleanup', help='Delete files from database no longer present on filesystem')
     file_cleanup.add_argument('--dry-run', '-d', action='store_true', help='Do not delete files')
+    file_cleanup.add_argument('--workers', '-w', type=int, default=DEFAULT_CLEANUP_WORKERS,
+                              help='Number of threads used to check directories, useful on network filesystems')
 
     # File backup
     file_backup = file_sub_parser.add_parser('backup', help='Backup file')
-    file_backup.add_argument('local_file', help='Local file path')
+    file_backup.add_argument('local_file', nargs='?', help='Local file path')
+    file_backup.add_argument('--from-file', '-ff',
+                             help='Backup every file listed in file, one path per line, "-" reads stdin. Prints a json line per path')
+    file_backup.add_argument('--null', '-0', action='store_true', help='Paths in --from-file are separated by NUL instead of newline')
+    file_backup.add_argument('--stdin', action='store_true',
+                             help='Backup data piped to stdin, such as a database dump, without writing it to disk')
+    file_backup.add_argument('--name', '-n', help='Logical path data from --stdin is recorded as, and restored to')
+    file_backup.add_argument('--workers', '-w', type=int, default=DEFAULT_BACKUP_WORKERS,
+                             help='Number of listed files to encrypt and upload at the same time')
+    file_backup.add_argument('--schedule', dest='schedule_policy', choices=list(SCHEDULE_POLICIES), default=DEFAULT_SCHEDULE_POLICY,
+                             help='Order listed files are backed up in, policies other than fifo read the whole list first')
     file_backup.add_argument('--overwrite', '-o', action='store_true', help='Overwrite copy in database')
     file_backup.add_argument('--force-checksum', '-fc', action='store_true',
                             help='Force full MD5 checksum calculation even if file metadata (mtime/size) unchanged')
@@ -262,6 +878,10 @@ def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
     file_restore.add_argument('local_file_id', type=int, help='Local file id')
     file_restore.add_argument('--overwrite', '-o', action='store_true', help='Overwrite copy locally')
     file_restore.add_argument('--set-restore', '-sr', action='store_true', help='Attempt to restore archived files')
+    file_restore.add_argument('--verify', action='store_true',
+                              help='Check md5 of existing local file even if its metadata matches the cache')
+    file_restore.add_argument('--preserve-metadata', '-pm', action='store_true',
+                              help='Reapply mode and mtime the file had when backed up')
 
     # File md5
     file_md5 = file_sub_parser.add_parser('md5', help='Get md5 sum of file, in base64 encoding')
@@ -282,12 +902,32 @@ def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
     backup_sub_parser = backup_parser.add_subparsers(dest='command', description='Command')
 
     # Backup List
-    backup_sub_parser.add_parser('list', help='List backups')
+    backup_list = backup_sub_parser.add_parser('list', help='List backups')
+    backup_list.add_argument('--format', dest='output_format', choices=LIST_FORMATS,
+                             help='Output format, compact json array by default or json lines')
+    backup_list.add_argument('--min-id', type=int, help='Only list backups with id greater or equal')
+    backup_list.add_argument('--max-id', type=int, help='Only list backups with id less or equal')
 
     # Backup cleanup
     backup_cleanup = backup_sub_parser.add_parser('cleanup', help='Delete backups from database and object storage that dont have local files')
     backup_cleanup.add_argument('--dry-run', '-d', action='store_true', help='Do not delete these backups')
 
+    # Backup verify
+    backup_verify = backup_sub_parser.add_parser('verify', help='Verify backups exist in object storage with expected md5 sums')
+    backup_verify_mode = backup_verify.add_mutually_exclusive_group()
+    backup_verify_mode.add_argument('--quick', '-q', action='store_true',
+                                    help='Compare against the object storage listing only, no downloads, the default')
+    backup_verify_mode.add_argument('--deep', action='store_true',
+                                    help='Download and decrypt objects in memory, checking both md5 sums')
+    backup_verify.add_argument('--sample-rate', type=float, default=1.0,
+                               help='Fraction of backup entries to check with deep verify')
+    backup_verify.add_argument('--bandwidth-limit', type=int,
+                               help='Max download bytes per second for deep verify')
+    backup_verify.add_argument('--progress-file', '-pf',
+                               help='Progress file for deep verify, allows resuming an interrupted run')
+    backup_verify.add_argument('--workers', '-w', type=int, default=DEFAULT_VERIFY_WORKERS,
+                               help='Number of parallel downloads for deep verify')
+
     # Directory Arguments
     dir_sub_parser = dir_parser.add_subparsers(dest='command', description='Command')
 
@@ -299,6 +939,51 @@ def parse_args(args): #pylint:disable=too-many-locals,too-many-statements
     dir_backup.add_argument('--cache-file', '-cf', help='Cache file to use for directory backup')
     dir_backup.add_argument('--force-checksum', '-fc', action='store_true',
                            help='Force full MD5 checksum calculation even if file metadata (mtime/size) unchanged')
+    dir_backup.add_argument('--workers', '-w', type=int, default=DEFAULT_BACKUP_WORKERS,
+                           help='Number of files encrypted and uploaded at the same time')
+    dir_backup.add_argument('--schedule', dest='schedule_policy', choices=list(SCHEDULE_POLICIES), default=DEFAULT_SCHEDULE_POLICY,
+                           help='Order to backup files in, balanced alternates largest and smallest files')
+
+    # Directory restore
+    dir_restore = dir_sub_parser.add_parser('restore', help='Restore files, downloading each backup once')
+    dir_restore.add_argument('--path-prefix', '-p', help='Only restore files with local path starting with prefix')
+    dir_restore.add_argument('--overwrite', '-o', action='store_true', help='Overwrite copy locally')
+    dir_restore.add_argument('--set-restore', '-sr', action='store_true', help='Attempt to restore archived files')
+    dir_restore.add_argument('--hardlink', action='store_true',
+                             help='Hardlink files with the same content instead of copying them')
+    dir_restore.add_argument('--verify', action='store_true',
+                             help='Check md5 of existing local files even if their metadata matches the cache')
+    dir_restore.add_argument('--preserve-metadata', '-pm', action='store_true',
+                             help='Reapply mode and mtime files had when backed up')
+
+    # Directory watch
+    dir_watch = dir_sub_parser.add_parser('watch', help='Backup directory, then watch it and backup files as they change')
+    dir_watch.add_argument('--dir-paths', nargs='+', required=True, help='Directory local path')
+    dir_watch.add_argument('--overwrite', '-o', action='store_true', help='Overwrite copy in database')
+    dir_watch.add_argument('--skip-files', '-f', nargs='+', help='Skip files matching regexes')
+    dir_watch.add_argument('--cache-file', '-cf', help='Cache file to use for directory backup')
+    dir_watch.add_argument('--force-checksum', '-fc', action='store_true',
+                           help='Force full MD5 checksum calculation even if file metadata (mtime/size) unchanged')
+    dir_watch.add_argument('--workers', '-w', type=int, default=DEFAULT_BACKUP_WORKERS,
+                           help='Number of files encrypted and uploaded at the same time')
+    dir_watch.add_argument('--schedule', dest='schedule_policy', choices=list(SCHEDULE_POLICIES), default=DEFAULT_SCHEDULE_POLICY,
+                           help='Order to backup files in, balanced alternates largest and smallest files')
+    dir_watch.add_argument('--debounce', type=float, default=DEFAULT_WATCH_DEBOUNCE,
+                           help='Seconds a changed file must be quiet before it is backed up')
+    dir_watch.add_argument('--duration', type=float, help='Stop watching after seconds, watches until interrupted by default')
+
+    # Run Arguments
+    run_sub_parser = run_parser.add_subparsers(dest='command', description='Command')
+
+    # Run list
+    run_list = run_sub_parser.add_parser('list', help='List recorded backup runs')
+    run_list.add_argument('--run-command', '-c', dest='run_command', help='Only list runs of command, such as "directory_backup"')
+    run_list.add_argument('--limit', '-l', type=int, help='Max number of runs to list')
+
+    # Run stats
+    run_stats = run_sub_parser.add_parser('stats', help='Show throughput statistics of recorded backup runs')
+    run_stats.add_argument('--run-command', '-c', dest='run_command', help='Only include runs of command, such as "directory_backup"')
+    run_stats.add_argument('--limit', '-l', type=int, help='Only include most recent number of runs per command')
 
     # Final Steps
     parsed_args = vars(parser.parse_args(args))
@@ -334,12 +1019,37 @@ def generate_args(command_line_args):
     settings.update(cli_args)
     return settings
 
+def run_on_server(args):
+    '''
+    Send command to the server if one is listening, returns False if the command should run in this process
+
+    args    :   Args from generate_args
+    '''
+    request = server_request_args(args)
+    if request is None:
+        return False
+    socket_path = Path((args.get('general') or {}).get('server_socket') or DEFAULT_SERVER_SOCKET).expanduser()
+    if not socket_path.is_socket():
+        return False
+    try:
+        response = send_request(socket_path, request, sys.stdout)
+    except OSError:
+        # Socket left behind by a server that is no longer running
+        return False
+    except BackupToolException as error:
+        raise CLIException(str(error)) from error
+    if response.get('status') != 'success':
+        raise CLIException(f'Server request failed: {response.get("error")}')
+    return True
+
 def main():
     '''
     Main Runner
     '''
     try:
         args = generate_args(sys.argv[1:])
+        if run_on_server(args):
+            return
         with ClientCLI(**args) as client_cli:
             client_cli.run_command()
     except CLIException as error:
@@ -0,0 +1,160 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+import traceback
+
+from pathlib import Path
+
+from backup_tool.exception import BackupToolException
+
+# Commands the server runs, other commands always run in the cli process
+SERVER_COMMANDS = ['file_backup', 'file_restore', 'directory_backup']
+# Default number of requests run at the same time, others wait for a slot
+DEFAULT_SERVER_WORKERS = 4
+# Request args that are paths, made absolute by the thin client since the server has its own working directory
+PATH_ARGS = ['local_file', 'dir_paths', 'cache_file', 'from_file']
+
+class SocketOutput():
+    '''
+    File like writer sending printed output to the client as json lines
+    '''
+    def __init__(self, writer):
+        self.writer = writer
+
+    def write(self, text):
+        '''
+        Send text to client
+        '''
+        if text:
+            self.writer.write(json.dumps({'stdout': text}).encode('utf-8') + b'\n')
+            self.writer.flush()
+
+    def flush(self):
+        '''
+        Flush writer
+        '''
+        self.writer.flush()
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    '''
+    Run one json request per connection, streaming output back as json lines
+    '''
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        response = {'status': 'success'}
+        try:
+            request = json.loads(line)
+            command_str = f'{request.get("module")}_{request.get("command")}'
+            if command_str not in SERVER_COMMANDS:
+                raise BackupToolException(f'Command "{command_str}" not supported by server')
+            with self.server.slots:
+                self.server.run_request(request, SocketOutput(self.wfile))
+        except Exception as error: #pylint:disable=broad-exception-caught
+            # Report any failure to the client, the server keeps running
+            self.server.client.logger.error(f'Server request failed: {str(error)}')
+            self.server.client.logger.debug(traceback.format_exc())
+            response = {'status': 'failed', 'error': str(error)}
+        finally:
+            # Each handler thread has its own scoped database session
+            self.server.client.db_session.remove()
+        self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+
+class BackupServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    '''
+    Unix socket server running cli requests against one warm backup client
+    '''
+    daemon_threads = True
+
+    def __init__(self, socket_path, client, run_request, workers=DEFAULT_SERVER_WORKERS):
+        '''
+        socket_path     :   Path of unix socket
+        client          :   BackupClient kept warm between requests, using a scoped database session
+        run_request     :   Function taking request args and output writer, runs the command
+        workers         :   Number of requests run at the same time
+        '''
+        self.socket_path = Path(socket_path)
+        self.client = client
+        self.run_request = run_request
+        self.slots = threading.BoundedSemaphore(workers)
+        if self.socket_path.is_socket():
+            if socket_listening(self.socket_path):
+                raise BackupToolException(f'Server already running on socket "{str(self.socket_path)}"')
+            # Remove socket left by a server that did not shut down cleanly
+            self.socket_path.unlink()
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        # Socket gives full access to the backup client, only the owner may connect
+        # Created without group and other access, so there is no window before the chmod where others can connect
+        umask = os.umask(0o077)
+        try:
+            super().__init__(str(self.socket_path), RequestHandler)
+        finally:
+            os.umask(umask)
+        os.chmod(self.socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        if self.socket_path.is_socket():
+            self.socket_path.unlink()
+
+def socket_listening(socket_path):
+    '''
+    Return True if a server accepts connections on unix socket
+
+    socket_path     :   Path of unix socket
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        try:
+            connection.connect(str(socket_path))
+        except OSError:
+            return False
+    return True
+
+def server_request_args(args):
+    '''
+    Return request args for the server, None if the command is not run by the server
+
+    args    :   Parsed cli args
+    '''
+    if f'{args.get("module")}_{args.get("command")}' not in SERVER_COMMANDS:
+        return None
+    # Stdin of the thin client cannot be read by the server
+    if args.get('from_file') == '-' or args.get('stdin'):
+        return None
+    request = {key: value for key, value in args.items() if key not in ('general', 'oci', 'settings_file')}
+    for key in PATH_ARGS:
+        value = request.get(key)
+        if isinstance(value, list):
+            request[key] = [os.path.abspath(item) for item in value]
+        elif value:
+            request[key] = os.path.abspath(value)
+    return request
+
+def send_request(socket_path, request, output):
+    '''
+    Send request to server and write its output as it streams back
+    Returns final response dictionary
+    Raises OSError if the server is not running, BackupToolException if the connection fails after the request was sent
+
+    socket_path     :   Path of unix socket
+    request         :   Request args from server_request_args
+    output          :   Writer for command output
+    '''
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(str(socket_path))
+        # Once connected the request may be running, failures must not make the caller run it again
+        try:
+            connection.sendall(json.dumps(request).encode('utf-8') + b'\n')
+            with connection.makefile('rb') as reader:
+                for line in reader:
+                    message = json.loads(line)
+                    if 'stdout' in message:
+                        output.write(message['stdout'])
+                        continue
+                    return message
+        except OSError as error:
+            raise BackupToolException(f'Lost connection to server: {str(error)}') from error
+    raise BackupToolException('Server closed connection without a response')
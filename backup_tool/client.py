@@ -1,23 +1,140 @@
-import uuid
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from contextlib import contextmanager
+import copy
+from itertools import groupby
+import json
 import os
+import random
+import shutil
+from stat import S_IMODE
+import statistics
+from threading import Lock
+import time
+import uuid
 
 from pathlib import Path
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 
 from backup_tool import crypto
 from backup_tool.exception import BackupToolClientException
-from backup_tool.oci_client import OCIObjectStorageClient
-from backup_tool.database import BASE, BackupEntry, BackupEntryLocalFile
+from backup_tool.governor import DEFAULT_MAX_LIMIT
+from backup_tool.metrics import RunMetrics
 from backup_tool import utils
 
-class BackupClient():
+# Database models pull in sqlalchemy, only load them once the database is used
+database = utils.lazy_import('backup_tool.database')
+sqlalchemy = utils.lazy_import('sqlalchemy')
+
+# Number of local file rows checked per batch during cleanup
+CLEANUP_BATCH_SIZE = 1000
+# Default threads used to list directories during cleanup, helps on network filesystems
+DEFAULT_CLEANUP_WORKERS = 8
+# Max ids per bulk delete, keeps under sqlite variable limits
+DELETE_CHUNK_SIZE = 500
+# Number of backup entry rows streamed per batch during verify
+VERIFY_BATCH_SIZE = 1000
+# Default parallel downloads during deep verify
+DEFAULT_VERIFY_WORKERS = 4
+# Write deep verify progress file after this many entries
+VERIFY_PROGRESS_INTERVAL = 100
+# Rows fetched per batch when streaming file and backup lists
+LIST_BATCH_SIZE = 1000
+# Metadata compared to decide a file is unchanged, each policy also compares size
+# mtime     :   Float mtime, coarse but tolerant of filesystems that do not keep nanoseconds
+# mtime_ns  :   Nanosecond mtime
+# inode     :   Nanosecond mtime, inode and device, catches files replaced by another with the same mtime
+# strict    :   Nanosecond mtime and ctime, inode and device, also catches metadata only changes
+METADATA_POLICIES = ['mtime', 'mtime_ns', 'inode', 'strict']
+DEFAULT_METADATA_POLICY = 'mtime_ns'
+# Free bytes kept on the filesystem of the work directory, files whose encrypted copy would cut into it are not staged
+# Opt in, by default only files that do not fit the free space at all are streamed
+DEFAULT_STAGING_RESERVE = 0
+# Files up to this size are encrypted in memory and uploaded with a single put, skipping the work directory
+DEFAULT_SMALL_FILE_THRESHOLD = 256 * 1024
+# Suffix of objects downloaded to the work directory during restore, kept after a failed download so it can be resumed
+DOWNLOAD_SUFFIX = '.download'
+
+class DatabaseUploadState():
+    '''
+    Multipart upload progress recorded in the pending upload tables as it changes, so an interrupted upload only sends missing parts
+    Has the attributes and methods of oci_client.MultipartUploadState, which is not imported so the oci sdk loads on first use
+    '''
+    def __init__(self, session, object_name, encryption_data=None):
+        '''
+        session         :   Database session of the thread uploading
+        object_name     :   Object the upload creates
+        encryption_data :   Encryption data of the uploaded file, recorded so a later backup of the file can resume the upload
+        '''
+        self.session = session
+        self.object_name = object_name
+        self.encryption_data = encryption_data or {}
+        self.pending_upload = session.query(database.PendingUpload).\
+            filter(database.PendingUpload.object_name == object_name).first()
+        self.parts = {}
+        if self.pending_upload:
+            for part in session.query(database.PendingUploadPart).\
+                    filter(database.PendingUploadPart.pending_upload_id == self.pending_upload.id):
+                self.parts[part.part_num] = part.etag
+
+    @property
+    def upload_id(self):
+        '''
+        Multipart upload id, None if no upload was created yet
+        '''
+        return self.pending_upload.upload_id if self.pending_upload else None
+
+    @property
+    def part_size(self):
+        '''
+        Bytes per part the upload was created with
+        '''
+        return self.pending_upload.part_size if self.pending_upload else None
+
+    def started(self, upload_id, part_size):
+        '''
+        Record multipart upload was created
+        '''
+        self.clear()
+        self.pending_upload = database.PendingUpload(object_name=self.object_name,
+                                                     upload_id=upload_id,
+                                                     part_size=part_size,
+                                                     encrypted_file_path=self.encryption_data.get('encrypted_file'),
+                                                     encrypted_md5_checksum=self.encryption_data.get('encrypted_file_md5'),
+                                                     local_file_path=self.encryption_data.get('local_file'),
+                                                     original_md5_checksum=self.encryption_data.get('local_file_md5'),
+                                                     original_size=self.encryption_data.get('local_file_size'),
+                                                     created_time=time.time())
+        self.session.add(self.pending_upload)
+        self.session.commit()
+
+    def part_uploaded(self, part_num, etag):
+        '''
+        Record part was uploaded
+        '''
+        self.session.add(database.PendingUploadPart(pending_upload_id=self.pending_upload.id, part_num=part_num, etag=etag))
+        self.session.commit()
+        self.parts[part_num] = etag
+
+    def clear(self):
+        '''
+        Delete recorded upload, once it is committed or no longer exists
+        '''
+        if self.pending_upload:
+            self.session.query(database.PendingUploadPart).\
+                filter(database.PendingUploadPart.pending_upload_id == self.pending_upload.id).delete()
+            self.session.delete(self.pending_upload)
+            self.session.commit()
+            self.pending_upload = None
+        self.parts = {}
+
+class BackupClient(): #pylint:disable=too-many-public-methods
     '''
     Backup Client
     '''
 
-    def __init__(self, database_file, crypto_key, oci_config_file, oci_config_section, oci_namespace, oci_bucket,
-                 work_directory, logging_file=None, relative_path=None, oci_instance_principal=False):
+    def __init__(self, database_file, crypto_key, oci_config_file, oci_config_section, oci_namespace, oci_bucket, #pylint:disable=too-many-locals
+                 work_directory, logging_file=None, relative_path=None, oci_instance_principal=False,
+                 metadata_policy=None, metadata_policies=None, scoped_session=False, oci_max_concurrency=None, oci_latency_target=None,
+                 staging_budget=None, staging_reserve=None, small_file_threshold=None):
         '''
         Backup Client
 
@@ -42,25 +159,34 @@ class BackupClient():
         The basic idea here is to make moving files between different types of machines easier
 
         oci_instance_principal  : Use instance principal auth for client
+        metadata_policy         : Metadata compared to skip unchanged files, one of METADATA_POLICIES
+        metadata_policies       : Dictionary of path prefix to metadata policy, such as mount points of network filesystems
+                                  The longest matching prefix is used, otherwise metadata_policy
+        scoped_session          : Use a scoped database session, so the client can be used from several threads
+        oci_max_concurrency     : Most object storage requests in flight, the request governor adapts its limit below this
+        oci_latency_target      : Seconds, object storage requests slower than this lower the request governor limit
+        staging_budget          : Most bytes of encrypted files staged in the work directory at the same time, no limit by default
+        staging_reserve         : Free bytes kept on the filesystem of the work directory, files that do not fit are streamed instead, none by default
+        small_file_threshold    : Bytes, files up to this size are encrypted in memory and uploaded with one request, 0 disables
 
         '''
 
         self.logger = utils.setup_logger('backup_client', 10, logging_file=logging_file)
+        self.metrics = RunMetrics()
 
         if database_file is None:
-            database_url = 'sqlite:///'
-            self.logger.debug('Initializing database with no file')
+            self.database_url = 'sqlite:///'
         else:
-            database_url = f'sqlite:///{database_file}'
-            self.logger.debug(f'Initializing database with file: "{database_file}"')
-
-        # Create engine and tables
-        engine = create_engine(database_url)
-        BASE.metadata.create_all(engine)
-
-        # Bind metadata and create session
-        BASE.metadata.bind = engine
-        self.db_session = sessionmaker(bind=engine)()
+            self.database_url = f'sqlite:///{database_file}'
+        # Database and object storage client are created on first use
+        self._db_session = None
+        self._os_client = None
+        self._upload_session = None
+        self._upload_session_lock = Lock()
+        # Object path to its lock and number of threads using it, while it is downloaded to the work directory
+        self._download_locks = {}
+        self._download_locks_lock = Lock()
+        self.scoped_session = scoped_session
 
         self.crypto_key = crypto_key
         self.relative_path = None
@@ -70,12 +196,105 @@ class BackupClient():
         self.work_directory = Path(work_directory)
         if not self.work_directory.exists():
             self.work_directory.mkdir(parents=True)
+        self.staging_budget = staging_budget
+        self.staging_reserve = DEFAULT_STAGING_RESERVE if staging_reserve is None else staging_reserve
+        self.small_file_threshold = DEFAULT_SMALL_FILE_THRESHOLD if small_file_threshold is None else small_file_threshold
 
         self.oci_namespace = oci_namespace
         self.oci_bucket = oci_bucket
+        self.oci_config_file = oci_config_file
+        self.oci_config_section = oci_config_section
+        self.oci_instance_principal = oci_instance_principal
+        self.oci_max_concurrency = oci_max_concurrency or DEFAULT_MAX_LIMIT
+        self.oci_latency_target = oci_latency_target
+
+        self.metadata_policy = metadata_policy or DEFAULT_METADATA_POLICY
+        # Longest prefix first, so the most specific policy wins
+        self.metadata_policies = sorted(((Path(prefix).expanduser(), policy) for prefix, policy in (metadata_policies or {}).items()),
+                                        key=lambda item: len(item[0].parts), reverse=True)
+        for policy in [self.metadata_policy] + [item[1] for item in self.metadata_policies]:
+            if policy not in METADATA_POLICIES:
+                raise BackupToolClientException(f'Invalid metadata policy "{policy}", must be one of {METADATA_POLICIES}')
+
+    @property
+    def db_session(self):
+        '''
+        Database session, created on first use
+        '''
+        if self._db_session is None:
+            self.logger.debug(f'Initializing database with url: "{self.database_url}"')
+            self._db_session = database.create_session(self.database_url, scoped=self.scoped_session)
+        return self._db_session
+
+    @property
+    def upload_session(self):
+        '''
+        Database session for multipart upload state, scoped since uploads run on worker threads
+        None for in memory databases, which do not outlive the process and are separate for each thread
+        '''
+        # Same database name the engine reports, without creating a session on this thread
+        if sqlalchemy.engine.make_url(self.database_url).database in (None, '', ':memory:'):
+            return None
+        if self.scoped_session:
+            return self.db_session
+        # First use can come from several worker threads at once
+        with self._upload_session_lock:
+            if self._upload_session is None:
+                self._upload_session = database.create_thread_sessions(self.db_session)
+        return self._upload_session
+
+    def remove_upload_session(self):
+        '''
+        Close the upload session of the calling thread, worker threads call it once done so their connections are returned
+        '''
+        session = self.upload_session
+        if session is not None:
+            session.remove()
+
+    @property
+    def os_client(self):
+        '''
+        Object storage client, created on first use
+        '''
+        if self._os_client is None:
+            if not (self.oci_namespace and self.oci_bucket):
+                raise BackupToolClientException('Object storage namespace and bucket required for this command')
+            # The oci sdk is slow to import, only load it once object storage is used
+            from backup_tool.oci_client import OCIObjectStorageClient #pylint:disable=import-outside-toplevel
+            self._os_client = OCIObjectStorageClient(self.oci_config_file, self.oci_config_section,
+                                                     instance_principal=self.oci_instance_principal, logger=self.logger,
+                                                     metrics=self.metrics, max_concurrency=self.oci_max_concurrency,
+                                                     latency_target=self.oci_latency_target)
+        return self._os_client
+
+    def warm(self):
+        '''
+        Open database and object storage client ahead of first use, reading the tables checked for every file into the page cache
+        '''
+        self.db_session.query(database.BackupEntryLocalFile.local_file_path).count()
+        self.db_session.query(database.BackupEntry.original_md5_checksum).count()
         if self.oci_namespace and self.oci_bucket:
-            self.os_client = OCIObjectStorageClient(oci_config_file, oci_config_section,
-                                                    instance_principal=oci_instance_principal, logger=self.logger)
+            self.logger.debug(f'Created object storage client {self.os_client}')
+
+    def request_client(self):
+        '''
+        Return client sharing the database, object storage client and locks of this one, with its own run metrics
+        Used by the server, so requests running at the same time do not mix their metrics and run history
+        Object storage requests share the request governor limit, their retries are recorded in the metrics of the request
+        '''
+        client = copy.copy(self)
+        client.metrics = RunMetrics()
+        if self._os_client is not None:
+            client._os_client = self._os_client.with_metrics(client.metrics) #pylint:disable=protected-access
+        return client
+
+    def _local_file_md5(self, local_file_path):
+        '''
+        Get md5 of local file, recording md5 stage metrics
+        '''
+        with self.metrics.time('md5') as observation:
+            observation.size = os.path.getsize(local_file_path)
+            return utils.md5(local_file_path)
 
     def _generate_uuid(self):
         '''
@@ -85,23 +304,26 @@ class BackupClient():
         while True:
             object_path = str(uuid.uuid4())
 
-            existing_path = self.db_session.query(BackupEntry).\
-                    filter(BackupEntry.uploaded_file_path == object_path).first()
+            existing_path = self.db_session.query(database.BackupEntry).\
+                    filter(database.BackupEntry.uploaded_file_path == object_path).first()
             if not existing_path:
                 return object_path
             self.logger.warning(f'UUID "{object_path}" already in use, generating another')
 
-    def file_restore(self, local_file_id, overwrite=False, set_restore=False): #pylint: disable=too-many-return-statements
+    def file_restore(self, local_file_id, overwrite=False, set_restore=False, verify=False, preserve_metadata=False):
         '''
         Restore file from object storage
+        Metadata of the restored file is cached, so the next backup does not hash it again
 
-        local_file_id   :   ID of local file database entry to restore locally
-        overwrite       :   Overwrite local file if md5 does not match
-        set_restore     :   If object is archived, attempt to restore
+        local_file_id       :   ID of local file database entry to restore locally
+        overwrite           :   Overwrite local file if md5 does not match
+        set_restore         :   If object is archived, attempt to restore
+        verify              :   Hash existing local file even if its metadata matches the cache
+        preserve_metadata   :   Reapply mode and mtime the file had at backup time
         '''
         self.logger.info(f'Restoring local file: {local_file_id}')
 
-        local_file = self.db_session.get(BackupEntryLocalFile, local_file_id)
+        local_file = self.db_session.get(database.BackupEntryLocalFile, local_file_id)
         if not local_file:
             self.logger.error(f'Unable to find local file: {local_file_id}')
             return False
@@ -110,50 +332,279 @@ class BackupClient():
             self.logger.error(f'No backup entry for local file: {local_file_id}')
             return False
 
-        backup_entry = self.db_session.get(BackupEntry, local_file.backup_entry_id)
+        backup_entry = self.db_session.get(database.BackupEntry, local_file.backup_entry_id)
 
         if not backup_entry:
             self.logger.error(f'Expecting backup entry {local_file.backup_entry_id} does not exist')
 
-        local_file_path = Path(local_file.local_file_path)
-        if self.relative_path:
-            local_file_path = self.relative_path / local_file_path
+        local_file_path = self._local_file_full_path(local_file)
+
+        restored = (not overwrite and self._local_file_restored(local_file_path, backup_entry, local_file=local_file, verify=verify)) or \
+            (local_file.hardlink_local_file_id and
+             self._file_restore_hardlink(local_file, local_file_path, backup_entry, verify=verify)) or \
+            self._file_restore_download(backup_entry, local_file_path, set_restore)
+        if not restored:
+            return False
+        with self.metrics.time('db'):
+            self._set_restored_metadata(local_file, local_file_path, preserve_metadata)
+            self.db_session.commit()
+        return True
 
-        if local_file_path.is_file():
-            self.logger.debug(f'Checking local file "{str(local_file_path)}" md5')
-            local_file_md5 = utils.md5(str(local_file_path))
-            self.logger.debug(f'Local file "{str(local_file_path)}" has md5 sum {local_file_md5}')
-            if backup_entry.original_md5_checksum == local_file_md5:
-                if not overwrite:
-                    self.logger.info(f'Local file "{str(local_file_path)}" has expected md5 {local_file_md5}')
-                    return True
-
-        # Write file to temp dir
-        with utils.temp_file(self.work_directory) as encrypted_file:
+    def _set_restored_metadata(self, local_file, local_file_path, preserve_metadata):
+        '''
+        Reapply original mode and mtime to a restored file if requested, then cache its metadata so the next backup skips it
+        Does not commit
+
+        local_file          :   Local file database entry
+        local_file_path     :   Full local path of restored file
+        preserve_metadata   :   Reapply mode and mtime captured at backup time
+        '''
+        try:
+            if preserve_metadata:
+                if local_file.original_mode is not None:
+                    os.chmod(local_file_path, local_file.original_mode)
+                if local_file.original_mtime_ns is not None:
+                    os.utime(local_file_path, ns=(os.stat(local_file_path).st_atime_ns, local_file.original_mtime_ns))
+            self._set_cached_metadata(local_file, os.stat(local_file_path), original=False)
+        except OSError as error:
+            self.logger.warning(f'Unable to set metadata of restored file "{str(local_file_path)}": {str(error)}')
+
+    def _local_file_restored(self, local_file_path, backup_entry, local_file=None, verify=False):
+        '''
+        Return True if local file already exists with the md5 of backup entry
+        Files whose metadata matches the cache of local file are trusted without reading them, unless verify
+
+        local_file_path :   Full local path
+        backup_entry    :   Backup entry the local file points to
+        local_file      :   Local file database entry with cached metadata
+        verify          :   Always compare md5
+        '''
+        if not local_file_path.is_file():
+            return False
+        if local_file is not None and not verify:
+            try:
+                with self.metrics.time('stat'):
+                    stat = os.stat(local_file_path)
+            except OSError:
+                stat = None
+            if stat and self._metadata_matches(stat, local_file, self._get_metadata_policy(local_file_path)):
+                self.logger.info(f'Local file "{str(local_file_path)}" metadata matches cache, skipping md5')
+                self.metrics.increment('skip', files=1)
+                return True
+        self.logger.debug(f'Checking local file "{str(local_file_path)}" md5')
+        local_file_md5 = self._local_file_md5(str(local_file_path))
+        self.logger.debug(f'Local file "{str(local_file_path)}" has md5 sum {local_file_md5}')
+        if backup_entry.original_md5_checksum != local_file_md5:
+            return False
+        self.logger.info(f'Local file "{str(local_file_path)}" has expected md5 {local_file_md5}')
+        return True
+
+    def _file_restore_download(self, backup_entry, local_file_path, set_restore):
+        '''
+        Download and decrypt object of backup entry to local path, returns False if it could not be restored
+
+        backup_entry    :   Backup entry to restore
+        local_file_path :   Full local path to write
+        set_restore     :   If object is archived, attempt to restore
+        '''
+        with self._download_lock(backup_entry.uploaded_file_path):
+            # Named after the object, so a download interrupted by an error is resumed by the next restore of it
+            encrypted_file = self.work_directory / f'{backup_entry.uploaded_file_path}{DOWNLOAD_SUFFIX}'
             self.logger.info(f'Downloading object {backup_entry.uploaded_file_path} to temp file "{str(encrypted_file)}"')
-            self.os_client.object_get(self.oci_namespace, self.oci_bucket,
-                                      backup_entry.uploaded_file_path, str(encrypted_file), set_restore=set_restore)
+            with self.metrics.time('download') as observation:
+                downloaded = self.os_client.object_get(self.oci_namespace, self.oci_bucket,
+                                                       backup_entry.uploaded_file_path, str(encrypted_file), set_restore=set_restore)
+                observation.size = encrypted_file.stat().st_size if encrypted_file.exists() else 0
+            if not downloaded:
+                return False
             self.logger.info(f'Downloaded of object {backup_entry.uploaded_file_path} complete, written to temp file "{str(encrypted_file)}"')
 
-            # Ensure dir of new decrypted file is created
-            if not local_file_path.parent.exists():
-                local_file_path.mkdir(parents=True)
-            self.logger.debug(f'Decrypting temp file "{str(encrypted_file)}" to file "{str(local_file_path)}"')
-            encrypted_file_md5, local_file_md5 = crypto.decrypt_file(str(encrypted_file),
-                                                                     str(local_file_path),
-                                                                     self.crypto_key)
-            self.logger.debug(f'Decrypted file "{str(encrypted_file)}" with md5 "{encrypted_file_md5}" to '
-                              f'file "{str(local_file_path)}" with md5 "{local_file_md5}"')
-            if backup_entry.uploaded_md5_checksum != encrypted_file_md5:
-                self.logger.error(f'Downloaded file "{str(encrypted_file)}" has unexpected md5 {encrypted_file_md5}, '
-                                  f'expected {backup_entry.uploaded_md5_checksum}')
-                return False
+            try:
+                # Ensure dir of new decrypted file is created
+                if not local_file_path.parent.exists():
+                    local_file_path.parent.mkdir(parents=True)
+                self.logger.debug(f'Decrypting temp file "{str(encrypted_file)}" to file "{str(local_file_path)}"')
+                with self.metrics.time('decrypt') as observation:
+                    encrypted_file_md5, local_file_md5 = crypto.decrypt_file(str(encrypted_file),
+                                                                             str(local_file_path),
+                                                                             self.crypto_key)
+                    observation.size = local_file_path.stat().st_size
+            finally:
+                encrypted_file.unlink(missing_ok=True)
+        self.logger.debug(f'Decrypted file "{str(encrypted_file)}" with md5 "{encrypted_file_md5}" to '
+                          f'file "{str(local_file_path)}" with md5 "{local_file_md5}"')
+        if backup_entry.uploaded_md5_checksum != encrypted_file_md5:
+            self.logger.error(f'Downloaded file "{str(encrypted_file)}" has unexpected md5 {encrypted_file_md5}, '
+                              f'expected {backup_entry.uploaded_md5_checksum}')
+            return False
 
-            if local_file_md5 != backup_entry.original_md5_checksum:
-                self.logger.error(f'MD5 {local_file_md5} of decrypted file "{str(local_file_path)}" does not match expected {backup_entry.original_md5_checksum}')
-                return False
+        if local_file_md5 != backup_entry.original_md5_checksum:
+            self.logger.error(f'MD5 {local_file_md5} of decrypted file "{str(local_file_path)}" does not match expected {backup_entry.original_md5_checksum}')
+            return False
         return True
 
+    @contextmanager
+    def _download_lock(self, object_path):
+        '''
+        Hold lock of object path while it is downloaded to the work directory
+        Restores of the same object from other threads, such as server requests, wait instead of writing the same file
+
+        object_path :   Object path being downloaded
+        '''
+        with self._download_locks_lock:
+            lock, users = self._download_locks.get(object_path, (Lock(), 0))
+            self._download_locks[object_path] = (lock, users + 1)
+        try:
+            with lock:
+                yield
+        finally:
+            with self._download_locks_lock:
+                lock, users = self._download_locks.pop(object_path)
+                if users > 1:
+                    self._download_locks[object_path] = (lock, users - 1)
+
+    def _local_file_full_path(self, local_file):
+        '''
+        Full local path of local file database entry
+        '''
+        local_file_path = Path(local_file.local_file_path)
+        if self.relative_path:
+            local_file_path = self.relative_path / local_file_path
+        return local_file_path
+
+    def _file_restore_hardlink(self, local_file, local_file_path, backup_entry, verify=False):
+        '''
+        Restore local file as a hardlink of the file it was linked to at backup time, instead of writing the data again
+        Only links to a file that is already there with the expected md5, files that were not asked for are never restored
+        Returns False if the link cannot be made, so the file is restored normally
+
+        local_file          :   Local file database entry, with hardlink_local_file_id set
+        local_file_path     :   Full path to restore to
+        backup_entry        :   Backup entry of local file
+        verify              :   Hash existing link target even if its metadata matches the cache
+        '''
+        link_file = self.db_session.get(database.BackupEntryLocalFile, local_file.hardlink_local_file_id)
+        # Only link if both still have the same content
+        if not link_file or link_file.id == local_file.id or link_file.backup_entry_id != local_file.backup_entry_id:
+            return False
+        link_file_path = self._local_file_full_path(link_file)
+        if not self._local_file_restored(link_file_path, backup_entry, local_file=link_file, verify=verify):
+            self.logger.debug(f'Link target "{str(link_file_path)}" of "{str(local_file_path)}" does not have the expected content')
+            return False
+        try:
+            local_file_path.parent.mkdir(parents=True, exist_ok=True)
+            if local_file_path.exists():
+                local_file_path.unlink()
+            os.link(link_file_path, local_file_path)
+        except OSError as error:
+            self.logger.warning(f'Unable to hardlink "{str(local_file_path)}" to "{str(link_file_path)}", restoring data instead: {str(error)}')
+            return False
+        self.logger.info(f'Restored local file "{str(local_file_path)}" as hardlink of "{str(link_file_path)}"')
+        return True
+
+    def directory_restore(self, path_prefix=None, overwrite=False, set_restore=False, hardlink=False, verify=False, #pylint:disable=too-many-locals
+                          preserve_metadata=False):
+        '''
+        Restore all local files, or those under a path prefix, downloading and decrypting each backup entry once
+        Other local files sharing the backup entry are copied from the first one restored, with a reflink where the filesystem supports it
+        Returns counts of files restored per method
+
+        path_prefix         :   Only restore files with local path starting with prefix
+        overwrite           :   Restore files even if they already have the expected md5
+        set_restore         :   If object is archived, attempt to restore
+        hardlink            :   Hardlink files sharing a backup entry instead of copying them
+        verify              :   Hash existing local files even if their metadata matches the cache
+        preserve_metadata   :   Reapply mode and mtime files had at backup time
+        '''
+        local_file_model = database.BackupEntryLocalFile
+        backup_entry_model = database.BackupEntry
+        prefix_filters = []
+        if path_prefix:
+            prefix_filters.append(local_file_model.local_file_path >= path_prefix)
+            upper_bound = utils.prefix_upper_bound(path_prefix)
+            if upper_bound is not None:
+                prefix_filters.append(local_file_model.local_file_path < upper_bound)
+
+        counts = {'downloaded': 0, 'reflink': 0, 'copy_file_range': 0, 'copy': 0, 'hardlink': 0, 'skipped': 0, 'failed': 0}
+        last_backup_entry_id = None
+        while True:
+            # Batches of whole backup entries, committed once per batch, so memory stays bounded and all links of an entry are in one batch
+            entry_query = self.db_session.query(local_file_model.backup_entry_id).distinct().\
+                filter(local_file_model.backup_entry_id.isnot(None), *prefix_filters)
+            if last_backup_entry_id is not None:
+                entry_query = entry_query.filter(local_file_model.backup_entry_id > last_backup_entry_id)
+            backup_entry_ids = [row[0] for row in entry_query.order_by(local_file_model.backup_entry_id).limit(LIST_BATCH_SIZE)]
+            if not backup_entry_ids:
+                break
+            last_backup_entry_id = backup_entry_ids[-1]
+            rows = self.db_session.query(local_file_model, backup_entry_model).\
+                join(backup_entry_model, local_file_model.backup_entry_id == backup_entry_model.id).\
+                filter(local_file_model.backup_entry_id.in_(backup_entry_ids), *prefix_filters).\
+                order_by(local_file_model.backup_entry_id, local_file_model.id).all()
+            for _backup_entry_id, entry_rows in groupby(rows, key=lambda row: row[1].id):
+                entry_rows = list(entry_rows)
+                self._directory_restore_entry(entry_rows[0][1], [row[0] for row in entry_rows], counts,
+                                              overwrite, set_restore, hardlink, verify, preserve_metadata)
+            # Restored files and their cached metadata are committed together
+            with self.metrics.time('db'):
+                self.db_session.commit()
+        self.logger.info(f'Restored files: {counts}')
+        return counts
+
+    def _directory_restore_entry(self, backup_entry, local_files, counts, overwrite, set_restore, hardlink, verify, #pylint:disable=too-many-locals
+                                 preserve_metadata):
+        '''
+        Restore every local file of one backup entry, downloading it at most once
+        Sets metadata of restored files, does not commit
+        '''
+        paths = {local_file.id: self._local_file_full_path(local_file) for local_file in local_files}
+        # Files already on disk with the right content, the first one is the source for the others
+        restored = {}
+        if not overwrite:
+            for local_file in local_files:
+                if self._local_file_restored(paths[local_file.id], backup_entry, local_file=local_file, verify=verify):
+                    restored[local_file.id] = paths[local_file.id]
+                    counts['skipped'] += 1
+        pending = [local_file for local_file in local_files if local_file.id not in restored]
+        if pending and not restored:
+            first = pending.pop(0)
+            if not self._file_restore_download(backup_entry, paths[first.id], set_restore):
+                counts['failed'] += 1 + len(pending)
+                return
+            restored[first.id] = paths[first.id]
+            counts['downloaded'] += 1
+        source_path = next(iter(restored.values()))
+        for local_file in pending:
+            local_file_path = paths[local_file.id]
+            # Links made at backup time are restored as links, if the file they pointed to is restored
+            link_path = restored.get(local_file.hardlink_local_file_id) if local_file.hardlink_local_file_id else None
+            if hardlink and link_path is None:
+                link_path = source_path
+            try:
+                local_file_path.parent.mkdir(parents=True, exist_ok=True)
+                if local_file_path.is_symlink() or local_file_path.exists():
+                    local_file_path.unlink()
+                method = None
+                if link_path is not None:
+                    try:
+                        os.link(link_path, local_file_path)
+                        method = 'hardlink'
+                    except OSError as error:
+                        self.logger.warning(f'Unable to hardlink "{str(local_file_path)}" to "{str(link_path)}", copying instead: {str(error)}')
+                if method is None:
+                    with self.metrics.time('copy', size=source_path.stat().st_size):
+                        method = utils.copy_file(source_path, local_file_path)
+            except OSError as error:
+                self.logger.error(f'Unable to restore local file "{str(local_file_path)}" from "{str(source_path)}": {str(error)}')
+                counts['failed'] += 1
+                continue
+            self.logger.info(f'Restored local file "{str(local_file_path)}" from "{str(source_path)}" with {method}')
+            restored[local_file.id] = local_file_path
+            counts[method] += 1
+        for local_file in local_files:
+            if local_file.id in restored:
+                self._set_restored_metadata(local_file, restored[local_file.id], preserve_metadata)
+
     def file_md5(self, local_file):
         '''
         Get md5sum of local file
@@ -186,43 +637,104 @@ class BackupClient():
                          f'to output file "{local_output_file}" with md5 {decrypted_md5}')
         return {'original_md5': original_md5, 'decrypted_md5': decrypted_md5}
 
+    def _get_metadata_policy(self, local_file_path):
+        '''
+        Metadata policy of file, from the longest matching path prefix
+        '''
+        for prefix, policy in self.metadata_policies:
+            if Path(local_file_path).is_relative_to(prefix):
+                return policy
+        return self.metadata_policy
+
+    def _metadata_matches(self, stat, local_backup_file, policy):
+        '''
+        Check stat result against cached metadata with policy
+        Returns True if metadata matches
+        '''
+        if local_backup_file.cached_size is None or stat.st_size != local_backup_file.cached_size:
+            return False
+        # Entries cached before nanosecond columns existed fall back to the float mtime
+        if policy == 'mtime' or local_backup_file.cached_mtime_ns is None:
+            return local_backup_file.cached_mtime is not None and stat.st_mtime == local_backup_file.cached_mtime
+        if stat.st_mtime_ns != local_backup_file.cached_mtime_ns:
+            return False
+        if policy in ('inode', 'strict'):
+            if utils.sqlite_integer(stat.st_ino) != local_backup_file.cached_inode or \
+                    utils.sqlite_integer(stat.st_dev) != local_backup_file.cached_dev:
+                return False
+        if policy == 'strict' and stat.st_ctime_ns != local_backup_file.cached_ctime_ns:
+            return False
+        return True
+
     def _check_metadata_changed(self, local_file_path, local_backup_file):
         '''
-        Check if file metadata (mtime, size) has changed
+        Check if file metadata has changed, compared depending on the metadata policy of the path
         Returns True if metadata changed, False if unchanged
         '''
         try:
-            stat = os.stat(local_file_path)
-            current_mtime = stat.st_mtime
-            current_size = stat.st_size
-
-            # If we have cached metadata and it matches, file hasn't changed
-            if (local_backup_file.cached_mtime is not None and
-                local_backup_file.cached_size is not None):
-                if (current_mtime == local_backup_file.cached_mtime and
-                    current_size == local_backup_file.cached_size):
-                    self.logger.debug(f'File metadata unchanged (mtime={current_mtime}, size={current_size})')
-                    return False
-                self.logger.debug(f'File metadata changed - cached: (mtime={local_backup_file.cached_mtime}, size={local_backup_file.cached_size}), '
-                                f'current: (mtime={current_mtime}, size={current_size})')
-            else:
-                self.logger.debug('No cached metadata available')
-
-            return True
+            with self.metrics.time('stat'):
+                stat = os.stat(local_file_path)
         except OSError as e:
             self.logger.warning(f'Unable to stat file {local_file_path}: {e}')
             return True
 
-    def _update_metadata_cache(self, local_file_path, local_backup_file):
+        if local_backup_file.cached_mtime is None and local_backup_file.cached_mtime_ns is None:
+            self.logger.debug('No cached metadata available')
+            return True
+
+        policy = self._get_metadata_policy(local_file_path)
+        if not self._metadata_matches(stat, local_backup_file, policy):
+            self.logger.debug(f'File metadata changed with policy {policy} - cached: (mtime_ns={local_backup_file.cached_mtime_ns}, '
+                              f'mtime={local_backup_file.cached_mtime}, size={local_backup_file.cached_size}), '
+                              f'current: (mtime_ns={stat.st_mtime_ns}, size={stat.st_size})')
+            return True
+
+        self.logger.debug(f'File metadata unchanged with policy {policy} (mtime_ns={stat.st_mtime_ns}, size={stat.st_size})')
+        if local_backup_file.cached_mtime_ns is None or local_backup_file.original_mode is None:
+            # Upgrade entry cached before nanosecond and original metadata columns existed, so later runs use the stronger comparison
+            with self.metrics.time('db'):
+                self._set_cached_metadata(local_backup_file, stat)
+                self.db_session.commit()
+        return False
+
+    def _set_cached_metadata(self, local_backup_file, stat, original=True):
+        '''
+        Set cached metadata columns of entry from stat result, does not commit
+
+        original    :   Also record mode and mtime as the original metadata, false for restored files
+        '''
+        if original:
+            local_backup_file.original_mode = S_IMODE(stat.st_mode)
+            local_backup_file.original_mtime_ns = stat.st_mtime_ns
+        local_backup_file.cached_mtime = stat.st_mtime
+        local_backup_file.cached_size = stat.st_size
+        local_backup_file.cached_mtime_ns = stat.st_mtime_ns
+        local_backup_file.cached_ctime_ns = stat.st_ctime_ns
+        local_backup_file.cached_inode = utils.sqlite_integer(stat.st_ino)
+        local_backup_file.cached_dev = utils.sqlite_integer(stat.st_dev)
+
+    def _update_metadata_cache(self, local_file_path, local_backup_file, local_file_md5=None):
         '''
         Update cached metadata for a file
+        The cache is trusted to mean the file has the content of its backup entry, so restores can skip it
+        If local file md5 is given and does not match the backup entry, such as a change ignored without overwrite, it is cleared instead
         '''
+        if local_file_md5 is not None:
+            backup_entry = self.db_session.get(database.BackupEntry, local_backup_file.backup_entry_id) \
+                if local_backup_file.backup_entry_id else None
+            if not backup_entry or backup_entry.original_md5_checksum != local_file_md5:
+                with self.metrics.time('db'):
+                    for column in ['cached_mtime', 'cached_size', 'cached_mtime_ns', 'cached_ctime_ns', 'cached_inode', 'cached_dev']:
+                        setattr(local_backup_file, column, None)
+                    self.db_session.commit()
+                self.logger.debug(f'Cleared metadata cache for "{local_file_path}", its content does not match its backup entry')
+                return
         try:
             stat = os.stat(local_file_path)
-            local_backup_file.cached_mtime = stat.st_mtime
-            local_backup_file.cached_size = stat.st_size
-            self.db_session.commit()
-            self.logger.info(f'Cached metadata for "{local_file_path}" (mtime={stat.st_mtime}, size={stat.st_size})')
+            with self.metrics.time('db'):
+                self._set_cached_metadata(local_backup_file, stat)
+                self.db_session.commit()
+            self.logger.info(f'Cached metadata for "{local_file_path}" (mtime_ns={stat.st_mtime_ns}, size={stat.st_size})')
         except OSError as e:
             self.logger.warning(f'Unable to update metadata cache for {local_file_path}: {e}')
 
@@ -231,8 +743,8 @@ class BackupClient():
         Local backup of file exists
         '''
         self.logger.debug(f'Found existing local file: {local_backup_file.id}')
-        same_md5_backup_entry = self.db_session.query(BackupEntry).\
-                                    filter(BackupEntry.original_md5_checksum == local_file_md5).first()
+        same_md5_backup_entry = self.db_session.query(database.BackupEntry).\
+                                    filter(database.BackupEntry.original_md5_checksum == local_file_md5).first()
 
         # Check if backup entry already exists with checked md5, if so exit
         if not local_backup_file.backup_entry_id:
@@ -245,7 +757,7 @@ class BackupClient():
             return True
 
         # Check if backup entry matches local file
-        backup_entry = self.db_session.get(BackupEntry, local_backup_file.backup_entry_id)
+        backup_entry = self.db_session.get(database.BackupEntry, local_backup_file.backup_entry_id)
         if backup_entry.original_md5_checksum == local_file_md5:
             self.logger.debug(f'Local backup file {local_backup_file.id} still has same md5 as {backup_entry.id}')
             return False
@@ -264,31 +776,110 @@ class BackupClient():
         self.db_session.commit()
         return True
 
-    def _file_backup_ensure_database_entry(self, local_file_path, local_file_md5, overwrite):
+    def _get_local_file_entry(self, local_file_path):
+        '''
+        Get local file database entry of full local path, None if there is none
+        '''
         relative_file_path = local_file_path
         if self.relative_path:
             relative_file_path = local_file_path.relative_to(self.relative_path)
-            self.logger.debug(f'Using relative path for database "{str(relative_file_path)}"')
-        local_backup_file = self.db_session.query(BackupEntryLocalFile).\
-            filter(BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
-        if local_backup_file:
-            return self._check_backup_file_exists(local_backup_file, local_file_md5, overwrite), local_backup_file
-
-        self.logger.debug(f'No existing local file found for path: "{str(local_file_path)}"')
-        backup_file_args = {
-            'local_file_path': str(relative_file_path),
-        }
+        return self.db_session.query(database.BackupEntryLocalFile).\
+            filter(database.BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
 
-        local_backup_file = BackupEntryLocalFile(**backup_file_args)
-        self.db_session.add(local_backup_file)
-        self.db_session.commit()
-        self.logger.info(f'Created database entry {local_backup_file.id} for local file "{str(relative_file_path)}"')
-        return True, local_backup_file
+    def _file_backup_hardlink(self, local_file_path, link_local_file_id, link_backup_entry_id):
+        '''
+        Record local file as a hardlink of a file already backed up in this run, without reading its data
+
+        local_file_path         :   Full path of local file
+        link_local_file_id      :   Local file entry id of first link found with the same inode
+        link_backup_entry_id    :   Backup entry of the first link
+        '''
+        with self.metrics.time('db'):
+            local_backup_file = self._get_local_file_entry(local_file_path)
+            if not local_backup_file:
+                relative_file_path = local_file_path
+                if self.relative_path:
+                    relative_file_path = local_file_path.relative_to(self.relative_path)
+                local_backup_file = database.BackupEntryLocalFile(local_file_path=str(relative_file_path))
+                self.db_session.add(local_backup_file)
+            local_backup_file.backup_entry_id = link_backup_entry_id
+            local_backup_file.hardlink_local_file_id = link_local_file_id
+            self.db_session.commit()
+        self.logger.debug(f'Local file "{str(local_file_path)}" is a hardlink of local file {link_local_file_id}, '
+                          f'using backup entry {link_backup_entry_id}')
+        self.metrics.increment('skip', files=1)
+        self._update_metadata_cache(local_file_path, local_backup_file)
+        return local_backup_file
+
+    def _file_backup_detect_rename(self, local_file_path):
+        '''
+        Find entry of a vanished local file with the same device, inode, size and nanosecond mtime, and move it to the new path
+        Avoids hashing and uploading renamed files again
+        Returns moved entry, None if the file is not a rename
+
+        local_file_path     :   Full path of local file without a database entry
+        '''
+        try:
+            stat = os.stat(local_file_path)
+        except OSError:
+            return None
+        model = database.BackupEntryLocalFile
+        with self.metrics.time('db'):
+            candidates = self.db_session.query(model).\
+                filter(model.cached_inode == utils.sqlite_integer(stat.st_ino)).\
+                filter(model.cached_dev == utils.sqlite_integer(stat.st_dev)).\
+                filter(model.cached_size == stat.st_size).\
+                filter(model.cached_mtime_ns == stat.st_mtime_ns).\
+                filter(model.backup_entry_id.isnot(None)).all()
+        for local_backup_file in candidates:
+            previous_path = self._local_file_full_path(local_backup_file)
+            # Previous path still there means a hardlink or a copy preserving metadata, not a rename
+            if os.path.lexists(previous_path):
+                continue
+            relative_file_path = local_file_path
+            if self.relative_path:
+                relative_file_path = Path(local_file_path).relative_to(self.relative_path)
+            with self.metrics.time('db'):
+                local_backup_file.local_file_path = str(relative_file_path)
+                # Rename changes ctime
+                self._set_cached_metadata(local_backup_file, stat)
+                self.db_session.commit()
+            self.logger.info(f'Local file "{str(previous_path)}" moved to "{str(local_file_path)}", '
+                             f'moved entry {local_backup_file.id} without reading data')
+            self.metrics.increment('rename', files=1)
+            self.metrics.increment('skip', files=1)
+            return local_backup_file
+        return None
+
+    def _file_backup_ensure_database_entry(self, local_file_path, local_file_md5, overwrite):
+        with self.metrics.time('db'):
+            relative_file_path = local_file_path
+            if self.relative_path:
+                relative_file_path = local_file_path.relative_to(self.relative_path)
+                self.logger.debug(f'Using relative path for database "{str(relative_file_path)}"')
+            local_backup_file = self.db_session.query(database.BackupEntryLocalFile).\
+                filter(database.BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
+            if local_backup_file:
+                return self._check_backup_file_exists(local_backup_file, local_file_md5, overwrite), local_backup_file
+
+            self.logger.debug(f'No existing local file found for path: "{str(local_file_path)}"')
+            backup_file_args = {
+                'local_file_path': str(relative_file_path),
+            }
+
+            local_backup_file = database.BackupEntryLocalFile(**backup_file_args)
+            self.db_session.add(local_backup_file)
+            self.db_session.commit()
+            self.logger.info(f'Created database entry {local_backup_file.id} for local file "{str(relative_file_path)}"')
+            return True, local_backup_file
 
     def _file_backup_encrypt(self, local_file_path, local_file_md5):
         with utils.temp_file(self.work_directory, delete=False) as encrypted_file:
             self.logger.debug(f'Creating encrypted file "{str(encrypted_file)}" from file "{str(local_file_path)}"')
-            check_local_file_md5, encrypted_file_md5 = crypto.encrypt_file(str(local_file_path), str(encrypted_file), self.crypto_key)
+            local_file_size = os.path.getsize(local_file_path)
+            with self.metrics.time('encrypt') as observation:
+                check_local_file_md5, encrypted_file_md5 = crypto.encrypt_file(str(local_file_path), str(encrypted_file), self.crypto_key)
+                observation.size = encrypted_file.stat().st_size
             if check_local_file_md5 != local_file_md5:
                 self.logger.error(f'Unable to verify md5 during crypto phase for file "{str(local_file_path)}"')
                 raise BackupToolClientException(f'Unable to verify md5 during crypto phase for file "{str(local_file_path)}"')
@@ -297,32 +888,224 @@ class BackupClient():
             return {
                 'local_file': str(local_file_path),
                 'local_file_md5': local_file_md5,
+                'local_file_size': local_file_size,
                 'encrypted_file': str(encrypted_file),
                 'encrypted_file_md5': encrypted_file_md5,
             }
 
-    def _file_backup_upload(self, encrypted_file, local_encrypted_file_md5, original_md5_checksum, local_backup_file, object_path=None, resume_upload=False):
+    def _staging_space(self):
+        '''
+        Bytes that can be staged in the work directory, free space above the reserve
+        '''
+        return shutil.disk_usage(self.work_directory).free - self.staging_reserve
+
+    def _staging_decision(self, local_file_size, staged=0, unwritten=0):
+        '''
+        Return "memory" if file is small enough to encrypt in memory, "stage" if an encrypted copy of file fits the staging budget and
+        free space now, "wait" if it fits once staged files are done, or "stream" if it never fits, so it should be encrypted while uploaded
+
+        local_file_size :   Size of file to encrypt
+        staged          :   Bytes reserved for encrypted files staged now
+        unwritten       :   Bytes of those still being written, not yet taken from free space
+        '''
+        if local_file_size <= self.small_file_threshold:
+            return 'memory'
+        needed = crypto.encrypted_size(local_file_size)
+        space = self._staging_space()
+        over_budget = self.staging_budget is not None and staged + needed > self.staging_budget
+        # Space freed once staged files are uploaded and deleted
+        if (self.staging_budget is not None and needed > self.staging_budget) or needed > space + staged - unwritten:
+            return 'stream'
+        if over_budget or needed > space - unwritten:
+            return 'wait'
+        return 'stage'
+
+    def _file_backup_put_memory(self, local_file_path, local_file_md5, object_path):
+        '''
+        Encrypt small local file in memory and upload it to object path with one request
+        Does not use the database session, so can run on worker threads
+        Returns encryption data like _file_backup_encrypt, with no encrypted file
+        '''
+        self.logger.debug(f'Uploading file "{str(local_file_path)}" encrypted in memory to object path {object_path}')
+        with self.metrics.time('encrypt') as observation:
+            with open(local_file_path, 'rb') as reader:
+                data = reader.read()
+            encrypted, check_local_file_md5, encrypted_md5 = crypto.encrypt_bytes(data, self.crypto_key)
+            observation.size = len(encrypted)
+        if check_local_file_md5 != local_file_md5:
+            self.logger.error(f'Unable to verify md5 during crypto phase for file "{str(local_file_path)}"')
+            raise BackupToolClientException(f'Unable to verify md5 during crypto phase for file "{str(local_file_path)}"')
+        with self.metrics.time('upload', size=len(encrypted)):
+            self.os_client.object_put_bytes(self.oci_namespace, self.oci_bucket, object_path, encrypted, md5_sum=encrypted_md5)
+        return {
+            'local_file': str(local_file_path),
+            'local_file_md5': local_file_md5,
+            'local_file_size': len(data),
+            'encrypted_file': None,
+            'encrypted_file_md5': encrypted_md5,
+        }
+
+    def _file_backup_put_stream(self, local_file_path, local_file_md5, object_path):
+        '''
+        Encrypt local file while uploading it to object path, without staging the encrypted copy in the work directory
+        Does not use the database session, so can run on worker threads
+        Returns encryption data like _file_backup_encrypt, with no encrypted file
+        '''
+        self.logger.info(f'Streaming encrypted upload of file "{str(local_file_path)}" to object path {object_path}, it does not fit staging space')
+        with open(local_file_path, 'rb') as reader:
+            encrypting_reader = crypto.EncryptingReader(reader, self.crypto_key)
+            with self.metrics.time('upload') as observation:
+                self.os_client.object_put_stream(self.oci_namespace, self.oci_bucket, object_path, encrypting_reader)
+                observation.size = encrypting_reader.encrypted_size
+        self.metrics.increment('encrypt', files=1, size=encrypting_reader.original_size)
+        if encrypting_reader.original_md5 != local_file_md5:
+            # File changed after it was hashed, the object does not hold the content the database would record
+            self.os_client.object_delete(self.oci_namespace, self.oci_bucket, object_path)
+            raise BackupToolClientException(f'Unable to verify md5 during crypto phase for file "{str(local_file_path)}"')
+        return {
+            'local_file': str(local_file_path),
+            'local_file_md5': local_file_md5,
+            'local_file_size': encrypting_reader.original_size,
+            'encrypted_file': None,
+            'encrypted_file_md5': encrypting_reader.encrypted_md5,
+        }
+
+    def _file_backup_upload(self, encrypted_file, local_encrypted_file_md5, original_md5_checksum, local_backup_file, object_path=None, resume_upload=False,
+                            original_size=None, encryption_data=None):
         object_path = object_path or self._generate_uuid()
-        self.logger.debug(f'Uploading encrypted file "{str(encrypted_file)}" to object path {object_path}')
-        self.os_client.object_put(self.oci_namespace, self.oci_bucket, object_path, str(encrypted_file),
-                                  md5_sum=local_encrypted_file_md5, resume_upload=resume_upload)
+        self._file_backup_put(encrypted_file, local_encrypted_file_md5, object_path, resume_upload=resume_upload, encryption_data=encryption_data)
+        return self._file_backup_finalize(encrypted_file, object_path, local_encrypted_file_md5, original_md5_checksum, local_backup_file,
+                                          original_size=original_size)
 
+    def _file_backup_put(self, encrypted_file, local_encrypted_file_md5, object_path, resume_upload=False, encryption_data=None):
+        '''
+        Upload encrypted file to object path, recording multipart upload progress so an interrupted upload only sends missing parts
+        Only uses the upload session, so can run on worker threads
+        '''
+        self.logger.debug(f'Uploading encrypted file "{str(encrypted_file)}" to object path {object_path}')
+        upload_state = None
+        if self.upload_session is not None:
+            upload_state = DatabaseUploadState(self.upload_session, object_path, encryption_data=encryption_data)
+        with self.metrics.time('upload', size=os.path.getsize(encrypted_file)):
+            self.os_client.object_put(self.oci_namespace, self.oci_bucket, object_path, str(encrypted_file),
+                                      md5_sum=local_encrypted_file_md5, resume_upload=resume_upload, upload_state=upload_state)
+
+    def _file_backup_pending_upload(self, local_file_path, local_file_md5):
+        '''
+        Return encryption data and object path of an interrupted upload of local file, or None for both if there is none to resume
+        Pending uploads of other content of the file, or whose encrypted file is gone, are discarded
+        '''
+        if self.upload_session is None:
+            return None, None
+        encryption_data, object_path = None, None
+        pending_uploads = self.upload_session.query(database.PendingUpload).\
+            filter(database.PendingUpload.local_file_path == str(local_file_path)).all()
+        for pending_upload in pending_uploads:
+            if encryption_data is None and pending_upload.original_md5_checksum == local_file_md5 and \
+                    Path(pending_upload.encrypted_file_path).exists():
+                self.logger.info(f'Resuming upload of file "{str(local_file_path)}" to object path {pending_upload.object_name}')
+                encryption_data = {
+                    'local_file': str(local_file_path),
+                    'local_file_md5': local_file_md5,
+                    'local_file_size': pending_upload.original_size,
+                    'encrypted_file': pending_upload.encrypted_file_path,
+                    'encrypted_file_md5': pending_upload.encrypted_md5_checksum,
+                }
+                object_path = pending_upload.object_name
+                continue
+            self._discard_pending_upload(pending_upload.object_name)
+        return encryption_data, object_path
+
+    def _discard_pending_upload(self, object_path):
+        '''
+        Abort multipart upload to object path if one is recorded, deleting its parts, record and encrypted file
+        Only uses the upload session, so can run on worker threads
+        '''
+        if self.upload_session is None:
+            return
+        upload_state = DatabaseUploadState(self.upload_session, object_path)
+        if not upload_state.upload_id:
+            return
+        self.logger.info(f'Discarding pending upload {upload_state.upload_id} to object path {object_path}')
+        self.os_client.object_abort_upload(self.oci_namespace, self.oci_bucket, object_path, upload_state.upload_id)
+        if upload_state.pending_upload.encrypted_file_path:
+            Path(upload_state.pending_upload.encrypted_file_path).unlink(missing_ok=True)
+        upload_state.clear()
+
+    def _file_backup_finalize(self, encrypted_file, object_path, local_encrypted_file_md5, original_md5_checksum, local_backup_file,
+                              original_size=None):
+        '''
+        Create backup entry for uploaded object and point local file to it
+        '''
         backup_args = {
             'uploaded_file_path' : object_path,
             'uploaded_md5_checksum' : local_encrypted_file_md5,
             'original_md5_checksum':original_md5_checksum,
+            'original_size': original_size,
         }
 
-        backup_entry = BackupEntry(**backup_args)
-        self.db_session.add(backup_entry)
-        self.db_session.commit()
-        self.logger.info(f'Uploaded encrypted file "{str(encrypted_file)}" as backup entry {backup_entry.id}')
+        with self.metrics.time('db'):
+            backup_entry = database.BackupEntry(**backup_args)
+            self.db_session.add(backup_entry)
+            self.db_session.commit()
+            self.logger.info(f'Uploaded encrypted file "{str(encrypted_file)}" as backup entry {backup_entry.id}')
 
-        local_backup_file.backup_entry_id = backup_entry.id
-        self.db_session.commit()
+            local_backup_file.backup_entry_id = backup_entry.id
+            # New content, no longer shares data with any hardlink
+            local_backup_file.hardlink_local_file_id = None
+            self.db_session.commit()
         self.logger.info(f'Updated local backup {local_backup_file.id} to match backup entry {backup_entry.id}')
         return True
 
+    def _metrics_totals(self):
+        '''
+        Current metric totals used for run history
+        '''
+        stages = self.metrics.summary()['stages']
+        def stage_value(stage, key):
+            return stages.get(stage, {}).get(key, 0)
+        return {
+            'files_scanned': stage_value('scan', 'files'),
+            'files_hashed': stage_value('md5', 'files'),
+            'files_uploaded': stage_value('upload', 'files'),
+            'files_skipped': stage_value('skip', 'files'),
+            'bytes_read': stage_value('md5', 'bytes') + stage_value('encrypt', 'bytes'),
+            'bytes_uploaded': stage_value('upload', 'bytes'),
+            'stage_durations': {name: stage['seconds'] for name, stage in stages.items()},
+        }
+
+    @contextmanager
+    def record_run(self, command):
+        '''
+        Record run of command in the run history table, using metrics collected during the run
+
+        command     :   Name of command, such as "directory_backup"
+        '''
+        start_time = time.time()
+        start_totals = self._metrics_totals()
+        status = 'failed'
+        try:
+            yield
+            status = 'success'
+        finally:
+            end_totals = self._metrics_totals()
+            run_args = {
+                'command': command,
+                'status': status,
+                'start_time': start_time,
+                'end_time': time.time(),
+            }
+            for key in ['files_scanned', 'files_hashed', 'files_uploaded', 'files_skipped', 'bytes_read', 'bytes_uploaded']:
+                run_args[key] = end_totals[key] - start_totals[key]
+            stage_durations = {}
+            for stage, seconds in end_totals['stage_durations'].items():
+                stage_durations[stage] = round(seconds - start_totals['stage_durations'].get(stage, 0), 6)
+            run_args['stage_durations'] = json.dumps(stage_durations)
+            backup_run = database.BackupRun(**run_args)
+            self.db_session.add(backup_run)
+            self.db_session.commit()
+            self.logger.info(f'Recorded {status} run {backup_run.id} of command {command}')
+
     def file_backup(self, local_file, overwrite=False, force_checksum=False):
         '''
         Backup file to object storage
@@ -331,10 +1114,15 @@ class BackupClient():
         overwrite                   :       Upload new file if md5 has changed
         force_checksum              :       Force MD5 calculation even if metadata unchanged
         '''
+        with self.record_run('file_backup'):
+            return self._file_backup(local_file, overwrite, force_checksum)
+
+    def _file_backup(self, local_file, overwrite, force_checksum):
         # Use local file as the full path of the file
         # Use local file path as relative path for the database
         local_file_path = Path(local_file).resolve()
         self.logger.info(f'Backing up local file: "{str(local_file_path)}"')
+        self.metrics.increment('scan', files=1)
 
         # Get relative path for database
         relative_file_path = local_file_path
@@ -342,8 +1130,8 @@ class BackupClient():
             relative_file_path = local_file_path.relative_to(self.relative_path)
 
         # Get or create database entry
-        local_backup_file = self.db_session.query(BackupEntryLocalFile).\
-            filter(BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
+        local_backup_file = self.db_session.query(database.BackupEntryLocalFile).\
+            filter(database.BackupEntryLocalFile.local_file_path == str(relative_file_path)).first()
 
         # For existing entries, check metadata first (unless force_checksum)
         if local_backup_file and not force_checksum:
@@ -351,90 +1139,641 @@ class BackupClient():
                 # Metadata unchanged - file likely hasn't changed
                 if local_backup_file.backup_entry_id:
                     self.logger.info(f'File metadata unchanged, skipping backup for "{str(local_file_path)}"')
+                    self.metrics.increment('skip', files=1)
                     return False
                 self.logger.debug('Metadata unchanged but no backup entry exists, calculating checksum')
+        elif not local_backup_file and not force_checksum:
+            if self._file_backup_detect_rename(local_file_path):
+                return False
 
         # Calculate MD5 (either metadata changed, force_checksum, or no cached metadata)
         if force_checksum:
             self.logger.debug('Force checksum enabled, calculating MD5')
-        local_file_md5 = utils.md5(local_file_path)
+        local_file_md5 = self._local_file_md5(local_file_path)
         self.logger.debug(f'Local file "{str(local_file_path)}" has md5 {local_file_md5}')
 
         # Now check if we should upload
         should_upload_file, local_backup_file = self._file_backup_ensure_database_entry(local_file_path, local_file_md5, overwrite)
         if not should_upload_file:
             # Update metadata cache even if not uploading (md5 matched but metadata changed)
-            self._update_metadata_cache(local_file_path, local_backup_file)
+            self._update_metadata_cache(local_file_path, local_backup_file, local_file_md5=local_file_md5)
             return False
 
-        # Perform backup
-        encryption_data = self._file_backup_encrypt(local_file_path, local_file_md5)
-        self._file_backup_upload(encryption_data['encrypted_file'],
-                                 encryption_data['encrypted_file_md5'],
-                                 encryption_data['local_file_md5'],
-                                 local_backup_file)
-        Path(encryption_data['encrypted_file']).unlink()
+        # Encrypted copy of an interrupted upload is already staged, its uploaded parts were read from it
+        encryption_data, object_path = self._file_backup_pending_upload(local_file_path, local_file_md5)
+        # Perform backup, nothing else is staged so a file that does not fit now never will
+        decision = 'stage' if encryption_data else self._staging_decision(local_file_path.stat().st_size)
+        if decision != 'stage':
+            object_path = self._generate_uuid()
+            put = self._file_backup_put_memory if decision == 'memory' else self._file_backup_put_stream
+            encryption_data = put(local_file_path, local_file_md5, object_path)
+            self._file_backup_finalize(local_file_path, object_path, encryption_data['encrypted_file_md5'], local_file_md5,
+                                       local_backup_file, original_size=encryption_data['local_file_size'])
+        else:
+            if encryption_data is None:
+                encryption_data = self._file_backup_encrypt(local_file_path, local_file_md5)
+            self._file_backup_upload(encryption_data['encrypted_file'],
+                                     encryption_data['encrypted_file_md5'],
+                                     encryption_data['local_file_md5'],
+                                     local_backup_file,
+                                     object_path=object_path,
+                                     original_size=encryption_data['local_file_size'],
+                                     encryption_data=encryption_data)
+            Path(encryption_data['encrypted_file']).unlink()
 
         # Update metadata cache after successful backup
         self._update_metadata_cache(local_file_path, local_backup_file)
 
         return True
 
-    def file_list(self):
+    def file_backup_stream(self, reader, name, overwrite=False):
+        '''
+        Backup stream, such as a database dump piped to stdin, without writing it to disk
+        Data is hashed, encrypted and uploaded in parts as it is read, so memory is bounded by the upload part size
+
+        reader      :       Readable binary stream
+        name        :       Logical path the stream is recorded as, and restored to
+        overwrite   :       Replace the backup of an earlier stream with the same name
+        '''
+        with self.record_run('file_backup'):
+            return self._file_backup_stream(reader, name, overwrite)
+
+    def _file_backup_stream(self, reader, name, overwrite):
+        self.logger.info(f'Backing up stream as "{name}"')
+        self.metrics.increment('scan', files=1)
+        local_backup_file = self.db_session.query(database.BackupEntryLocalFile).\
+            filter(database.BackupEntryLocalFile.local_file_path == name).first()
+        if local_backup_file and not local_backup_file.from_stream:
+            raise BackupToolClientException(f'Local file "{name}" is not a stream backup, choose another name')
+        # Checked before reading, the stream cannot be read again
+        if local_backup_file and local_backup_file.backup_entry_id and not overwrite:
+            raise BackupToolClientException(f'Stream "{name}" already has backup entry {local_backup_file.backup_entry_id}, '
+                                            'use overwrite to replace it')
+
+        encrypting_reader = crypto.EncryptingReader(reader, self.crypto_key)
+        object_path = self._generate_uuid()
+        with self.metrics.time('upload') as observation:
+            self.os_client.object_put_stream(self.oci_namespace, self.oci_bucket, object_path, encrypting_reader)
+            observation.size = encrypting_reader.encrypted_size
+        self.metrics.increment('encrypt', files=1, size=encrypting_reader.original_size)
+        self.logger.info(f'Uploaded stream "{name}" of {encrypting_reader.original_size} bytes with md5 {encrypting_reader.original_md5}')
+
+        with self.metrics.time('db'):
+            if not local_backup_file:
+                local_backup_file = database.BackupEntryLocalFile(local_file_path=name, from_stream=True)
+                self.db_session.add(local_backup_file)
+                self.db_session.commit()
+            same_md5_backup_entry = self.db_session.query(database.BackupEntry).\
+                filter(database.BackupEntry.original_md5_checksum == encrypting_reader.original_md5).first()
+            if same_md5_backup_entry:
+                local_backup_file.backup_entry_id = same_md5_backup_entry.id
+                self.db_session.commit()
+        if same_md5_backup_entry:
+            # Content is already backed up, only known once the stream was read, drop the new copy
+            self.logger.info(f'Stream "{name}" matches backup entry {same_md5_backup_entry.id}, deleting uploaded object {object_path}')
+            self.os_client.object_delete(self.oci_namespace, self.oci_bucket, object_path)
+            return True
+        return self._file_backup_finalize(name, object_path, encrypting_reader.encrypted_md5,
+                                          encrypting_reader.original_md5, local_backup_file,
+                                          original_size=encrypting_reader.original_size)
+
+    def file_list(self, path_prefix=None, min_id=None, max_id=None, has_backup=None):
         '''
         List all local file database entries
+
+        path_prefix :   Only list files with local path starting with prefix
+        min_id      :   Only list files with id greater or equal
+        max_id      :   Only list files with id less or equal
+        has_backup  :   Only list files with a backup entry if True, without if False
         '''
-        local_files = []
-        for local_file in self.db_session.query(BackupEntryLocalFile).all():
-            local_files.append(local_file.as_dict())
-        return local_files
+        return list(self.file_list_iter(path_prefix=path_prefix, min_id=min_id, max_id=max_id, has_backup=has_backup))
 
-    def file_cleanup(self, dry_run=False):
+    def file_list_iter(self, path_prefix=None, min_id=None, max_id=None, has_backup=None):
+        '''
+        Stream local file database entries in batches, memory stays constant regardless of row count
+
+        path_prefix :   Only list files with local path starting with prefix
+        min_id      :   Only list files with id greater or equal
+        max_id      :   Only list files with id less or equal
+        has_backup  :   Only list files with a backup entry if True, without if False
+        '''
+        model = database.BackupEntryLocalFile
+        query = self.db_session.query(model)
+        if path_prefix:
+            # Range comparison instead of LIKE, so the unique index on local path is used
+            query = query.filter(model.local_file_path >= path_prefix)
+            upper_bound = utils.prefix_upper_bound(path_prefix)
+            if upper_bound is not None:
+                query = query.filter(model.local_file_path < upper_bound)
+        if min_id is not None:
+            query = query.filter(model.id >= min_id)
+        if max_id is not None:
+            query = query.filter(model.id <= max_id)
+        if has_backup is True:
+            query = query.filter(model.backup_entry_id.isnot(None))
+        elif has_backup is False:
+            query = query.filter(model.backup_entry_id.is_(None))
+        for local_file in query.order_by(model.id).yield_per(LIST_BATCH_SIZE):
+            yield local_file.as_dict()
+
+    def file_duplicates(self, dir_paths=None): #pylint:disable=too-many-locals
+        '''
+        Find groups of duplicate files, largest possible savings first
+        Without dir_paths, groups local file entries in the database that share content md5
+        With dir_paths, finds duplicates on disk before backup, only hashing files whose size collides
+
+        dir_paths   :   Directories to search on disk instead of the database
+        '''
+        if dir_paths:
+            return self._file_duplicates_on_disk(dir_paths)
+
+        local_file = database.BackupEntryLocalFile
+        backup_entry = database.BackupEntry
+        func = sqlalchemy.func
+        size = func.coalesce(local_file.cached_size, 0)
+        # Local copies beyond the largest, space deduplicating them could free, not space already saved
+        bytes_saveable = func.sum(size) - func.max(size)
+        # Grouping and savings computed in sqlite over the indexed md5 and backup entry columns
+        groups = self.db_session.query(backup_entry.original_md5_checksum, func.count(local_file.id),
+                                       func.max(size), bytes_saveable).\
+            join(backup_entry, local_file.backup_entry_id == backup_entry.id).\
+            group_by(backup_entry.original_md5_checksum).having(func.count(local_file.id) > 1).\
+            order_by(bytes_saveable.desc(), backup_entry.original_md5_checksum)
+
+        duplicates = {}
+        for md5_sum, count, max_size, saveable in groups:
+            duplicates[md5_sum] = {
+                'original_md5_checksum': md5_sum,
+                'count': count,
+                'size': max_size,
+                'bytes_saveable': saveable,
+                'backup_entry_ids': [],
+                'local_files': [],
+            }
+        if not duplicates:
+            return []
+
+        duplicate_md5s = self.db_session.query(backup_entry.original_md5_checksum).\
+            join(local_file, local_file.backup_entry_id == backup_entry.id).\
+            group_by(backup_entry.original_md5_checksum).having(func.count(local_file.id) > 1)
+        members = self.db_session.query(backup_entry.original_md5_checksum, backup_entry.id,
+                                        local_file.id, local_file.local_file_path, local_file.cached_size).\
+            join(backup_entry, local_file.backup_entry_id == backup_entry.id).\
+            filter(backup_entry.original_md5_checksum.in_(duplicate_md5s.scalar_subquery())).\
+            order_by(backup_entry.original_md5_checksum, local_file.local_file_path).yield_per(LIST_BATCH_SIZE)
+        for md5_sum, backup_entry_id, local_file_id, local_file_path, cached_size in members:
+            group = duplicates[md5_sum]
+            if backup_entry_id not in group['backup_entry_ids']:
+                group['backup_entry_ids'].append(backup_entry_id)
+            group['local_files'].append({
+                'id': local_file_id,
+                'local_file_path': local_file_path,
+                'cached_size': cached_size,
+            })
+        return list(duplicates.values())
+
+    def _file_duplicates_on_disk(self, dir_paths): #pylint:disable=too-many-locals
+        '''
+        Find duplicate files on disk, grouping by size first so only size collisions are hashed
+
+        dir_paths   :   Directories to search
+        '''
+        files_by_size = {}
+        seen_inodes = set()
+        pending_directories = [str(Path(dir_path).resolve()) for dir_path in dir_paths]
+        with self.metrics.time('scan', files=0) as scan_observation:
+            while pending_directories:
+                directory = pending_directories.pop()
+                try:
+                    entries = list(os.scandir(directory))
+                except OSError as error:
+                    self.logger.warning(f'Unable to list directory "{directory}": {str(error)}')
+                    continue
+                for entry in entries:
+                    if entry.is_symlink():
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        pending_directories.append(entry.path)
+                        continue
+                    if not entry.is_file(follow_symlinks=False):
+                        continue
+                    stat = entry.stat(follow_symlinks=False)
+                    # Hardlinks of the same inode take no extra space, only count them once
+                    if (stat.st_dev, stat.st_ino) in seen_inodes:
+                        continue
+                    seen_inodes.add((stat.st_dev, stat.st_ino))
+                    # Empty files are trivially identical and save nothing
+                    if stat.st_size:
+                        files_by_size.setdefault(stat.st_size, []).append(entry.path)
+                    scan_observation.files += 1
+
+        files_by_md5 = {}
+        for size, paths in files_by_size.items():
+            if len(paths) < 2:
+                continue
+            for path in paths:
+                try:
+                    md5_sum = self._local_file_md5(path)
+                except OSError as error:
+                    self.logger.warning(f'Unable to hash file "{path}": {str(error)}')
+                    continue
+                files_by_md5.setdefault((size, md5_sum), []).append(path)
+
+        duplicates = []
+        for (size, md5_sum), paths in files_by_md5.items():
+            if len(paths) < 2:
+                continue
+            duplicates.append({
+                'original_md5_checksum': md5_sum,
+                'count': len(paths),
+                'size': size,
+                'bytes_saveable': size * (len(paths) - 1),
+                'local_files': [{'local_file_path': path} for path in sorted(paths)],
+            })
+        duplicates.sort(key=lambda group: (-group['bytes_saveable'], group['original_md5_checksum']))
+        return duplicates
+
+    def _list_directory(self, directory):
+        '''
+        List entry names of directory, returns None if directory is not present, False if it cannot be read
+
+        directory       :       Path of directory to list
+        '''
+        try:
+            with os.scandir(directory) as scanner:
+                return {entry.name for entry in scanner}
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+        except OSError as error:
+            # Such as permission denied, files under it may still exist so they are kept
+            self.logger.warning(f'Unable to list directory "{str(directory)}", keeping its local files: {str(error)}')
+            return False
+
+    def _file_cleanup_check_batch(self, batch, executor, missing_directories): #pylint:disable=too-many-locals
+        '''
+        Check batch of local files for existence, using one directory listing per parent directory
+        Returns list of local file ids that are no longer present
+
+        batch               :       List of (local file id, full local file path)
+        executor            :       Thread pool to list directories with
+        missing_directories :       Set of directories known to be missing, updated in place
+        '''
+        directories = {}
+        for local_file_id, local_file_path in batch:
+            directories.setdefault(local_file_path.parent, []).append((local_file_id, local_file_path))
+
+        # List shallow directories first, so anything under a directory found missing is skipped
+        listings = {}
+        unreadable_directories = set()
+        for depth in sorted({len(directory.parts) for directory in directories}):
+            to_list = []
+            for directory in directories:
+                if len(directory.parts) != depth:
+                    continue
+                if directory in missing_directories or any(parent in missing_directories for parent in directory.parents):
+                    continue
+                parent_listing = listings.get(directory.parent)
+                if parent_listing is not None and directory.name not in parent_listing:
+                    missing_directories.add(directory)
+                    continue
+                to_list.append(directory)
+            for directory, listing in zip(to_list, executor.map(self._list_directory, to_list)):
+                if listing is None:
+                    missing_directories.add(directory)
+                    continue
+                if listing is False:
+                    unreadable_directories.add(directory)
+                    continue
+                listings[directory] = listing
+
+        missing_files = []
+        for directory, local_files in directories.items():
+            if directory in unreadable_directories:
+                continue
+            listing = listings.get(directory)
+            if listing is None:
+                self.logger.debug(f'Directory "{str(directory)}" no longer present')
+            for local_file_id, local_file_path in local_files:
+                if listing is not None and local_file_path.name in listing:
+                    continue
+                self.logger.info(f'Local file {local_file_id} path "{str(local_file_path)}" no longer present, removing from db')
+                missing_files.append(local_file_id)
+        return missing_files
+
+    def file_cleanup(self, dry_run=False, workers=DEFAULT_CLEANUP_WORKERS):
         '''
         Delete local files in database that are no longer present on file system
         dry_run     :       Return list of files, but do not execute deletes
+        workers     :       Number of threads used to list directories
         '''
-
         files_cleaned = []
-
-        for local_file in self.db_session.query(BackupEntryLocalFile).all():
-            local_file_path = Path(local_file.local_file_path)
-            if self.relative_path:
-                local_file_path = self.relative_path / local_file_path
-            if not local_file_path.exists():
-                self.logger.info(f'Local file {local_file.id} path "{str(local_file_path)}" no longer present, removing from db')
-                if not dry_run:
-                    self.db_session.query(BackupEntryLocalFile).filter_by(id=local_file.id).delete()
-                files_cleaned.append(local_file.id)
-            else:
-                self.logger.debug(f'Local file {local_file.id} path "{str(local_file_path)}" exists, skipping')
+        missing_directories = set()
+
+        # Stream rows ordered by path so files in the same directory land in the same batch
+        # Entries backed up from a stream have no file on disk to check
+        query = self.db_session.query(database.BackupEntryLocalFile.id, database.BackupEntryLocalFile.local_file_path).\
+            filter(database.BackupEntryLocalFile.from_stream.isnot(True)).\
+            order_by(database.BackupEntryLocalFile.local_file_path).yield_per(CLEANUP_BATCH_SIZE)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            batch = []
+            for local_file_id, local_file_path in query:
+                local_file_path = Path(local_file_path)
+                if self.relative_path:
+                    local_file_path = self.relative_path / local_file_path
+                batch.append((local_file_id, local_file_path))
+                if len(batch) >= CLEANUP_BATCH_SIZE:
+                    files_cleaned += self._file_cleanup_check_batch(batch, executor, missing_directories)
+                    batch = []
+            if batch:
+                files_cleaned += self._file_cleanup_check_batch(batch, executor, missing_directories)
+
+        if not dry_run:
+            for start in range(0, len(files_cleaned), DELETE_CHUNK_SIZE):
+                chunk = files_cleaned[start:start + DELETE_CHUNK_SIZE]
+                self.db_session.query(database.BackupEntryLocalFile).\
+                    filter(database.BackupEntryLocalFile.id.in_(chunk)).delete(synchronize_session=False)
         self.db_session.commit()
         return files_cleaned
 
-    def backup_list(self):
+    def backup_list(self, min_id=None, max_id=None):
         '''
         List all external backup database entries
+
+        min_id      :   Only list backups with id greater or equal
+        max_id      :   Only list backups with id less or equal
+        '''
+        return list(self.backup_list_iter(min_id=min_id, max_id=max_id))
+
+    def backup_list_iter(self, min_id=None, max_id=None):
         '''
-        backup_files = []
-        for backup_entry in self.db_session.query(BackupEntry).all():
-            backup_files.append(backup_entry.as_dict())
-        return backup_files
+        Stream external backup database entries in batches, memory stays constant regardless of row count
+
+        min_id      :   Only list backups with id greater or equal
+        max_id      :   Only list backups with id less or equal
+        '''
+        model = database.BackupEntry
+        query = self.db_session.query(model)
+        if min_id is not None:
+            query = query.filter(model.id >= min_id)
+        if max_id is not None:
+            query = query.filter(model.id <= max_id)
+        for backup_entry in query.order_by(model.id).yield_per(LIST_BATCH_SIZE):
+            yield backup_entry.as_dict()
 
     def backup_cleanup(self, dry_run=False):
         '''
         Find backup entries that do not have a local file entry, and delete these backups
         dry_run     :   Return list of files, but do not delete
         '''
-        backup_entry_ids = [item[0] for item in self.db_session.query(BackupEntry.id)]
-        local_file_backups = [item[0] for item in self.db_session.query(BackupEntryLocalFile.backup_entry_id).distinct()]
+        backup_entry_ids = [item[0] for item in self.db_session.query(database.BackupEntry.id)]
+        local_file_backups = [item[0] for item in self.db_session.query(database.BackupEntryLocalFile.backup_entry_id).distinct()]
 
         extra_backup_entries = list(set(backup_entry_ids) - set(local_file_backups))
 
         self.logger.info(f'Found backup file entries {extra_backup_entries} that do not have local files')
 
-        for backup in self.db_session.query(BackupEntry).filter(BackupEntry.id.in_(extra_backup_entries)):
+        for backup in self.db_session.query(database.BackupEntry).filter(database.BackupEntry.id.in_(extra_backup_entries)):
             if not dry_run:
                 self.os_client.object_delete(self.oci_namespace, self.oci_bucket, backup.uploaded_file_path)
-                self.db_session.query(BackupEntry).filter_by(id=backup.id).delete()
+                self.db_session.query(database.BackupEntry).filter_by(id=backup.id).delete()
                 self.db_session.commit()
         return extra_backup_entries
+
+    def backup_verify(self, quick=False, deep=False, sample_rate=1.0, bandwidth_limit=None, progress_file=None,
+                      workers=DEFAULT_VERIFY_WORKERS):
+        '''
+        Verify backup entries against object storage
+
+        quick           :   Only compare against the object listing, the default mode
+        deep            :   Download and decrypt objects in memory, comparing both md5 sums
+        sample_rate     :   Fraction of backup entries to check in deep mode
+        bandwidth_limit :   Max download bytes per second across all workers in deep mode
+        progress_file   :   File to record verified entries, so an interrupted deep verify can resume
+        workers         :   Number of parallel downloads in deep mode
+        '''
+        if quick and deep:
+            raise BackupToolClientException('Quick and deep verify cannot be combined')
+        if deep:
+            return self._backup_verify_deep(sample_rate, bandwidth_limit, progress_file, workers)
+        if not quick:
+            self.logger.debug('No verify mode given, defaulting to quick verify')
+        return self._backup_verify_quick()
+
+    def _backup_verify_quick(self):
+        '''
+        Verify backup entries against object storage without downloading objects
+        Merge joins the bucket listing with backup entries, both ordered by object name
+        '''
+        result = {
+            'checked': 0,
+            'missing': [],
+            'md5_mismatch': [],
+            'unknown': [],
+            'unverified_multipart': 0,
+        }
+
+        def iterate_objects():
+            for page in self.os_client.object_list_pages(self.oci_namespace, self.oci_bucket):
+                yield from page
+
+        objects = iterate_objects()
+        entries = iter(self.db_session.query(database.BackupEntry.id, database.BackupEntry.uploaded_file_path, database.BackupEntry.uploaded_md5_checksum).\
+            filter(database.BackupEntry.uploaded_file_path.isnot(None)).\
+            order_by(database.BackupEntry.uploaded_file_path).yield_per(VERIFY_BATCH_SIZE))
+
+        obj = next(objects, None)
+        entry = next(entries, None)
+        while obj is not None or entry is not None:
+            if entry is None or (obj is not None and obj['name'] < entry.uploaded_file_path):
+                self.logger.warning(f'Object "{obj["name"]}" has no matching backup entry')
+                result['unknown'].append(obj['name'])
+                obj = next(objects, None)
+                continue
+            if obj is None or entry.uploaded_file_path < obj['name']:
+                self.logger.error(f'Backup entry {entry.id} object "{entry.uploaded_file_path}" missing from object storage')
+                result['missing'].append({'id': entry.id, 'uploaded_file_path': entry.uploaded_file_path})
+                entry = next(entries, None)
+                continue
+            # Only entries found in the listing are checked, missing ones are counted apart
+            result['checked'] += 1
+            # Multipart uploads report an md5 of the part md5s, suffixed with the part count
+            if obj['md5'] and '-' in obj['md5']:
+                result['unverified_multipart'] += 1
+            elif obj['md5'] != entry.uploaded_md5_checksum:
+                self.logger.error(f'Backup entry {entry.id} object "{entry.uploaded_file_path}" has md5 {obj["md5"]}, '
+                                  f'expected {entry.uploaded_md5_checksum}')
+                result['md5_mismatch'].append({
+                    'id': entry.id,
+                    'uploaded_file_path': entry.uploaded_file_path,
+                    'expected_md5': entry.uploaded_md5_checksum,
+                    'object_md5': obj['md5'],
+                })
+            obj = next(objects, None)
+            entry = next(entries, None)
+        self.logger.info(f'Checked {result["checked"]} backup entries, {len(result["missing"])} missing, '
+                         f'{len(result["md5_mismatch"])} md5 mismatches, {len(result["unknown"])} unknown objects')
+        return result
+
+    def _backup_verify_deep_entry(self, uploaded_file_path, uploaded_md5_checksum, original_md5_checksum, rate_limiter):
+        '''
+        Stream single object through decryption, return failure reason or None if object is valid
+        '''
+        with self.os_client.object_get_stream(self.oci_namespace, self.oci_bucket, uploaded_file_path) as reader:
+            if rate_limiter:
+                reader = utils.ThrottledReader(reader, rate_limiter)
+            encrypted_md5, decrypted_md5 = crypto.decrypt_stream(reader, None, self.crypto_key)
+        if encrypted_md5 != uploaded_md5_checksum:
+            return f'Encrypted md5 {encrypted_md5} does not match expected {uploaded_md5_checksum}'
+        if decrypted_md5 != original_md5_checksum:
+            return f'Decrypted md5 {decrypted_md5} does not match expected {original_md5_checksum}'
+        return None
+
+    def _backup_verify_deep(self, sample_rate, bandwidth_limit, progress_file, workers): #pylint:disable=too-many-locals,too-many-statements
+        '''
+        Download objects in parallel and decrypt them in memory, checking encrypted and original md5 sums
+        '''
+        result = {
+            'verified': 0,
+            'failed': [],
+            'skipped': 0,
+            'sampled_out': 0,
+        }
+        progress_path = Path(progress_file).expanduser() if progress_file else None
+        # Entries are verified in id order, every entry up to this id was checked by an earlier run
+        checked_through = None
+        if progress_path and progress_path.exists():
+            checked_through = json.loads(progress_path.read_text(encoding='utf-8'))['checked_through']
+            self.logger.info(f'Resuming deep verify after backup entry {checked_through}')
+        # Ids of entries being verified, and the last id read, the high water id is just below the oldest one in flight
+        in_flight = set()
+        last_id = [checked_through]
+
+        def write_progress():
+            if not progress_path:
+                return
+            high_water = min(in_flight) - 1 if in_flight else last_id[0]
+            if high_water is None:
+                return
+            # Replaced in one step, an interrupted write never leaves a partial progress file
+            temp_path = progress_path.with_name(f'{progress_path.name}.tmp')
+            temp_path.write_text(json.dumps({'checked_through': high_water}), encoding='utf-8')
+            os.replace(temp_path, progress_path)
+
+        def finish(future):
+            entry_id, uploaded_file_path = pending.pop(future)
+            try:
+                failure = future.result()
+            except Exception as error:
+                failure = f'Unable to download object: {str(error)}'
+            if failure:
+                self.logger.error(f'Backup entry {entry_id} object "{uploaded_file_path}" failed deep verify: {failure}')
+                result['failed'].append({'id': entry_id, 'uploaded_file_path': uploaded_file_path, 'reason': failure})
+            else:
+                self.logger.debug(f'Backup entry {entry_id} object "{uploaded_file_path}" verified')
+                result['verified'] += 1
+            # Failed entries are recorded too, they are reported once and not retried on resume
+            in_flight.discard(entry_id)
+            if (result['verified'] + len(result['failed'])) % VERIFY_PROGRESS_INTERVAL == 0:
+                write_progress()
+
+        rate_limiter = utils.RateLimiter(bandwidth_limit) if bandwidth_limit else None
+        entries = self.db_session.query(database.BackupEntry.id, database.BackupEntry.uploaded_file_path,
+                                        database.BackupEntry.uploaded_md5_checksum, database.BackupEntry.original_md5_checksum).\
+            filter(database.BackupEntry.uploaded_file_path.isnot(None)).order_by(database.BackupEntry.id).yield_per(VERIFY_BATCH_SIZE)
+        pending = {}
+        completed = False
+        try:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                for entry in entries:
+                    if checked_through is not None and entry.id <= checked_through:
+                        result['skipped'] += 1
+                        continue
+                    last_id[0] = entry.id
+                    # Sampling is for spot checks, not security
+                    if sample_rate < 1 and random.random() >= sample_rate: # nosec B311
+                        result['sampled_out'] += 1
+                        continue
+                    future = executor.submit(self._backup_verify_deep_entry, entry.uploaded_file_path,
+                                             entry.uploaded_md5_checksum, entry.original_md5_checksum, rate_limiter)
+                    pending[future] = (entry.id, entry.uploaded_file_path)
+                    in_flight.add(entry.id)
+                    # Keep a bounded number of downloads queued
+                    if len(pending) >= workers * 2:
+                        done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                        # Finish in id order, an interrupt raised by a later entry keeps earlier results
+                        for future in sorted(done, key=lambda item: pending[item][0]):
+                            finish(future)
+                for future in sorted(pending, key=lambda item: pending[item][0]):
+                    finish(future)
+            completed = True
+        finally:
+            if progress_path:
+                if completed:
+                    # Full pass finished, next run starts a fresh scrub
+                    progress_path.unlink(missing_ok=True)
+                else:
+                    # Interrupted or failed, keep what was checked
+                    write_progress()
+        self.logger.info(f'Deep verified {result["verified"]} backup entries, {len(result["failed"])} failed, '
+                         f'{result["skipped"]} skipped from previous progress, {result["sampled_out"]} not sampled')
+        return result
+
+    def run_list(self, run_command=None, limit=None):
+        '''
+        List recorded runs, newest first
+
+        run_command :   Only list runs of command, such as "directory_backup"
+        limit       :   Max number of runs to list
+        '''
+        query = self.db_session.query(database.BackupRun)
+        if run_command:
+            query = query.filter(database.BackupRun.command == run_command)
+        query = query.order_by(database.BackupRun.id.desc())
+        if limit:
+            query = query.limit(limit)
+        runs = []
+        for backup_run in query:
+            run_dict = backup_run.as_dict()
+            run_dict['stage_durations'] = json.loads(run_dict['stage_durations'] or '{}')
+            runs.append(run_dict)
+        return runs
+
+    def run_stats(self, run_command=None, limit=None): #pylint:disable=too-many-locals
+        '''
+        Throughput statistics of recorded successful runs, grouped by command
+
+        run_command :   Only include runs of command
+        limit       :   Only include most recent number of runs per command
+        '''
+        runs_by_command = {}
+        for backup_run in self.run_list(run_command=run_command):
+            if backup_run['status'] != 'success':
+                continue
+            command_runs = runs_by_command.setdefault(backup_run['command'], [])
+            if limit and len(command_runs) >= limit:
+                continue
+            command_runs.append(backup_run)
+
+        stats = {}
+        for command, runs in runs_by_command.items():
+            durations = [run['end_time'] - run['start_time'] for run in runs]
+            throughputs = [run['bytes_uploaded'] / duration if duration else 0 for run, duration in zip(runs, durations)]
+            files_per_second = [(run['files_scanned'] or 0) / duration if duration else 0 for run, duration in zip(runs, durations)]
+            median_duration = statistics.median(durations)
+            stages = {}
+            for run in runs:
+                for stage, seconds in run['stage_durations'].items():
+                    stages.setdefault(stage, []).append(seconds)
+            stats[command] = {
+                'runs': len(runs),
+                'latest_start_time': runs[0]['start_time'],
+                'latest_duration_seconds': round(durations[0], 3),
+                'median_duration_seconds': round(median_duration, 3),
+                # Above 1 means the latest run was slower than usual
+                'latest_vs_median_duration': round(durations[0] / median_duration, 3) if median_duration else None,
+                'mean_upload_bytes_per_second': round(statistics.mean(throughputs), 3),
+                'latest_upload_bytes_per_second': round(throughputs[0], 3),
+                'mean_files_scanned_per_second': round(statistics.mean(files_per_second), 3),
+                'mean_stage_seconds': {stage: round(statistics.mean(values), 3) for stage, values in stages.items()},
+            }
+        return stats
@@ -3,8 +3,20 @@ import hashlib
 import os
 import struct
 
-# Crypto namespace is provided by pycryptodome, not the deprecated pyCrypto
-from Crypto.Cipher import AES  # nosec B413
+from backup_tool.exception import BackupToolException
+from backup_tool.utils import read_exact
+
+# Header size of streams whose size is not known when the header is written, the size is appended after the data instead
+STREAM_SIZE_UNKNOWN = 2**64 - 1
+SIZE_FORMAT = '<Q'
+
+def encrypted_size(size):
+    '''
+    Return size of encrypted copy of data of size, header with size and iv, then data padded to the block size
+
+    size    :   Bytes of data to encrypt
+    '''
+    return struct.calcsize(SIZE_FORMAT) + 16 + (size + 15) // 16 * 16
 
 # https://eli.thegreenplace.net/2010/06/25/aes-encryption-of-files-in-python-with-pycrypto
 def encrypt_file(input_file, output_file, passphrase, chunksize=64*1024): #pylint:disable=too-many-locals
@@ -16,6 +28,9 @@ def encrypt_file(input_file, output_file, passphrase, chunksize=64*1024): #pylin
     passphrase  :   The encryption key - a string that must be either 16, 24 or 32 bytes long
     chunksize   :   Sets the size of the chunk which the function uses to read and encrypt the file
     '''
+    # Imported on use, keeps startup fast for commands that never encrypt
+    # Crypto namespace is provided by pycryptodome, not the deprecated pyCrypto
+    from Crypto.Cipher import AES  #pylint:disable=import-outside-toplevel # nosec B413
     iv = os.urandom(16)
     encryptor = AES.new(passphrase.encode('utf-8'), AES.MODE_CBC, iv)
     filesize = os.path.getsize(input_file)
@@ -25,7 +40,7 @@ def encrypt_file(input_file, output_file, passphrase, chunksize=64*1024): #pylin
     encrypted_hash_value = hashlib.md5()  # nosec B324
     with open(input_file, 'rb') as infile:
         with open(output_file, 'wb') as outfile:
-            packed_qs = struct.pack('<Q', filesize)
+            packed_qs = struct.pack(SIZE_FORMAT, filesize)
             outfile.write(packed_qs)
             encrypted_hash_value.update(packed_qs)
             outfile.write(iv)
@@ -46,44 +61,194 @@ def encrypt_file(input_file, output_file, passphrase, chunksize=64*1024): #pylin
     encrypted_md5_value = str(codecs.encode(encrypted_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
     return original_md5_value, encrypted_md5_value
 
-def decrypt_file(input_file, output_file, passphrase, chunksize=24*1024): #pylint:disable=too-many-locals
+def encrypt_bytes(data, passphrase):
     '''
-    Decrypts a file using AES (CBC mode) with the given key.
+    Encrypts data in memory using AES (CBC mode) with the given key, in the format of encrypt_file
+    Returns encrypted data, md5 of data and md5 of encrypted data
 
-    input_file  :   Name of the input file
-    output_file :   Name of output file
+    data        :   Bytes to encrypt
     passphrase  :   The encryption key - a string that must be either 16, 24 or 32 bytes long
-    chunksize   :   Sets the size of the chunk which the function uses to read and decrypt the file
+    '''
+    # Crypto namespace is provided by pycryptodome, not the deprecated pyCrypto
+    from Crypto.Cipher import AES  #pylint:disable=import-outside-toplevel # nosec B413
+    iv = os.urandom(16)
+    encryptor = AES.new(passphrase.encode('utf-8'), AES.MODE_CBC, iv)
+    padding = (' ' * ((16 - len(data) % 16) % 16)).encode('utf-8')
+    encrypted = struct.pack(SIZE_FORMAT, len(data)) + iv + encryptor.encrypt(data + padding)
+    # MD5 used for file integrity/dedup, not security
+    original_hash_value = hashlib.md5()  # nosec B324
+    original_hash_value.update(data)
+    encrypted_hash_value = hashlib.md5()  # nosec B324
+    encrypted_hash_value.update(encrypted)
+    original_md5_value = str(codecs.encode(original_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
+    encrypted_md5_value = str(codecs.encode(encrypted_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
+    return encrypted, original_md5_value, encrypted_md5_value
+
+class EncryptingReader():
+    '''
+    Readable stream of encrypted data, encrypting the wrapped stream as it is read, in the format of encrypt_file
+    The size is not known up front, so the header holds STREAM_SIZE_UNKNOWN and the size follows the data
+    Md5 sums and sizes are set once the stream has been read to the end
+    '''
+    def __init__(self, reader, passphrase, chunksize=64*1024):
+        '''
+        reader      :   Readable binary stream of data to encrypt
+        passphrase  :   The encryption key - a string that must be either 16, 24 or 32 bytes long
+        chunksize   :   Bytes read from reader at a time, must be a multiple of 16
+        '''
+        # Crypto namespace is provided by pycryptodome, not the deprecated pyCrypto
+        from Crypto.Cipher import AES  #pylint:disable=import-outside-toplevel # nosec B413
+        iv = os.urandom(16)
+        self.encryptor = AES.new(passphrase.encode('utf-8'), AES.MODE_CBC, iv)
+        self.reader = reader
+        self.chunksize = chunksize
+        # MD5 used for file integrity/dedup, not security
+        self.original_hash_value = hashlib.md5()  # nosec B324
+        self.encrypted_hash_value = hashlib.md5()  # nosec B324
+        self.original_size = 0
+        self.encrypted_size = 0
+        self.finished = False
+        # Bytearray, so appending chunks and reading from the front does not copy the whole buffer
+        self.buffer = bytearray()
+        self._output(struct.pack(SIZE_FORMAT, STREAM_SIZE_UNKNOWN) + iv)
+
+    def _output(self, data):
+        self.encrypted_hash_value.update(data)
+        self.encrypted_size += len(data)
+        self.buffer += data
+
+    def _encrypt_next(self):
+        # Only the last chunk can be short, so only it is padded
+        chunk = read_exact(self.reader, self.chunksize)
+        if not chunk:
+            self._output(struct.pack(SIZE_FORMAT, self.original_size))
+            self.finished = True
+            return
+        self.original_hash_value.update(chunk)
+        self.original_size += len(chunk)
+        if len(chunk) % 16 != 0:
+            chunk += (' ' * (16 - len(chunk) % 16)).encode('utf-8')
+        self._output(self.encryptor.encrypt(chunk))
+
+    def read(self, size=-1):
+        '''
+        Read up to size bytes of encrypted data, all remaining data if size is negative
+        '''
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            self._encrypt_next()
+        if size < 0:
+            size = len(self.buffer)
+        data = bytes(self.buffer[:size])
+        del self.buffer[:size]
+        return data
+
+    @property
+    def original_md5(self):
+        '''
+        Base64 md5 of data read from the wrapped stream
+        '''
+        return str(codecs.encode(self.original_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
+
+    @property
+    def encrypted_md5(self):
+        '''
+        Base64 md5 of encrypted data
+        '''
+        return str(codecs.encode(self.encrypted_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
+
+def decrypt_stream(reader, writer, passphrase, chunksize=24*1024): #pylint:disable=too-many-locals
+    '''
+    Decrypts a stream using AES (CBC mode) with the given key.
+    Returns md5 of encrypted input and md5 of decrypted output
+
+    reader      :   Readable binary stream of encrypted data
+    writer      :   Writable binary stream for decrypted data, if None decrypted data is only hashed
+    passphrase  :   The encryption key - a string that must be either 16, 24 or 32 bytes long
+    chunksize   :   Sets the size of the chunk which the function uses to read and decrypt the stream
     '''
     # MD5 used for file integrity/dedup, not security
     original_hash_value = hashlib.md5()  # nosec B324
     decrypted_hash_value = hashlib.md5()  # nosec B324
-    with open(input_file, 'rb') as infile:
-        read_input = infile.read(struct.calcsize('Q'))
-        original_hash_value.update(read_input)
-        origsize = struct.unpack('<Q', read_input)[0]
+    read_input = read_exact(reader, struct.calcsize(SIZE_FORMAT))
+    original_hash_value.update(read_input)
+    origsize = struct.unpack(SIZE_FORMAT, read_input)[0]
 
-        iv = infile.read(16)
-        original_hash_value.update(iv)
+    iv = read_exact(reader, 16)
+    original_hash_value.update(iv)
 
-        decryptor = AES.new(passphrase.encode('utf-8'), AES.MODE_CBC, iv)
+    # Crypto namespace is provided by pycryptodome, not the deprecated pyCrypto
+    from Crypto.Cipher import AES  #pylint:disable=import-outside-toplevel # nosec B413
+    decryptor = AES.new(passphrase.encode('utf-8'), AES.MODE_CBC, iv)
+    if origsize == STREAM_SIZE_UNKNOWN:
+        _decrypt_sized_by_trailer(reader, writer, decryptor, original_hash_value, decrypted_hash_value, chunksize)
+    else:
         total_size = 0
-        with open(output_file, 'wb') as outfile:
-            while True:
-                chunk = infile.read(chunksize)
-                if len(chunk) == 0:
-                    break
-                original_hash_value.update(chunk)
-                decrypted_bit = decryptor.decrypt(chunk)
-                # Check if current chunk is last chunk
-                check_end = total_size + len(chunk) - origsize
-                if check_end:
-                    # Assume its last chunk
-                    decrypted_bit = decrypted_bit[0:(-1 * ((total_size + len(chunk)) - origsize))]
-                else:
-                    total_size += len(chunk)
-                outfile.write(decrypted_bit)
-                decrypted_hash_value.update(decrypted_bit)
+        while True:
+            chunk = read_exact(reader, chunksize)
+            if len(chunk) == 0:
+                break
+            original_hash_value.update(chunk)
+            decrypted_bit = decryptor.decrypt(chunk)
+            total_size += len(chunk)
+            # Last chunk will contain padding past the original size, drop it
+            if total_size > origsize:
+                decrypted_bit = decrypted_bit[:len(decrypted_bit) - (total_size - origsize)]
+            if writer is not None:
+                writer.write(decrypted_bit)
+            decrypted_hash_value.update(decrypted_bit)
     original_md5_value = str(codecs.encode(original_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
     decrypted_md5_value = str(codecs.encode(decrypted_hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
     return original_md5_value, decrypted_md5_value
+
+def _decrypt_sized_by_trailer(reader, writer, decryptor, original_hash_value, decrypted_hash_value, chunksize): #pylint:disable=too-many-locals
+    '''
+    Decrypt data of a stream encrypted by EncryptingReader, whose size is in a trailer after the data
+    The trailer and last block, which holds the padding, are held back until the end of the stream is reached
+    Raises BackupToolException if the stream is truncated or its trailer does not match the length of the data
+    '''
+    held_size = struct.calcsize(SIZE_FORMAT) + 16
+    pending = b''
+    written = 0
+    while True:
+        chunk = read_exact(reader, chunksize)
+        if not chunk:
+            break
+        original_hash_value.update(chunk)
+        pending += chunk
+        ready = (len(pending) - held_size) // 16 * 16
+        if ready > 0:
+            decrypted_bit = decryptor.decrypt(pending[:ready])
+            pending = pending[ready:]
+            written += len(decrypted_bit)
+            if writer is not None:
+                writer.write(decrypted_bit)
+            decrypted_hash_value.update(decrypted_bit)
+    trailer_size = struct.calcsize(SIZE_FORMAT)
+    # Encrypted data is whole blocks followed by the trailer, anything else was cut short
+    if len(pending) < trailer_size or (len(pending) - trailer_size) % 16 != 0:
+        raise BackupToolException(f'Encrypted stream is truncated, {len(pending)} bytes left at the end do not hold whole blocks '
+                                  f'and a {trailer_size} byte size trailer')
+    origsize = struct.unpack(SIZE_FORMAT, pending[-trailer_size:])[0]
+    last_blocks = pending[:-trailer_size]
+    # Only the last block is padded, so the size decides how many blocks there are
+    encrypted_length = written + len(last_blocks)
+    if (origsize + 15) // 16 * 16 != encrypted_length:
+        raise BackupToolException(f'Encrypted stream is truncated or corrupt, size trailer {origsize} does not match '
+                                  f'{encrypted_length} bytes of encrypted data')
+    decrypted_bit = decryptor.decrypt(last_blocks)[:origsize - written] if last_blocks else b''
+    if writer is not None:
+        writer.write(decrypted_bit)
+    decrypted_hash_value.update(decrypted_bit)
+
+def decrypt_file(input_file, output_file, passphrase, chunksize=24*1024):
+    '''
+    Decrypts a file using AES (CBC mode) with the given key.
+
+    input_file  :   Name of the input file
+    output_file :   Name of output file
+    passphrase  :   The encryption key - a string that must be either 16, 24 or 32 bytes long
+    chunksize   :   Sets the size of the chunk which the function uses to read and decrypt the file
+    '''
+    with open(input_file, 'rb') as infile:
+        with open(output_file, 'wb') as outfile:
+            return decrypt_stream(infile, outfile, passphrase, chunksize=chunksize)
@@ -1,5 +1,9 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Float
-from sqlalchemy.orm import declarative_base
+from sqlalchemy import Boolean, Column, ForeignKey, Integer, String, Float, Text, create_engine
+from sqlalchemy.orm import declarative_base, scoped_session, sessionmaker
+
+# Bump whenever models change, so databases created by older versions get new tables created
+# Column changes to existing tables still need an alembic migration
+SCHEMA_VERSION = 8
 
 
 # taken from https://www.reddit.com/r/Python/comments/4kqdyg/cool_sqlalchemy_trick/
@@ -41,12 +45,15 @@ class BackupEntry(BASE):
     # File paths
     uploaded_file_path = Column(String(256), unique=True)
 
-    # Original md5 sum before encryption
-    original_md5_checksum = Column(String(32))
+    # Original md5 sum before encryption, indexed for duplicate grouping
+    original_md5_checksum = Column(String(32), index=True)
 
     # MD5 sums
     uploaded_md5_checksum = Column(String(32), unique=True)
 
+    # Size before encryption, null for entries created before it was recorded
+    original_size = Column(Integer, nullable=True)
+
 @inject_function(as_dict)
 class BackupEntryLocalFile(BASE):
     '''
@@ -58,7 +65,7 @@ class BackupEntryLocalFile(BASE):
     id = Column(Integer, primary_key=True)
 
     # Foreign Key to backup entry
-    backup_entry_id = Column(Integer, ForeignKey('backup_entry.id'))
+    backup_entry_id = Column(Integer, ForeignKey('backup_entry.id'), index=True)
 
     # Local Path
     local_file_path = Column(String(40960), unique=True)
@@ -66,3 +73,127 @@ class BackupEntryLocalFile(BASE):
     # Cached metadata for fast change detection
     cached_mtime = Column(Float, nullable=True)
     cached_size = Column(Integer, nullable=True)
+    # Nanosecond timestamps and inode, compared depending on the metadata policy of the path
+    cached_mtime_ns = Column(Integer, nullable=True)
+    cached_ctime_ns = Column(Integer, nullable=True)
+    # Indexed to match renamed files to their previous entry
+    cached_inode = Column(Integer, nullable=True, index=True)
+    cached_dev = Column(Integer, nullable=True)
+
+    # First local file found with the same inode, set when this file is a hardlink of it
+    hardlink_local_file_id = Column(Integer, ForeignKey('backup_entry_local_file.id'), nullable=True)
+
+    # Permission bits and mtime of the file when backed up, restore can reapply them
+    # Kept apart from the cached columns, which restore updates to the restored file
+    original_mode = Column(Integer, nullable=True)
+    original_mtime_ns = Column(Integer, nullable=True)
+
+    # Set when backed up from a stream such as stdin, the path is a logical name with no file on disk to clean up
+    from_stream = Column(Boolean, nullable=True)
+
+@inject_function(as_dict)
+class BackupRun(BASE):
+    '''
+    BackupRun, history of backup runs and their throughput
+    '''
+    __tablename__ = 'backup_run'
+
+    # Primary key
+    id = Column(Integer, primary_key=True)
+
+    # Command that was run, such as "directory_backup"
+    command = Column(String(64))
+    # Outcome of run, "success" or "failed"
+    status = Column(String(16))
+
+    # Start and end as unix timestamps
+    start_time = Column(Float)
+    end_time = Column(Float)
+
+    # File counts
+    files_scanned = Column(Integer)
+    files_hashed = Column(Integer)
+    files_uploaded = Column(Integer)
+    files_skipped = Column(Integer)
+
+    # Byte counts
+    bytes_read = Column(Integer)
+    bytes_uploaded = Column(Integer)
+
+    # JSON dictionary of seconds spent per stage
+    stage_durations = Column(Text)
+
+@inject_function(as_dict)
+class PendingUpload(BASE):
+    '''
+    PendingUpload, multipart upload of an encrypted file that has not been committed yet
+    '''
+    __tablename__ = 'pending_upload'
+
+    # Primary key
+    id = Column(Integer, primary_key=True)
+
+    # Object the upload creates, and the multipart upload id given by object storage
+    object_name = Column(String(256), unique=True)
+    upload_id = Column(String(256))
+    # Bytes per part, every part but the last has this size, so part numbers map to the same file offsets on resume
+    part_size = Column(Integer)
+
+    # Encrypted file the parts are read from, encryption uses a random iv so only this copy matches the uploaded parts
+    encrypted_file_path = Column(String(40960))
+    encrypted_md5_checksum = Column(String(32))
+
+    # Local file encrypted, indexed so a later backup of the same file can resume the upload
+    local_file_path = Column(String(40960), index=True)
+    original_md5_checksum = Column(String(32))
+    original_size = Column(Integer, nullable=True)
+
+    # Unix timestamp the multipart upload was created
+    created_time = Column(Float)
+
+@inject_function(as_dict)
+class PendingUploadPart(BASE):
+    '''
+    PendingUploadPart, part of a pending upload stored in object storage
+    '''
+    __tablename__ = 'pending_upload_part'
+
+    # Primary key
+    id = Column(Integer, primary_key=True)
+
+    # Foreign Key to pending upload
+    pending_upload_id = Column(Integer, ForeignKey('pending_upload.id'), index=True)
+
+    # Part number starting at 1, and etag object storage returned for it, needed to commit the upload
+    part_num = Column(Integer)
+    etag = Column(String(256))
+
+def create_session(database_url, scoped=False):
+    '''
+    Create database session, creating tables only if the schema version is not current
+
+    database_url    :   Sqlite database url
+    scoped          :   Return a scoped session, giving each thread its own session
+    '''
+    engine = create_engine(database_url)
+    with engine.connect() as connection:
+        # Sqlite user_version header is cheap to read, create_all has to inspect every table
+        user_version = connection.exec_driver_sql('PRAGMA user_version').scalar()
+        if user_version < SCHEMA_VERSION:
+            BASE.metadata.create_all(connection)
+            connection.exec_driver_sql(f'PRAGMA user_version = {int(SCHEMA_VERSION)}')
+            connection.commit()
+
+    # Bind metadata and create session
+    BASE.metadata.bind = engine
+    if scoped:
+        return scoped_session(sessionmaker(bind=engine))
+    return sessionmaker(bind=engine)()
+
+def create_thread_sessions(session):
+    '''
+    Return scoped session bound to the engine of session, giving each thread its own session
+
+    session     :   Database session
+    '''
+    return scoped_session(sessionmaker(bind=session.get_bind()))
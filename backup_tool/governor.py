@@ -0,0 +1,203 @@
+import random
+import threading
+import time
+
+from backup_tool.exception import ObjectStorageException
+
+# Error classes retried by the governor, with the base of their exponential backoff in seconds
+# throttle      :   Service asked us to slow down, 429
+# unavailable   :   Service overloaded or failing, 5xx
+# timeout       :   Connection failed or timed out before a response
+BACKOFF_BASE = {
+    'throttle': 1.0,
+    'unavailable': 0.5,
+    'timeout': 0.25,
+}
+MAX_BACKOFF = 30.0
+DEFAULT_MAX_ATTEMPTS = 8
+DEFAULT_INITIAL_LIMIT = 8
+DEFAULT_MAX_LIMIT = 64
+# Fraction of the limit kept after throttling, and after a success slower than the latency target
+THROTTLE_DECREASE = 0.5
+LATENCY_DECREASE = 0.9
+# Gauge reporting the current limit in run metrics
+LIMIT_GAUGE = 'storage_concurrency_limit'
+
+class RequestGovernor():
+    '''
+    Shared limit on object storage requests in flight, adjusted with additive increase and multiplicative decrease
+    Successes grow the limit by about one per limit requests, throttling and failures halve it,
+    and failed requests are retried with full jitter backoff keyed on the class of error
+    '''
+    def __init__(self, classify, metrics=None, logger=None, initial_limit=DEFAULT_INITIAL_LIMIT, max_limit=DEFAULT_MAX_LIMIT,
+                 min_limit=1, latency_target=None, max_attempts=DEFAULT_MAX_ATTEMPTS, sleep=time.sleep):
+        '''
+        classify        :   Function taking an exception, returns a key of BACKOFF_BASE if it should be retried, None otherwise
+        metrics         :   RunMetrics the limit gauge and retries are recorded in
+        logger          :   Logger for retries
+        initial_limit   :   Requests allowed in flight at start
+        max_limit       :   Upper bound of limit
+        min_limit       :   Lower bound of limit
+        latency_target  :   Seconds, successes of latency sensitive requests slower than this shrink the limit
+        max_attempts    :   Attempts per request before the error is raised
+        sleep           :   Sleep function, replaced in tests
+        '''
+        self.classify = classify
+        self.metrics = metrics
+        self.logger = logger
+        self.min_limit = max(min_limit, 1)
+        self.max_limit = max(max_limit, self.min_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.max_attempts = max(max_attempts, 1)
+        self.sleep = sleep
+        self.in_flight = 0
+        self.condition = threading.Condition()
+        self._report_limit(self.metrics)
+
+    @property
+    def current_limit(self):
+        '''
+        Whole number of requests currently allowed in flight
+        '''
+        return max(int(self.limit), self.min_limit)
+
+    def _report_limit(self, metrics):
+        if metrics:
+            metrics.set_gauge(LIMIT_GAUGE, self.current_limit)
+
+    def _acquire(self):
+        with self.condition:
+            while self.in_flight >= self.current_limit:
+                self.condition.wait()
+            self.in_flight += 1
+
+    def _release(self):
+        with self.condition:
+            self.in_flight -= 1
+            self.condition.notify_all()
+
+    def _adjust(self, metrics, factor=None):
+        '''
+        Grow limit additively, or shrink it by factor, reporting the new limit to metrics
+        '''
+        with self.condition:
+            if factor is None:
+                self.limit = min(self.limit + 1 / self.limit, float(self.max_limit))
+            else:
+                self.limit = max(self.limit * factor, float(self.min_limit))
+            # More requests may now fit
+            self.condition.notify_all()
+        self._report_limit(metrics)
+
+    def backoff(self, error_class, attempt):
+        '''
+        Return seconds to wait before retrying, full jitter over an exponential bound
+
+        error_class     :   Key of BACKOFF_BASE
+        attempt         :   Attempts made so far, starting at 1
+        '''
+        bound = min(BACKOFF_BASE[error_class] * 2 ** (attempt - 1), MAX_BACKOFF)
+        return random.uniform(0, bound) # nosec B311
+
+    def call(self, operation, function, *args, latency_sensitive=True, **kwargs):
+        '''
+        Run function once a request slot is free, retrying throttling, unavailable and timeout errors
+
+        operation           :   Name of operation, used in logs
+        function            :   Function making the request
+        latency_sensitive   :   Compare latency against target, false for requests whose time depends on their size
+        '''
+        return self.call_reporting(self.metrics, operation, function, *args, latency_sensitive=latency_sensitive, **kwargs)
+
+    def call_reporting(self, metrics, operation, function, *args, latency_sensitive=True, **kwargs):
+        '''
+        Run function like call, recording retries and the limit in metrics instead of the metrics of the governor
+
+        metrics             :   RunMetrics of the caller, None to record nothing
+        '''
+        attempt = 0
+        while True:
+            attempt += 1
+            self._acquire()
+            start = time.monotonic()
+            try:
+                result = function(*args, **kwargs)
+            except Exception as error: #pylint:disable=broad-exception-caught
+                self._release()
+                error_class = self.classify(error)
+                if error_class is None:
+                    raise
+                self._adjust(metrics, THROTTLE_DECREASE)
+                if metrics:
+                    metrics.increment('storage', errors=1, retries=1 if attempt < self.max_attempts else 0)
+                if attempt >= self.max_attempts:
+                    raise ObjectStorageException(f'Object storage {operation} failed after {attempt} attempts: {str(error)}') from error
+                delay = self.backoff(error_class, attempt)
+                if self.logger:
+                    self.logger.warning(f'Object storage {operation} failed with {error_class} error, '
+                                        f'retrying in {delay:.2f}s with limit {self.current_limit}: {str(error)}')
+                self.sleep(delay)
+                continue
+            self._release()
+            latency = time.monotonic() - start
+            if latency_sensitive and self.latency_target and latency > self.latency_target:
+                self._adjust(metrics, LATENCY_DECREASE)
+            else:
+                self._adjust(metrics)
+            return result
+
+    def wrap(self, operation, function, latency_sensitive=True):
+        '''
+        Return function that runs through the governor, for sdk helpers that call it themselves
+
+        operation           :   Name of operation, used in logs
+        function            :   Function making the request
+        latency_sensitive   :   Compare latency against target
+        '''
+        def governed(*args, **kwargs):
+            return self.call(operation, function, *args, latency_sensitive=latency_sensitive, **kwargs)
+        return governed
+
+    def reporting_to(self, metrics):
+        '''
+        Return governor sharing the limit and requests in flight of this one, recording its retries and limit in other metrics
+        Used for requests of the server, which share one object storage client but each have their own metrics
+
+        metrics     :   RunMetrics to record in
+        '''
+        self._report_limit(metrics)
+        return GovernorView(self, metrics)
+
+class GovernorView():
+    '''
+    Request governor recording in its own metrics, while requests go through the limit of a shared governor
+    '''
+    def __init__(self, governor, metrics):
+        '''
+        governor    :   RequestGovernor whose limit is used
+        metrics     :   RunMetrics retries and the limit are recorded in
+        '''
+        self.governor = governor
+        self.metrics = metrics
+
+    @property
+    def current_limit(self):
+        '''
+        Whole number of requests currently allowed in flight by the shared governor
+        '''
+        return self.governor.current_limit
+
+    def call(self, operation, function, *args, latency_sensitive=True, **kwargs):
+        '''
+        Run function through the shared governor, see RequestGovernor.call
+        '''
+        return self.governor.call_reporting(self.metrics, operation, function, *args, latency_sensitive=latency_sensitive, **kwargs)
+
+    def wrap(self, operation, function, latency_sensitive=True):
+        '''
+        Return function that runs through the shared governor, see RequestGovernor.wrap
+        '''
+        def governed(*args, **kwargs):
+            return self.call(operation, function, *args, latency_sensitive=latency_sensitive, **kwargs)
+        return governed
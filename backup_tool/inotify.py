@@ -0,0 +1,194 @@
+from collections import namedtuple
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+
+# Event masks, from linux/inotify.h
+IN_ACCESS = 0x00000001
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+
+# Events that mean a file may have new content or metadata, or that the directory tree changed
+WATCH_MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE_SELF | IN_ONLYDIR
+
+# Struct inotify_event header, name follows padded to len bytes
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 64 * 1024
+
+InotifyEvent = namedtuple('InotifyEvent', ['wd', 'mask', 'cookie', 'name'])
+
+class Inotify():
+    '''
+    Minimal ctypes wrapper of the linux inotify api
+    '''
+    def __init__(self):
+        library = ctypes.util.find_library('c')
+        self.libc = ctypes.CDLL(library, use_errno=True)
+        if not hasattr(self.libc, 'inotify_init1'):
+            raise OSError(errno.ENOSYS, 'inotify is not available on this platform')
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.poller = select.poll()
+        self.poller.register(self.fd, select.POLLIN)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, exc_traceback):
+        self.close()
+
+    def close(self):
+        '''
+        Close inotify file descriptor, removing all watches
+        '''
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        '''
+        Watch path, returns watch descriptor
+
+        path    :   Path to watch
+        mask    :   Events to watch for
+        '''
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), str(path))
+        return wd
+
+    def remove_watch(self, wd):
+        '''
+        Remove watch, ignores watches the kernel already removed
+
+        wd      :   Watch descriptor
+        '''
+        self.libc.inotify_rm_watch(self.fd, wd)
+
+    def read_events(self, timeout=None):
+        '''
+        Read pending events, waiting up to timeout seconds for the first one
+
+        timeout :   Seconds to wait, None waits forever
+        '''
+        if not self.poller.poll(None if timeout is None else int(timeout * 1000)):
+            return []
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b'\0')
+            offset += length
+            events.append(InotifyEvent(wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+class RecursiveWatcher():
+    '''
+    Watch directory trees, reporting paths that changed
+    '''
+    def __init__(self, inotify, logger=None):
+        '''
+        inotify :   Inotify instance
+        logger  :   Logger to report watch errors to
+        '''
+        self.inotify = inotify
+        self.logger = logger
+        # Watch descriptor to directory path, and the reverse
+        self.directories = {}
+        self.watches = {}
+
+    def watch(self, directory):
+        '''
+        Watch directory and all directories under it
+        Returns files found in directories that were not watched before, they may have been created before the watch
+
+        directory   :   Directory path
+        '''
+        found_files = []
+        for root, directories, files in os.walk(directory):
+            if root in self.watches:
+                continue
+            try:
+                wd = self.inotify.add_watch(root)
+            except OSError as error:
+                if self.logger:
+                    hint = ', raise fs.inotify.max_user_watches' if error.errno == errno.ENOSPC else ''
+                    self.logger.warning(f'Unable to watch directory "{root}": {str(error)}{hint}')
+                directories[:] = []
+                continue
+            self.directories[wd] = root
+            self.watches[root] = wd
+            found_files += [os.path.join(root, name) for name in files]
+        return found_files
+
+    def unwatch(self, directory):
+        '''
+        Stop watching directory and all directories under it
+
+        directory   :   Directory path
+        '''
+        prefix = os.path.join(directory, '')
+        for wd, path in list(self.directories.items()):
+            if path == directory or path.startswith(prefix):
+                self.inotify.remove_watch(wd)
+                del self.directories[wd]
+                self.watches.pop(path, None)
+
+    def poll(self, timeout=None):
+        '''
+        Wait for events, returns set of changed file paths and whether the event queue overflowed
+        On overflow events were lost, so the trees must be rescanned
+
+        timeout     :   Seconds to wait for events
+        '''
+        changed = set()
+        overflow = False
+        for event in self.inotify.read_events(timeout=timeout):
+            if event.mask & IN_Q_OVERFLOW:
+                overflow = True
+                continue
+            if event.mask & IN_IGNORED:
+                path = self.directories.pop(event.wd, None)
+                if self.watches.get(path) == event.wd:
+                    del self.watches[path]
+                continue
+            directory = self.directories.get(event.wd)
+            if directory is None:
+                continue
+            path = os.path.join(directory, event.name) if event.name else directory
+            if event.mask & IN_ISDIR:
+                if event.mask & IN_MOVED_FROM:
+                    self.unwatch(path)
+                elif event.mask & (IN_CREATE | IN_MOVED_TO):
+                    # New or moved in directory, watch it and check the files already in it
+                    changed.update(self.watch(path))
+                continue
+            if event.mask & (IN_DELETE_SELF | IN_MOVED_FROM):
+                continue
+            changed.add(path)
+        return changed, overflow
@@ -0,0 +1,242 @@
+from contextlib import contextmanager
+import json
+import os
+from pathlib import Path
+from threading import Lock
+import time
+
+# Upper bounds in seconds for per file latency histograms
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600)
+
+class StageMetrics():
+    '''
+    Counters and latency histogram for a single stage of a run
+    '''
+    def __init__(self):
+        self.files = 0
+        self.bytes = 0
+        self.errors = 0
+        self.retries = 0
+        self.seconds = 0.0
+        self.observations = 0
+        # Last bucket counts anything slower than the largest bound
+        self.bucket_counts = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, seconds):
+        '''
+        Record latency of one operation
+
+        seconds     :   Duration of operation
+        '''
+        self.seconds += seconds
+        self.observations += 1
+        for index, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+                return
+        self.bucket_counts[-1] += 1
+
+    def percentile(self, fraction):
+        '''
+        Estimate latency percentile from histogram, returns upper bound of matching bucket
+
+        fraction    :   Percentile as fraction, such as 0.99
+        '''
+        if not self.observations:
+            return None
+        target = fraction * self.observations
+        running = 0
+        for index, count in enumerate(self.bucket_counts):
+            running += count
+            if running >= target:
+                if index < len(LATENCY_BUCKETS):
+                    return LATENCY_BUCKETS[index]
+                break
+        # Slower than every bucket, best estimate is the mean of the run
+        return self.seconds / self.observations
+
+    def as_dict(self):
+        '''
+        Return stage metrics as dictionary
+        '''
+        return {
+            'files': self.files,
+            'bytes': self.bytes,
+            'errors': self.errors,
+            'retries': self.retries,
+            'seconds': round(self.seconds, 6),
+            'p50_seconds': self.percentile(0.5),
+            'p99_seconds': self.percentile(0.99),
+        }
+
+class Observation():
+    '''
+    Handle given to callers timing a stage, so bytes and files can be recorded once known
+    '''
+    def __init__(self, size=0, files=1):
+        self.size = size
+        self.files = files
+
+class RunMetrics():
+    '''
+    Per stage performance metrics for a client run, safe to record from multiple threads
+    '''
+    def __init__(self):
+        self.start_time = time.time()
+        self.monotonic_start = time.monotonic()
+        self.stages = {}
+        self.markers = []
+        self.gauges = {}
+        self.lock = Lock()
+
+    def _stage(self, stage):
+        if stage not in self.stages:
+            self.stages[stage] = StageMetrics()
+        return self.stages[stage]
+
+    @contextmanager
+    def time(self, stage, size=0, files=1):
+        '''
+        Time one operation of a stage, errors raised inside are counted and re-raised
+        Files and bytes are only added when the operation succeeds
+
+        stage       :   Name of stage, such as "md5" or "upload"
+        size        :   Bytes processed by operation, can also be set on the yielded observation
+        files       :   Files processed by operation, can also be set on the yielded observation
+        '''
+        observation = Observation(size=size, files=files)
+        start = time.monotonic()
+        succeeded = False
+        try:
+            yield observation
+            succeeded = True
+        except Exception:
+            with self.lock:
+                self._stage(stage).errors += 1
+            raise
+        finally:
+            duration = time.monotonic() - start
+            with self.lock:
+                stage_metrics = self._stage(stage)
+                stage_metrics.observe(duration)
+                if succeeded:
+                    stage_metrics.files += observation.files
+                    stage_metrics.bytes += observation.size or 0
+
+    def increment(self, stage, files=0, size=0, errors=0, retries=0):
+        '''
+        Increment counters of a stage without timing
+
+        stage       :   Name of stage
+        files       :   Files to add
+        size        :   Bytes to add
+        errors      :   Errors to add
+        retries     :   Retries to add
+        '''
+        with self.lock:
+            stage_metrics = self._stage(stage)
+            stage_metrics.files += files
+            stage_metrics.bytes += size
+            stage_metrics.errors += errors
+            stage_metrics.retries += retries
+
+    def mark(self, name):
+        '''
+        Record wall clock marker for the start of a phase of the run
+
+        name        :   Name of phase
+        '''
+        with self.lock:
+            self.markers.append((name, round(time.monotonic() - self.monotonic_start, 6)))
+
+    def set_gauge(self, name, value):
+        '''
+        Set current value of a gauge
+
+        name        :   Name of gauge
+        value       :   Current value
+        '''
+        with self.lock:
+            self.gauges[name] = value
+
+    def summary(self):
+        '''
+        Return all metrics as dictionary
+        '''
+        with self.lock:
+            return {
+                'start_time': self.start_time,
+                'duration_seconds': round(time.time() - self.start_time, 6),
+                'stages': {name: stage.as_dict() for name, stage in self.stages.items()},
+                'gauges': dict(self.gauges),
+                'markers': list(self.markers),
+            }
+
+    def format_summary(self):
+        '''
+        Return human readable summary lines
+        '''
+        summary = self.summary()
+        lines = [f'Run finished in {summary["duration_seconds"]:.2f}s']
+        for name, stage in summary['stages'].items():
+            line = f'{name}: files={stage["files"]} bytes={stage["bytes"]} errors={stage["errors"]} ' \
+                   f'retries={stage["retries"]} time={stage["seconds"]:.2f}s'
+            if stage['p50_seconds'] is not None:
+                line += f' p50={stage["p50_seconds"]}s p99={stage["p99_seconds"]}s'
+            lines.append(line)
+        for name, value in summary['gauges'].items():
+            lines.append(f'{name}: {value}')
+        return lines
+
+    def write_json(self, path):
+        '''
+        Write metrics summary as json
+
+        path        :   Output file path
+        '''
+        Path(path).write_text(json.dumps(self.summary(), indent=4), encoding='utf-8')
+
+    def write_prometheus(self, path, command, prefix='backup_tool'): #pylint:disable=too-many-locals
+        '''
+        Write metrics in prometheus text format, for the node exporter textfile collector
+        File is written to a temp file first and renamed, so the collector never reads a partial file
+
+        path        :   Output file path, should end in ".prom"
+        command     :   Command label added to every series
+        prefix      :   Metric name prefix
+        '''
+        with self.lock:
+            stages = {name: stage.as_dict() | {'buckets': list(stage.bucket_counts), 'observations': stage.observations}
+                      for name, stage in self.stages.items()}
+            gauges = dict(self.gauges)
+        lines = []
+        for counter, description in (('files', 'Files processed per stage'),
+                                     ('bytes', 'Bytes processed per stage'),
+                                     ('errors', 'Errors per stage'),
+                                     ('retries', 'Retries per stage')):
+            lines.append(f'# HELP {prefix}_stage_{counter}_total {description}')
+            lines.append(f'# TYPE {prefix}_stage_{counter}_total counter')
+            for name, stage in stages.items():
+                lines.append(f'{prefix}_stage_{counter}_total{{command="{command}",stage="{name}"}} {stage[counter]}')
+        lines.append(f'# HELP {prefix}_stage_duration_seconds Per operation latency per stage')
+        lines.append(f'# TYPE {prefix}_stage_duration_seconds histogram')
+        for name, stage in stages.items():
+            running = 0
+            for bound, count in zip(LATENCY_BUCKETS, stage['buckets']):
+                running += count
+                lines.append(f'{prefix}_stage_duration_seconds_bucket{{command="{command}",stage="{name}",le="{bound}"}} {running}')
+            lines.append(f'{prefix}_stage_duration_seconds_bucket{{command="{command}",stage="{name}",le="+Inf"}} {stage["observations"]}')
+            lines.append(f'{prefix}_stage_duration_seconds_sum{{command="{command}",stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'{prefix}_stage_duration_seconds_count{{command="{command}",stage="{name}"}} {stage["observations"]}')
+        for name, value in gauges.items():
+            lines.append(f'# TYPE {prefix}_{name} gauge')
+            lines.append(f'{prefix}_{name}{{command="{command}"}} {value}')
+        lines.append(f'# TYPE {prefix}_run_duration_seconds gauge')
+        lines.append(f'{prefix}_run_duration_seconds{{command="{command}"}} {round(time.time() - self.start_time, 6)}')
+        lines.append(f'# TYPE {prefix}_last_run_timestamp_seconds gauge')
+        lines.append(f'{prefix}_last_run_timestamp_seconds{{command="{command}"}} {int(time.time())}')
+
+        path = Path(path)
+        temp_path = path.with_name(f'.{path.name}.tmp')
+        temp_path.write_text('\n'.join(lines) + '\n', encoding='utf-8')
+        os.replace(temp_path, path)
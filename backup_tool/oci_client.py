@@ -1,23 +1,116 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import copy
+import json
+import math
+import os
 import shutil
 
 from oci.auth.signers import InstancePrincipalsSecurityTokenSigner
 from oci.config import from_file
-from oci.retry import DEFAULT_RETRY_STRATEGY
-from oci.exceptions import ServiceError
+from oci.retry import NoneRetryStrategy
+from oci.exceptions import ConnectTimeout, MultipartUploadError, RequestException, ServiceError
 from oci.object_storage import ObjectStorageClient, UploadManager
 from oci.util import to_dict
 
+from oci.object_storage.models import CommitMultipartUploadDetails, CommitMultipartUploadPartDetails, CreateMultipartUploadDetails
 from oci.object_storage.models import RestoreObjectsDetails
 from oci.pagination import list_call_get_all_results
 
 from backup_tool.exception import ObjectStorageException
-from backup_tool.utils import setup_logger
+from backup_tool.governor import DEFAULT_MAX_LIMIT, RequestGovernor
+from backup_tool.utils import md5_bytes, read_exact, setup_logger
+
+# Service error statuses retried by the request governor, to their error class
+RETRY_STATUSES = {
+    429: 'throttle',
+    500: 'unavailable',
+    502: 'unavailable',
+    503: 'unavailable',
+    504: 'unavailable',
+}
+# Bytes per part of streamed uploads, held in memory while uploaded
+# Object storage allows 10000 parts, so this bounds streams to about 1.2 TiB
+DEFAULT_STREAM_PART_SIZE = 128 * 1024 * 1024
+# Bytes per part of files uploaded with a multipart upload state, same as the sdk upload manager
+# Files of at most one part are uploaded with a single request
+DEFAULT_FILE_PART_SIZE = 128 * 1024 * 1024
+# Parts of one file uploaded at the same time, each held in memory while uploaded
+DEFAULT_PART_WORKERS = 3
+# Bytes per ranged request of downloads, objects larger than one range are downloaded in ranges
+DEFAULT_RANGE_SIZE = 64 * 1024 * 1024
+# Ranges of one object downloaded at the same time
+DEFAULT_RANGE_WORKERS = 4
+# Bytes read from a range response at a time, written straight to the file
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+# Suffix of the file next to a ranged download recording its finished ranges, so an interrupted download can be resumed
+RANGES_FILE_SUFFIX = '.ranges'
+
+def classify_error(error):
+    '''
+    Return request governor error class of exception, None if it should not be retried
+
+    error   :   Exception raised by the oci sdk
+    '''
+    if isinstance(error, MultipartUploadError):
+        # Retry when every failed part failed for a retryable reason
+        causes = [classify_error(cause) for cause in error.error_causes]
+        return causes[0] if causes and None not in causes else None
+    if isinstance(error, ServiceError):
+        return RETRY_STATUSES.get(error.status)
+    if isinstance(error, (ConnectTimeout, RequestException, TimeoutError, ConnectionError)):
+        return 'timeout'
+    return None
+
+class MultipartUploadState():
+    '''
+    Progress of a multipart upload, the upload id and etags of uploaded parts
+    Objects with the same attributes and methods can persist changes instead, so an interrupted upload is resumed by uploading only missing parts
+    '''
+    def __init__(self, upload_id=None, part_size=None, parts=None):
+        '''
+        upload_id   :   Multipart upload id, None if no upload was created yet
+        part_size   :   Bytes per part the upload was created with
+        parts       :   Dictionary of uploaded part number to etag
+        '''
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.parts = dict(parts or {})
+
+    def started(self, upload_id, part_size):
+        '''
+        Record multipart upload was created
+
+        upload_id   :   Multipart upload id
+        part_size   :   Bytes per part
+        '''
+        self.upload_id = upload_id
+        self.part_size = part_size
+        self.parts = {}
+
+    def part_uploaded(self, part_num, etag):
+        '''
+        Record part was uploaded
+
+        part_num    :   Part number, starting at 1
+        etag        :   Etag returned for part, needed to commit the upload
+        '''
+        self.parts[part_num] = etag
+
+    def clear(self):
+        '''
+        Forget upload, once it is committed or no longer exists
+        '''
+        self.upload_id = None
+        self.part_size = None
+        self.parts = {}
 
 class OCIObjectStorageClient():
     '''
     Object Storage Client
     '''
-    def __init__(self, config_file, config_section, logger=None, instance_principal=False):
+    def __init__(self, config_file, config_section, logger=None, instance_principal=False,
+                 metrics=None, max_concurrency=DEFAULT_MAX_LIMIT, latency_target=None):
         '''
         Create ObjectStorageClient for OCI
 
@@ -25,18 +118,34 @@ class OCIObjectStorageClient():
         config_section      :   OCI Config File Section
         logger              :   Logger, if not given one will be created
         instance_principal  :   Use instance principal for auth
+        metrics             :   RunMetrics the request governor reports its limit and retries to
+        max_concurrency     :   Most requests the request governor allows in flight
+        latency_target      :   Seconds, requests slower than this lower the request governor limit
         '''
+        # Retries are done by the request governor, sdk retries would sleep without it knowing about throttling
         if not instance_principal:
             config = from_file(config_file, config_section)
-            self.object_storage_client = ObjectStorageClient(config, retry_strategy=DEFAULT_RETRY_STRATEGY)
+            self.object_storage_client = ObjectStorageClient(config, retry_strategy=NoneRetryStrategy())
         else:
             signer = InstancePrincipalsSecurityTokenSigner()
-            self.object_storage_client = ObjectStorageClient(config={}, signer=signer, retry_strategy=DEFAULT_RETRY_STRATEGY)
+            self.object_storage_client = ObjectStorageClient(config={}, signer=signer, retry_strategy=NoneRetryStrategy())
         self.upload_manager = UploadManager(self.object_storage_client)
         if logger is None:
             self.logger = setup_logger("oci_client", 10)
         else:
             self.logger = logger
+        self.governor = RequestGovernor(classify_error, metrics=metrics, logger=self.logger,
+                                        max_limit=max_concurrency, latency_target=latency_target)
+
+    def with_metrics(self, metrics):
+        '''
+        Return client sharing the sdk client and request governor limit of this one, recording governor retries and limit in metrics
+
+        metrics     :   RunMetrics to record in
+        '''
+        client = copy.copy(self)
+        client.governor = self.governor.reporting_to(metrics)
+        return client
 
     def object_list(self, namespace_name, bucket_name):
         '''
@@ -47,12 +156,32 @@ class OCIObjectStorageClient():
         '''
         self.logger.info("Retrieving object list from namespace %s and bucket %s",
                          namespace_name, bucket_name)
-        all_objects_response = list_call_get_all_results(self.object_storage_client.list_objects,
+        all_objects_response = list_call_get_all_results(self.governor.wrap('list', self.object_storage_client.list_objects),
                                                          namespace_name, bucket_name, fields='name,md5,size,timeCreated')
         return [to_dict(obj) for obj in all_objects_response.data.objects]
 
+    def object_list_pages(self, namespace_name, bucket_name, page_size=1000):
+        '''
+        Yield object storage objects one page at a time, objects are sorted by name
+
+        namespace_name  :   Object Storage Namespace
+        bucket_name     :   Bucket Name
+        page_size       :   Max objects requested per page
+        '''
+        self.logger.info(f'Streaming object list from namespace "{namespace_name}" and bucket "{bucket_name}"')
+        start = None
+        while True:
+            response = self.governor.call('list', self.object_storage_client.list_objects, namespace_name, bucket_name,
+                                          fields='name,md5,size,timeCreated', start=start, limit=page_size)
+            if response.status != 200:
+                raise ObjectStorageException(f'Error listing objects, Response code {str(response.status)}')
+            yield [to_dict(obj) for obj in response.data.objects]
+            start = response.data.next_start_with
+            if not start:
+                return
 
-    def object_put(self, namespace_name, bucket_name, object_name, file_name, md5_sum=None, resume_upload=False):
+    def object_put(self, namespace_name, bucket_name, object_name, file_name, md5_sum=None, resume_upload=False,
+                   upload_state=None, part_size=DEFAULT_FILE_PART_SIZE):
         '''
         Upload object to object storage
 
@@ -61,10 +190,35 @@ class OCIObjectStorageClient():
         object_name     :   Name of uploaded object
         file_name       :   Name of local file to upload
         md5_sum         :   Md5 sum of local file
+        resume_upload   :   Look for a pending multipart upload of the object to resume, when there is no upload state
+        upload_state    :   MultipartUploadState of the object, files larger than part size are uploaded in parts recorded in it
+        part_size       :   Bytes per part of new multipart uploads with upload state
         '''
         self.logger.info(f'Starting upload of file "{file_name}" to namespace "{namespace_name}" '
                          f'bucket "{bucket_name}" and object name "{object_name}"')
-        upload_resumed = False
+        if upload_state is not None and os.path.getsize(file_name) > part_size:
+            self._upload_parts(namespace_name, bucket_name, object_name, file_name, upload_state, part_size)
+            self.logger.info(f'File "{file_name}" uploaded to object storage with object name "{object_name}"')
+            return True
+        # Upload state replaces listing the pending uploads of the bucket
+        resume = [resume_upload and upload_state is None]
+        def upload():
+            try:
+                return self._upload(namespace_name, bucket_name, object_name, file_name, md5_sum, resume[0])
+            finally:
+                # A failed attempt may leave a multipart upload behind, retries continue it
+                resume[0] = upload_state is None
+        response = self.governor.call('put', upload, latency_sensitive=False)
+        if response.status != 200:
+            raise ObjectStorageException(f'Error uploading object, Reponse code {str(response.status)}')
+        self.logger.info(f'File "{file_name}" uploaded to object storage with object name "{object_name}"')
+        return True
+
+    def _upload(self, namespace_name, bucket_name, object_name, file_name, md5_sum, resume_upload):
+        '''
+        Upload file, resuming a pending multipart upload of the object if there is one
+        Runs inside a request governor slot, so makes its requests directly
+        '''
         if resume_upload:
             self.logger.debug(f'Checking if object name "{object_name}" is in list of pending uploads')
             multipart_uploads = list_call_get_all_results(self.object_storage_client.list_multipart_uploads,
@@ -73,50 +227,309 @@ class OCIObjectStorageClient():
                 # Assume namespace and bucket are the same
                 if multipart_upload.object == object_name:
                     self.logger.debug(f'Resuming file upload {multipart_upload.upload_id} for object "{object_name}"')
-                    response = self.upload_manager.resume_upload_file(namespace_name, bucket_name, object_name, file_name, multipart_upload.upload_id)
-                    upload_resumed = True
-                    break
-        if not upload_resumed:
-            response = self.upload_manager.upload_file(namespace_name, bucket_name, object_name, file_name, content_md5=md5_sum)
+                    return self.upload_manager.resume_upload_file(namespace_name, bucket_name, object_name, file_name, multipart_upload.upload_id)
+        return self.upload_manager.upload_file(namespace_name, bucket_name, object_name, file_name, content_md5=md5_sum)
+
+    def _upload_parts(self, namespace_name, bucket_name, object_name, file_name, upload_state, part_size):
+        '''
+        Upload file as a multipart upload, only sending parts missing from upload state
+        Starts a new upload once if the recorded one no longer exists, such as after it was aborted or expired
+        '''
+        restarted = False
+        while True:
+            if upload_state.upload_id:
+                self.logger.info(f'Resuming multipart upload {upload_state.upload_id} for object "{object_name}" '
+                                 f'with {len(upload_state.parts)} parts uploaded')
+            else:
+                create_response = self.governor.call('put', self.object_storage_client.create_multipart_upload, namespace_name, bucket_name,
+                                                      CreateMultipartUploadDetails(object=object_name))
+                upload_state.started(create_response.data.upload_id, part_size)
+            try:
+                self._upload_missing_parts(namespace_name, bucket_name, object_name, file_name, upload_state)
+                parts = [CommitMultipartUploadPartDetails(part_num=part_num, etag=etag) for part_num, etag in sorted(upload_state.parts.items())]
+                self.governor.call('put', self.object_storage_client.commit_multipart_upload, namespace_name, bucket_name, object_name,
+                                   upload_state.upload_id, CommitMultipartUploadDetails(parts_to_commit=parts))
+            except ServiceError as error:
+                if error.status != 404 or restarted:
+                    raise
+                self.logger.warning(f'Multipart upload {upload_state.upload_id} for object "{object_name}" no longer exists, '
+                                    'starting a new upload')
+                upload_state.clear()
+                restarted = True
+                continue
+            upload_state.clear()
+            return
+
+    def _upload_missing_parts(self, namespace_name, bucket_name, object_name, file_name, upload_state):
+        '''
+        Upload parts of file missing from upload state concurrently, each read at its offset
+        Parts are recorded in upload state on this thread as they finish, so state does not need to be thread safe
+        '''
+        # Part numbers map to offsets of the part size the upload was created with
+        part_size = upload_state.part_size
+        part_count = max(math.ceil(os.path.getsize(file_name) / part_size), 1)
+        missing = [part_num for part_num in range(1, part_count + 1) if part_num not in upload_state.parts]
+        self.logger.debug(f'Uploading {len(missing)} of {part_count} parts of multipart upload {upload_state.upload_id} for object "{object_name}"')
+        def upload_part(part_num):
+            with open(file_name, 'rb') as reader:
+                reader.seek((part_num - 1) * part_size)
+                data = read_exact(reader, part_size)
+            response = self.governor.call('put', self.object_storage_client.upload_part, namespace_name, bucket_name, object_name,
+                                          upload_state.upload_id, part_num, data, content_md5=md5_bytes(data), latency_sensitive=False)
+            return part_num, response.headers['etag']
+        with ThreadPoolExecutor(max_workers=DEFAULT_PART_WORKERS) as executor:
+            futures = [executor.submit(upload_part, part_num) for part_num in missing]
+            try:
+                for future in as_completed(futures):
+                    upload_state.part_uploaded(*future.result())
+            finally:
+                # Parts not started are uploaded on resume
+                for future in futures:
+                    future.cancel()
+
+    def object_put_bytes(self, namespace_name, bucket_name, object_name, data, md5_sum=None):
+        '''
+        Upload data held in memory to object storage with a single put request
+
+        namespace_name  :   Object Storage Namespace
+        bucket_name     :   Bucket name
+        object_name     :   Name of uploaded object
+        data            :   Bytes to upload
+        md5_sum         :   Base64 md5 sum of data, checked by object storage
+        '''
+        self.logger.debug(f'Uploading {len(data)} bytes to namespace "{namespace_name}" bucket "{bucket_name}" and object name "{object_name}"')
+        response = self.governor.call('put', self.object_storage_client.put_object, namespace_name, bucket_name, object_name, data,
+                                      content_md5=md5_sum)
         if response.status != 200:
             raise ObjectStorageException(f'Error uploading object, Reponse code {str(response.status)}')
-        self.logger.info(f'File "{file_name}" uploaded to object storage with object name "{object_name}"')
         return True
 
-    def object_get(self, namespace_name, bucket_name, object_name, file_name, set_restore=False):
+    def object_put_stream(self, namespace_name, bucket_name, object_name, reader, part_size=DEFAULT_STREAM_PART_SIZE):
+        '''
+        Upload readable stream of unknown size to object storage as a multipart upload, one part in memory at a time
+        The multipart upload is aborted if the stream or an upload fails
+
+        namespace_name  :   Object Storage Namespace
+        bucket_name     :   Bucket name
+        object_name     :   Name of uploaded object
+        reader          :   Readable binary stream
+        part_size       :   Bytes per part, at least 10 MiB except for the last part
+        '''
+        self.logger.info(f'Starting stream upload to namespace "{namespace_name}" bucket "{bucket_name}" and object name "{object_name}"')
+        create_response = self.governor.call('put', self.object_storage_client.create_multipart_upload, namespace_name, bucket_name,
+                                              CreateMultipartUploadDetails(object=object_name))
+        upload_id = create_response.data.upload_id
+        parts = []
+        try:
+            while True:
+                data = read_exact(reader, part_size)
+                # Empty stream still needs one part
+                if not data and parts:
+                    break
+                part_response = self.governor.call('put', self.object_storage_client.upload_part, namespace_name, bucket_name,
+                                                   object_name, upload_id, len(parts) + 1, data, latency_sensitive=False)
+                parts.append(CommitMultipartUploadPartDetails(part_num=len(parts) + 1, etag=part_response.headers['etag']))
+                self.logger.debug(f'Uploaded part {len(parts)} of stream upload {upload_id} for object "{object_name}"')
+                if len(data) < part_size:
+                    break
+            self.governor.call('put', self.object_storage_client.commit_multipart_upload, namespace_name, bucket_name, object_name,
+                               upload_id, CommitMultipartUploadDetails(parts_to_commit=parts))
+        except BaseException:
+            # Nothing can resume a stream, do not leave its parts stored
+            self.logger.warning(f'Aborting stream upload {upload_id} for object "{object_name}"')
+            self.governor.call('delete', self.object_storage_client.abort_multipart_upload, namespace_name, bucket_name,
+                               object_name, upload_id)
+            raise
+        self.logger.info(f'Stream uploaded to object storage with object name "{object_name}" in {len(parts)} parts')
+        return True
+
+    def object_abort_upload(self, namespace_name, bucket_name, object_name, upload_id):
+        '''
+        Abort multipart upload, deleting its uploaded parts, returns False if it no longer exists
+
+        namespace_name  :   Object Storage Namespace
+        bucket_name     :   Bucket name
+        object_name     :   Name of object the upload creates
+        upload_id       :   Multipart upload id
+        '''
+        self.logger.info(f'Aborting multipart upload {upload_id} for object "{object_name}"')
+        try:
+            self.governor.call('delete', self.object_storage_client.abort_multipart_upload, namespace_name, bucket_name,
+                               object_name, upload_id)
+        except ServiceError as error:
+            if error.status != 404:
+                raise
+            return False
+        return True
+
+    def object_get(self, namespace_name, bucket_name, object_name, file_name, set_restore=False,
+                   range_size=DEFAULT_RANGE_SIZE, workers=DEFAULT_RANGE_WORKERS):
         '''
         Download object from object storage
+        Objects larger than range size are fetched in concurrent ranged requests, an interrupted download resumes with the missing ranges
 
         namespace_name  :   Object Storage Namespace
         bucket_name     :   Bucket name
         object_name     :   Name of object to download
         file_name       :   Name of local file where object will be downloaded
         set_restore     :   If object is archived, run "set_restore"
+        range_size      :   Bytes per ranged request of new downloads
+        workers         :   Ranges downloaded at the same time
         '''
         self.logger.info(f'Downloading object "{object_name}" from namespace "{namespace_name}" and bucket "{bucket_name}" to file "{file_name}"')
-        with open(file_name, 'wb') as writer:
+        try:
+            self._download_object(namespace_name, bucket_name, object_name, file_name, range_size, workers)
+        except ServiceError as error:
+            self.logger.exception(f'Service Error when attempting to download object: {str(error)}')
+            if set_restore and "'code': 'NotRestored'" in str(error):
+                self.logger.debug(f'Object "{object_name}" in bucket "{bucket_name}" and namepsace '
+                                  f'"{namespace_name}" is archived, will mark for restore')
+                restore_details = RestoreObjectsDetails(object_name=object_name)
+                restore_response = self.governor.call('restore', self.object_storage_client.restore_objects,
+                                                      namespace_name, bucket_name, restore_details)
+                if restore_response.status != 202:
+                    raise ObjectStorageException('Error restoring object, ' # pylint:disable=raise-missing-from
+                                                 f'Response code {str(restore_response.status)}')
+                self.logger.info(f'Set restore on object "{object_name}" in bucket "{bucket_name}" and namespace "{namespace_name}"')
+            return False
+        return True
+
+    def _download_object(self, namespace_name, bucket_name, object_name, file_name, range_size, workers):
+        '''
+        Resume interrupted ranged download of object, or download it with one request if it fits a range, or in ranges if not
+        '''
+        ranges_file = f'{file_name}{RANGES_FILE_SUFFIX}'
+        progress = self._download_progress(file_name, ranges_file)
+        if progress is not None:
+            self.logger.info(f'Resuming download of object "{object_name}" to file "{file_name}" '
+                             f'with {len(progress["done"])} ranges downloaded')
             try:
-                get_response = self.object_storage_client.get_object(namespace_name,
-                                                                     bucket_name,
-                                                                     object_name)
+                self._download_ranges(namespace_name, bucket_name, object_name, file_name, ranges_file, progress, workers)
+                return
             except ServiceError as error:
-                self.logger.exception(f'Service Error when attempting to download object: {str(error)}')
-                if set_restore and "'code': 'NotRestored'" in str(error):
-                    self.logger.debug(f'Object "{object_name}" in bucket "{bucket_name}" and namepsace '
-                                      f'"{namespace_name}" is archived, will mark for restore')
-                    restore_details = RestoreObjectsDetails(object_name=object_name)
-                    restore_response = self.object_storage_client.restore_objects(namespace_name, bucket_name, restore_details)
-                    if restore_response.status != 202:
-                        raise ObjectStorageException('Error restoring object, ' # pylint:disable=raise-missing-from
-                                                     f'Response code {str(restore_response.status)}')
-                    self.logger.info(f'Set restore on object "{object_name}" in bucket "{bucket_name}" and namespace "{namespace_name}"')
-                return False
-
-            if get_response.status != 200:
-                raise ObjectStorageException(f'Error downloading object, Response code {str(get_response.status)}')
+                # If match on the etag failed, ranges downloaded before belong to another version of the object
+                if error.status != 412:
+                    raise
+                self.logger.warning(f'Object "{object_name}" changed since its download was interrupted, starting over')
+                os.remove(ranges_file)
+        progress = self.governor.call('get', self._download, namespace_name, bucket_name, object_name, file_name, range_size,
+                                      latency_sensitive=False)
+        if progress is None:
+            return
+        with open(file_name, 'wb') as writer:
+            try:
+                os.posix_fallocate(writer.fileno(), 0, progress['size'])
+            except OSError:
+                # Filesystem cannot allocate ahead, a sparse file still takes writes at any offset
+                writer.truncate(progress['size'])
+        with open(ranges_file, 'w', encoding='utf-8') as writer:
+            writer.write(json.dumps({key: progress[key] for key in ['etag', 'size', 'range_size']}) + '\n')
+        self._download_ranges(namespace_name, bucket_name, object_name, file_name, ranges_file, progress, workers)
+
+    def _download(self, namespace_name, bucket_name, object_name, file_name, range_size):
+        '''
+        Write object to file if it fits in one range, otherwise return progress of a new ranged download
+        Runs inside a request governor slot, so makes its request directly
+        '''
+        get_response = self.object_storage_client.get_object(namespace_name, bucket_name, object_name)
+        if get_response.status != 200:
+            raise ObjectStorageException(f'Error downloading object, Response code {str(get_response.status)}')
+        size = int(get_response.headers.get('content-length', 0))
+        if size > range_size:
+            # Body is fetched in ranges instead
+            get_response.data.close()
+            self.logger.debug(f'Downloading object "{object_name}" of {size} bytes in ranges of {range_size} bytes')
+            return {'etag': get_response.headers['etag'], 'size': size, 'range_size': range_size, 'done': set()}
+        with open(file_name, 'wb') as writer:
             self.logger.debug(f'Writing object "{object_name}" to file "{file_name}"')
             shutil.copyfileobj(get_response.data.raw, writer)
-        return True
+        return None
+
+    def _download_progress(self, file_name, ranges_file):
+        '''
+        Return progress of an interrupted ranged download to file, None if there is none to resume
+        The ranges file holds a json line with the etag and sizes, then the number of each finished range on its own line
+        '''
+        try:
+            with open(ranges_file, encoding='utf-8') as reader:
+                lines = reader.read().split('\n')
+        except FileNotFoundError:
+            return None
+        try:
+            progress = json.loads(lines[0])
+        except ValueError:
+            return None
+        if not os.path.exists(file_name) or os.path.getsize(file_name) != progress['size']:
+            return None
+        # Last line is empty, or cut short by the interruption
+        progress['done'] = {int(line) for line in lines[1:-1]}
+        return progress
+
+    def _download_ranges(self, namespace_name, bucket_name, object_name, file_name, ranges_file, progress, workers): #pylint:disable=too-many-locals
+        '''
+        Download ranges missing from progress concurrently, writing each at its offset of the allocated file
+        Finished ranges are appended to the ranges file on this thread, which is removed once every range is written
+        '''
+        size = progress['size']
+        range_size = progress['range_size']
+        range_count = math.ceil(size / range_size)
+        missing = [index for index in range(range_count) if index not in progress['done']]
+        self.logger.debug(f'Downloading {len(missing)} of {range_count} ranges of object "{object_name}"')
+        def download_range(index):
+            start = index * range_size
+            length = min(range_size, size - start)
+            def get_range():
+                get_response = self.object_storage_client.get_object(namespace_name, bucket_name, object_name,
+                                                                     range=f'bytes={start}-{start + length - 1}', if_match=progress['etag'])
+                if get_response.status != 206:
+                    raise ObjectStorageException(f'Error downloading object range, Response code {str(get_response.status)}')
+                written = 0
+                try:
+                    with open(file_name, 'r+b') as writer:
+                        writer.seek(start)
+                        while written < length:
+                            chunk = get_response.data.raw.read(min(DOWNLOAD_CHUNK_SIZE, length - written))
+                            if not chunk:
+                                break
+                            writer.write(chunk)
+                            written += len(chunk)
+                finally:
+                    get_response.data.close()
+                if written != length:
+                    # Retried by the request governor like a dropped connection
+                    raise ConnectionError(f'Range at offset {start} of object "{object_name}" ended after {written} of {length} bytes')
+            self.governor.call('get', get_range, latency_sensitive=False)
+            return index
+        with open(ranges_file, 'a', encoding='utf-8') as ranges_writer, ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(download_range, index) for index in missing]
+            try:
+                for future in as_completed(futures):
+                    ranges_writer.write(f'{future.result()}\n')
+                    ranges_writer.flush()
+            finally:
+                # Ranges not started are downloaded on resume
+                for future in futures:
+                    future.cancel()
+        os.remove(ranges_file)
+
+    @contextmanager
+    def object_get_stream(self, namespace_name, bucket_name, object_name):
+        '''
+        Open object in object storage as a readable stream, nothing is written to disk
+
+        namespace_name  :   Object Storage Namespace
+        bucket_name     :   Bucket name
+        object_name     :   Name of object to stream
+        '''
+        self.logger.debug(f'Streaming object "{object_name}" from namespace "{namespace_name}" and bucket "{bucket_name}"')
+        # Only the request is governed, the body is read by the caller
+        get_response = self.governor.call('get', self.object_storage_client.get_object, namespace_name, bucket_name, object_name)
+        if get_response.status != 200:
+            raise ObjectStorageException(f'Error downloading object, Response code {str(get_response.status)}')
+        try:
+            yield get_response.data.raw
+        finally:
+            get_response.data.close()
 
     def object_delete(self, namespace_name, bucket_name, object_name):
         '''
@@ -127,9 +540,8 @@ class OCIObjectStorageClient():
         object_name     :   Name of object to delete
         '''
         self.logger.info(f'Deleting object "{object_name}" from namespace "{namespace_name}" and bucket "{bucket_name}"')
-        response = self.object_storage_client.delete_object(namespace_name,
-                                                            bucket_name,
-                                                            object_name)
+        response = self.governor.call('delete', self.object_storage_client.delete_object,
+                                      namespace_name, bucket_name, object_name)
         if response.status != 204:
             raise ObjectStorageException(f'Error deleting object, Reponse code {str(response.status)}')
         return True
@@ -0,0 +1,69 @@
+import cProfile
+import io
+import pstats
+import time
+import tracemalloc
+
+from pathlib import Path
+
+# Default number of functions and allocation sites listed in profile summaries
+DEFAULT_PROFILE_TOP = 30
+
+def profile_call(func, output_prefix, memory=False, top=DEFAULT_PROFILE_TOP, metrics=None, logger=None): #pylint:disable=too-many-locals
+    '''
+    Run function under cProfile, writing pstats and a text summary
+    Returns value of function
+
+    func            :   Function to call, takes no args
+    output_prefix   :   Path prefix for output, ".pstats" and ".txt" files are written
+    memory          :   Also trace memory allocations with tracemalloc
+    top             :   Number of entries to list in summary
+    metrics         :   RunMetrics of the run, phase markers and stage times are added to summary
+    logger          :   Logger to report output files to
+    '''
+    output_prefix = Path(output_prefix)
+    output_prefix.parent.mkdir(parents=True, exist_ok=True)
+    profiler = cProfile.Profile()
+    if memory:
+        tracemalloc.start()
+    start = time.monotonic()
+    profiler.enable()
+    try:
+        return func()
+    finally:
+        profiler.disable()
+        duration = time.monotonic() - start
+        memory_snapshot = None
+        memory_peak = None
+        if memory:
+            memory_snapshot = tracemalloc.take_snapshot()
+            memory_peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+        pstats_file = output_prefix.with_suffix('.pstats')
+        profiler.dump_stats(str(pstats_file))
+
+        summary = [f'Wall clock: {duration:.3f}s', '']
+        if metrics is not None:
+            summary.append('Phase markers (seconds since run start):')
+            for name, offset in metrics.summary()['markers']:
+                summary.append(f'  {offset:10.3f}  {name}')
+            summary.append('')
+            summary.append('Stages:')
+            summary += [f'  {line}' for line in metrics.format_summary()]
+            summary.append('')
+        for sort_key in ('cumulative', 'tottime'):
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats(sort_key).print_stats(top)
+            summary.append(f'Top {top} functions by {sort_key}:')
+            summary.append(stream.getvalue())
+        if memory_snapshot is not None:
+            summary.append(f'Peak traced memory: {memory_peak} bytes')
+            summary.append(f'Top {top} allocation sites:')
+            for stat in memory_snapshot.statistics('lineno')[:top]:
+                summary.append(f'  {stat}')
+
+        summary_file = output_prefix.with_suffix('.txt')
+        summary_file.write_text('\n'.join(summary) + '\n', encoding='utf-8')
+        if logger:
+            logger.info(f'Wrote profile to "{str(pstats_file)}" and summary to "{str(summary_file)}"')
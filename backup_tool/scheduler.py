@@ -0,0 +1,54 @@
+# Orderings of files for the directory backup pipeline
+# Each policy takes an iterable of (path, inode key, size) tuples in scan order and returns them in the order to process
+
+def fifo(files):
+    '''
+    Process files in scan order
+    Files are passed through as given, so a streamed input is not read ahead
+    '''
+    return files
+
+def largest_first(files):
+    '''
+    Start large files first, so their uploads overlap with everything else and do not leave a single threaded tail
+    '''
+    return sorted(files, key=lambda item: item[2], reverse=True)
+
+def smallest_first(files):
+    '''
+    Process small files first, for the fastest coverage by number of files
+    '''
+    return sorted(files, key=lambda item: item[2])
+
+def balanced(files):
+    '''
+    Alternate between the largest and smallest remaining files
+    Large uploads start early, while a steady stream of small files keeps the other workers and the uplink busy
+    '''
+    ordered = largest_first(files)
+    result = []
+    start, end = 0, len(ordered) - 1
+    while start <= end:
+        result.append(ordered[start])
+        start += 1
+        if start <= end:
+            result.append(ordered[end])
+            end -= 1
+    return result
+
+SCHEDULE_POLICIES = {
+    'fifo': fifo,
+    'largest-first': largest_first,
+    'smallest-first': smallest_first,
+    'balanced': balanced,
+}
+DEFAULT_SCHEDULE_POLICY = 'fifo'
+
+def schedule(files, policy=DEFAULT_SCHEDULE_POLICY):
+    '''
+    Return files in the order of policy
+
+    files       :   Iterable of (path, inode key, size) tuples
+    policy      :   Name of policy in SCHEDULE_POLICIES
+    '''
+    return SCHEDULE_POLICIES[policy](files)
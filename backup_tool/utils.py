@@ -1,13 +1,65 @@
 import codecs
 from contextlib import contextmanager
+import errno
 import hashlib
+import importlib.util
 import logging
 from logging.handlers import RotatingFileHandler
+import os
 import secrets
+import shutil
 import string
+import sys
+from threading import Lock
+import time
 
 from pathlib import Path
 
+def lazy_import(name):
+    '''
+    Import module, but only execute it on first attribute access
+    Keeps startup fast for commands that never use heavy modules
+
+    name    :   Full module name
+    '''
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+def prefix_upper_bound(prefix):
+    '''
+    Return smallest string greater than every string starting with prefix, None if there is none
+    Allows prefix matching as an index range, "prefix <= value < upper bound"
+
+    prefix  :   String prefix
+    '''
+    # Strip trailing max code points, they cannot be incremented
+    while prefix and ord(prefix[-1]) == sys.maxunicode:
+        prefix = prefix[:-1]
+    if not prefix:
+        return None
+    next_code_point = ord(prefix[-1]) + 1
+    # Surrogates cannot be encoded as utf-8 for the query, no valid string uses them so skip past them
+    if 0xD800 <= next_code_point <= 0xDFFF:
+        next_code_point = 0xE000
+    return prefix[:-1] + chr(next_code_point)
+
+def sqlite_integer(value):
+    '''
+    Wrap unsigned 64 bit value, such as an inode number, into the signed range sqlite integers can store
+
+    value   :   Integer value
+    '''
+    if value >= 2**63:
+        return value - 2**64
+    return value
+
 def random_string(length=32, prefix='', suffix=''):
     '''
     Generate random string
@@ -67,6 +119,150 @@ def md5(input_file, chunksize=64*1024):
     # This leaves "b'<hash> at beginning, so take out first two chars
     return str(md5_value).rstrip("\\n'")[2:]
 
+def md5_bytes(data):
+    '''
+    Get md5 base64 hash of bytes, in the format of md5
+    '''
+    # MD5 used for upload integrity, not security
+    hash_value = hashlib.md5()  # nosec B324
+    hash_value.update(data)
+    return str(codecs.encode(hash_value.digest(), 'base64')).rstrip("\\n'")[2:]
+
+def read_exact(reader, size):
+    '''
+    Read exactly size bytes from reader, unless end of stream is reached first
+    Network streams and pipes can return short reads
+
+    reader  :   Readable binary stream
+    size    :   Bytes to read
+    '''
+    # Join once at the end, appending to bytes copies everything read so far on every short read
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = reader.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+def read_delimited(reader, delimiter=b'\n', chunksize=64*1024):
+    '''
+    Yield entries of a binary stream split on delimiter, as soon as they are read
+    Empty entries are skipped
+
+    reader      :   Binary readable stream, such as sys.stdin.buffer
+    delimiter   :   Bytes separating entries
+    chunksize   :   Max bytes read at a time
+    '''
+    # read1 returns what is available instead of waiting for a full chunk, so entries from a pipe are not held back
+    read = getattr(reader, 'read1', reader.read)
+    remainder = b''
+    while True:
+        chunk = read(chunksize)
+        if not chunk:
+            break
+        entries = (remainder + chunk).split(delimiter)
+        remainder = entries.pop()
+        for entry in entries:
+            if entry:
+                yield entry
+    if remainder:
+        yield remainder
+
+# ioctl cloning a whole file, from linux/fs.h
+FICLONE = 0x40049409
+# Errors meaning a fast copy method is not supported between these files, so the next one is tried
+COPY_UNSUPPORTED_ERRORS = (errno.EXDEV, errno.ENOSYS, errno.EOPNOTSUPP, errno.EINVAL, errno.ENOTTY, errno.EBADF)
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+def copy_file(source, destination):
+    '''
+    Copy file contents, returns method used
+    Tries a reflink first, which shares blocks on filesystems like btrfs and xfs, then copy_file_range, which copies in the kernel,
+    then a plain copy
+
+    source      :   Path of file to copy
+    destination :   Path to write, replaced if it exists
+    '''
+    try:
+        import fcntl #pylint:disable=import-outside-toplevel
+    except ImportError:
+        # Not available outside of unix, skip the reflink
+        fcntl = None
+    with open(source, 'rb') as reader, open(destination, 'wb') as writer:
+        if fcntl:
+            try:
+                fcntl.ioctl(writer.fileno(), FICLONE, reader.fileno())
+                return 'reflink'
+            except OSError as error:
+                if error.errno not in COPY_UNSUPPORTED_ERRORS:
+                    raise
+        if hasattr(os, 'copy_file_range'):
+            try:
+                while os.copy_file_range(reader.fileno(), writer.fileno(), COPY_CHUNK_SIZE):
+                    pass
+                return 'copy_file_range'
+            except OSError as error:
+                if error.errno not in COPY_UNSUPPORTED_ERRORS:
+                    raise
+                # Start over, part of the file may have been copied
+                reader.seek(0)
+                writer.seek(0)
+                writer.truncate()
+        shutil.copyfileobj(reader, writer, COPY_CHUNK_SIZE)
+        return 'copy'
+
+class RateLimiter():
+    '''
+    Thread safe byte rate limiter, shared across readers to cap total bandwidth
+    '''
+    def __init__(self, bytes_per_second):
+        '''
+        bytes_per_second    :   Max average bytes per second across all consumers
+        '''
+        self.bytes_per_second = bytes_per_second
+        self.allowance = bytes_per_second
+        self.last_check = time.monotonic()
+        self.lock = Lock()
+
+    def consume(self, amount):
+        '''
+        Record amount of bytes used, sleeping if over the allowed rate
+
+        amount  :   Number of bytes consumed
+        '''
+        with self.lock:
+            now = time.monotonic()
+            self.allowance = min(self.bytes_per_second,
+                                 self.allowance + (now - self.last_check) * self.bytes_per_second)
+            self.last_check = now
+            self.allowance -= amount
+            wait = -self.allowance / self.bytes_per_second if self.allowance < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+class ThrottledReader():
+    '''
+    Wrap readable stream so reads are limited by a rate limiter
+    '''
+    def __init__(self, reader, rate_limiter):
+        '''
+        reader          :   Readable stream
+        rate_limiter    :   RateLimiter to consume read bytes from
+        '''
+        self.reader = reader
+        self.rate_limiter = rate_limiter
+
+    def read(self, size=-1):
+        '''
+        Read from underlying stream, then wait for bandwidth
+        '''
+        data = self.reader.read(size)
+        self.rate_limiter.consume(len(data))
+        return data
+
 def setup_logger(name, log_file_level, logging_file=None,
                  console_logging=True, console_logging_level=logging.INFO):
     '''
@@ -26,6 +26,11 @@ def test_global_args():
     assert args.pop('settings_file') == 'settings.conf'
 
 
+    args = parse_args(['--profile', '--profile-memory', '--profile-top', '10', 'file', 'list'])
+    assert args.pop('profile') == True
+    assert args.pop('profile_memory') == True
+    assert args.pop('profile_top') == 10
+
     blank_args = parse_args(['file', 'list'])
     assert blank_args.pop('module') == 'file'
     assert blank_args.pop('command') == 'list'
@@ -38,9 +43,25 @@ def test_file():
     assert args.pop('module') == 'file'
     assert args.pop('command') == 'list'
 
+    args = parse_args(['file', 'list', '--format', 'jsonl', '--path-prefix', 'docs/', '--min-id', '5', '--max-id', '10', '--no-backup'])
+    assert args.pop('output_format') == 'jsonl'
+    assert args.pop('path_prefix') == 'docs/'
+    assert args.pop('min_id') == 5
+    assert args.pop('max_id') == 10
+    assert args.pop('has_backup') == False
+    args = parse_args(['file', 'list', '--has-backup'])
+    assert args.pop('has_backup') == True
+    with pytest.raises(CLIException) as error:
+        parse_args(['file', 'list', '--has-backup', '--no-backup'])
+    assert str(error.value) == 'argument --no-backup: not allowed with argument --has-backup'
+
     args = parse_args(['file', 'duplicates'])
     assert args.pop('module') == 'file'
     assert args.pop('command') == 'duplicates'
+    assert args.pop('dir_paths') == None
+
+    args = parse_args(['file', 'duplicates', '--dir-paths', 'foo', 'bar'])
+    assert args.pop('dir_paths') == ['foo', 'bar']
 
     args = parse_args(['file', 'cleanup'])
     assert args.pop('module') == 'file'
@@ -51,6 +72,12 @@ def test_file():
     assert args.pop('module') == 'file'
     assert args.pop('command') == 'cleanup'
     assert args['dry_run'] == True
+    assert args['workers'] == 8
+
+    args = parse_args(['file', 'cleanup', '--workers', '32'])
+    assert args.pop('module') == 'file'
+    assert args.pop('command') == 'cleanup'
+    assert args['workers'] == 32
 
     args = parse_args(['file', 'backup', 'test-file'])
     assert args.pop('module') == 'file'
@@ -58,6 +85,18 @@ def test_file():
     assert args.pop('local_file') == 'test-file'
     assert args.pop('overwrite') == False
 
+    args = parse_args(['file', 'backup', '--from-file', '-', '-0', '-w', '4', '--schedule', 'largest-first'])
+    assert args.pop('local_file') is None
+    assert args.pop('from_file') == '-'
+    assert args.pop('null') == True
+    assert args.pop('workers') == 4
+    assert args.pop('schedule_policy') == 'largest-first'
+
+    args = parse_args(['file', 'backup', '--stdin', '--name', 'dumps/db.sql'])
+    assert args.pop('local_file') is None
+    assert args.pop('stdin') == True
+    assert args.pop('name') == 'dumps/db.sql'
+
     args = parse_args(['file', 'backup', 'test-file', '-o'])
     assert args.pop('module') == 'file'
     assert args.pop('command') == 'backup'
@@ -102,6 +141,10 @@ def test_file():
     assert args.pop('local_file_id') == 1234
     assert args.pop('overwrite') == True
 
+    args = parse_args(['file', 'restore', '1234', '--verify', '-pm'])
+    assert args.pop('verify') == True
+    assert args.pop('preserve_metadata') == True
+
     args = parse_args(['file', 'restore', '1234', '-sr'])
     assert args.pop('module') == 'file'
     assert args.pop('command') == 'restore'
@@ -139,6 +182,12 @@ def test_backup():
     args = parse_args(['backup', 'list'])
     assert args.pop('module') == 'backup'
     assert args.pop('command') == 'list'
+    assert args.pop('output_format') == None
+
+    args = parse_args(['backup', 'list', '--format', 'json', '--min-id', '2'])
+    assert args.pop('output_format') == 'json'
+    assert args.pop('min_id') == 2
+    assert args.pop('max_id') == None
 
     args = parse_args(['backup', 'cleanup'])
     assert args.pop('module') == 'backup'
@@ -150,6 +199,53 @@ def test_backup():
     assert args.pop('command') == 'cleanup'
     assert args.pop('dry_run') == True
 
+    args = parse_args(['backup', 'verify', '--quick'])
+    assert args.pop('module') == 'backup'
+    assert args.pop('command') == 'verify'
+    assert args.pop('quick') == True
+
+    with pytest.raises(CLIException):
+        parse_args(['backup', 'verify', '--quick', '--deep'])
+
+def test_directory_restore():
+    args = parse_args(['directory', 'restore'])
+    assert args.pop('module') == 'directory'
+    assert args.pop('command') == 'restore'
+    assert args.pop('path_prefix') == None
+    assert args.pop('overwrite') == False
+    assert args.pop('set_restore') == False
+    assert args.pop('hardlink') == False
+    assert args.pop('verify') == False
+    assert args.pop('preserve_metadata') == False
+
+    args = parse_args(['directory', 'restore', '-p', 'Documents/', '--hardlink', '-o'])
+    assert args.pop('path_prefix') == 'Documents/'
+    assert args.pop('hardlink') == True
+    assert args.pop('overwrite') == True
+
+def test_directory_watch():
+    args = parse_args(['directory', 'watch', '--dir-paths', 'test-dir'])
+    assert args.pop('module') == 'directory'
+    assert args.pop('command') == 'watch'
+    assert args.pop('dir_paths') == ['test-dir']
+    assert args.pop('debounce') == 2.0
+    assert args.pop('duration') == None
+
+    args = parse_args(['directory', 'watch', '--dir-paths', 'test-dir', '--debounce', '0.5', '--duration', '60'])
+    assert args.pop('debounce') == 0.5
+    assert args.pop('duration') == 60
+
+def test_serve():
+    args = parse_args(['serve'])
+    assert args.pop('module') == 'serve'
+    assert args.pop('command') == 'start'
+    assert args.pop('socket_path') == None
+    assert args.pop('workers') == 4
+
+    args = parse_args(['serve', '--socket', '/tmp/backup.sock', '-w', '2'])
+    assert args.pop('socket_path') == '/tmp/backup.sock'
+    assert args.pop('workers') == 2
+
 def test_directory():
     args = parse_args(['directory', 'backup', '--dir-paths', 'test-dir'])
     assert args.pop('module') == 'directory'
@@ -158,6 +254,12 @@ def test_directory():
     assert args.pop('overwrite') == False
     assert args.pop('skip_files') == None
     assert args.pop('cache_file') == None
+    assert args.pop('workers') == 1
+    assert args.pop('schedule_policy') == 'fifo'
+
+    args = parse_args(['directory', 'backup', '--dir-paths', 'test-dir', '-w', '8', '--schedule', 'largest-first'])
+    assert args.pop('workers') == 8
+    assert args.pop('schedule_policy') == 'largest-first'
 
     args = parse_args(['directory', 'backup', '-o', '--dir-paths', 'test-dir'])
     assert args.pop('module') == 'directory'
@@ -205,6 +307,23 @@ def test_directory():
     assert args.pop('dir_paths') == ['test-dir']
     assert args.pop('cache_file') == 'cachey'
 
+def test_run():
+    args = parse_args(['run', 'list'])
+    assert args.pop('module') == 'run'
+    assert args.pop('command') == 'list'
+    assert args.pop('run_command') == None
+    assert args.pop('limit') == None
+
+    args = parse_args(['run', 'list', '--run-command', 'directory_backup', '--limit', '5'])
+    assert args.pop('run_command') == 'directory_backup'
+    assert args.pop('limit') == 5
+
+    args = parse_args(['run', 'stats', '-c', 'file_backup', '-l', '10'])
+    assert args.pop('module') == 'run'
+    assert args.pop('command') == 'stats'
+    assert args.pop('run_command') == 'file_backup'
+    assert args.pop('limit') == 10
+
 def test_load_settings():
     result = load_settings(None)
     assert result == {}
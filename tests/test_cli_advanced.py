@@ -1,8 +1,13 @@
 """
 Advanced CLI tests to improve coverage
 """
+import io
 import json
 import os
+import socket
+import sys
+import threading
+import time
 from pathlib import Path
 from tempfile import TemporaryDirectory
 
@@ -10,8 +15,10 @@ import pytest
 from mock import patch
 
 from backup_tool import utils
-from backup_tool.cli.client import ClientCLI
-from backup_tool.exception import CLIException
+from backup_tool.cli.client import ClientCLI, run_on_server
+from backup_tool.cli.server import BackupServer, send_request, server_request_args
+from backup_tool.database import BackupEntryLocalFile
+from backup_tool.exception import BackupToolException, CLIException, ObjectStorageException
 
 
 class MockOSClient:
@@ -21,9 +28,15 @@ class MockOSClient:
     def object_put(self, *args, **kwargs):
         return True
 
+    def object_put_bytes(self, *args, **kwargs):
+        return True
+
     def object_delete(self, *args, **kwargs):
         return True
 
+    def with_metrics(self, metrics):
+        return self
+
 
 def test_crypto_key_file_loading():
     """Test that crypto key is loaded from file"""
@@ -33,7 +46,7 @@ def test_crypto_key_file_loading():
         crypto_key_file.write_text('1234567890123456\n')
 
         # Create a config with crypto_key_file
-        with patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient()):
+        with patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient()):
             client_cli = ClientCLI(**{
                 'module': 'file',
                 'command': 'list',
@@ -49,7 +62,7 @@ def test_crypto_key_file_loading():
 def test_crypto_key_file_not_found():
     """Test that missing crypto key file raises error"""
     with pytest.raises(CLIException) as error:
-        with patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient()):
+        with patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient()):
             ClientCLI(**{
                 'module': 'file',
                 'command': 'list',
@@ -63,7 +76,7 @@ def test_crypto_key_file_not_found():
 
 def test_directory_backup_basic(mocker):
     """Test basic directory backup functionality"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         # Create test directory with files
@@ -107,7 +120,7 @@ def test_directory_backup_basic(mocker):
 
 def test_directory_backup_with_skip_files(mocker):
     """Test directory backup with skip_files pattern"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         test_dir = Path(tmp_dir) / 'test_backup'
@@ -150,7 +163,7 @@ def test_directory_backup_with_skip_files(mocker):
 
 def test_directory_backup_with_cache_file(mocker):
     """Test directory backup with cache file"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         test_dir = Path(tmp_dir) / 'test_backup'
@@ -196,7 +209,7 @@ def test_directory_backup_with_cache_file(mocker):
 
 def test_directory_backup_with_symlinks(mocker):
     """Test that symlinks are skipped during directory backup"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         test_dir = Path(tmp_dir) / 'test_backup'
@@ -243,7 +256,7 @@ def test_directory_backup_with_symlinks(mocker):
 
 def test_cache_file_path_expansion(mocker):
     """Test that cache_file is converted to Path object"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         test_dir = Path(tmp_dir) / 'test_backup'
@@ -285,7 +298,7 @@ def test_cache_file_path_expansion(mocker):
 
 def test_cli_exit_with_cache_file(mocker):
     """Test that cache file is written on exit"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         test_dir = Path(tmp_dir) / 'test_backup'
@@ -327,7 +340,7 @@ def test_cli_exit_with_cache_file(mocker):
 
 def test_work_directory_from_config(mocker):
     """Test that work_directory is read from config"""
-    mocker.patch('backup_tool.client.OCIObjectStorageClient', return_value=MockOSClient())
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
 
     with TemporaryDirectory() as tmp_dir:
         crypto_key_file = Path(tmp_dir) / 'crypto-key'
@@ -348,3 +361,835 @@ def test_work_directory_from_config(mocker):
         # Verify work directory was created
         assert work_dir.exists()
         assert client_cli.client.work_directory == work_dir
+
+
+def test_directory_backup_metrics_files(mocker):
+    """Test that metrics are collected per stage and written when configured"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        (test_dir / 'file1.txt').write_text('content1')
+        (test_dir / 'file2.txt').write_text('content2')
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        metrics_file = Path(tmp_dir) / 'metrics.json'
+        metrics_textfile = Path(tmp_dir) / 'backup.prom'
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'backup',
+            'dir_paths': [str(test_dir)],
+            'overwrite': False,
+            'skip_files': None,
+            'cache_file': None,
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'work_directory': str(Path(tmp_dir) / 'work'),
+                'metrics_file': str(metrics_file),
+                'metrics_textfile': str(metrics_textfile),
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+        client_cli.run_command()
+
+        stages = json.loads(metrics_file.read_text())['stages']
+        assert stages['scan']['files'] == 2
+        for stage in ['md5', 'encrypt', 'upload']:
+            assert stages[stage]['files'] == 2
+        assert stages['md5']['bytes'] == 16
+        assert 'command="directory_backup"' in metrics_textfile.read_text()
+
+
+def test_profile_command(mocker):
+    """Test that profiling writes pstats and summary next to the log file"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        log_dir = Path(tmp_dir) / 'logs'
+        log_dir.mkdir()
+        client_cli = ClientCLI(**{
+            'module': 'file',
+            'command': 'md5',
+            'local_file': __file__,
+            'profile': True,
+            'profile_memory': True,
+            'profile_top': 5,
+            'general': {
+                'logging_file': str(log_dir / 'backup-tool.log'),
+            },
+            'oci': {},
+        })
+        client_cli.run_command()
+
+        pstats_files = list(log_dir.glob('backup-tool-profile-file_md5-*.pstats'))
+        assert len(pstats_files) == 1
+        summary = pstats_files[0].with_suffix('.txt').read_text()
+        assert 'Top 5 functions by cumulative' in summary
+        assert 'Peak traced memory' in summary
+        assert 'file_md5' in summary
+
+
+def test_file_list_streaming(mocker, capsys):
+    """Test that list commands stream compact json or json lines with filters"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MockOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'docs'
+        test_dir.mkdir()
+        (test_dir / 'a.txt').write_text('content a')
+        (test_dir / 'b.txt').write_text('content b')
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        database_file = Path(tmp_dir) / 'backup.sql'
+
+        def run(module, command, **kwargs):
+            with ClientCLI(**{
+                'module': module,
+                'command': command,
+                'general': {
+                    'crypto_key_file': str(crypto_key_file),
+                    'database_file': str(database_file),
+                    'relative_path': tmp_dir,
+                },
+                'oci': {
+                    'namespace': 'test-namespace',
+                    'bucket': 'test-bucket',
+                },
+            } | kwargs) as client_cli:
+                client_cli.run_command()
+            return capsys.readouterr().out
+
+        run('file', 'backup', local_file=str(test_dir / 'a.txt'))
+        # Local file entry without a backup
+        with ClientCLI(module='file', command='list', general={'database_file': str(database_file)}) as client_cli:
+            client_cli.client.db_session.add(BackupEntryLocalFile(local_file_path='other/c.txt'))
+            client_cli.client.db_session.commit()
+
+        files = json.loads(run('file', 'list'))
+        assert [item['local_file_path'] for item in files] == ['docs/a.txt', 'other/c.txt']
+
+        lines = run('file', 'list', output_format='jsonl', path_prefix='docs').splitlines()
+        assert [json.loads(line)['local_file_path'] for line in lines] == ['docs/a.txt']
+
+        files = json.loads(run('file', 'list', has_backup=False))
+        assert [item['local_file_path'] for item in files] == ['other/c.txt']
+        files = json.loads(run('file', 'list', has_backup=True, min_id=1, max_id=1))
+        assert [item['local_file_path'] for item in files] == ['docs/a.txt']
+        assert run('file', 'list', min_id=10) == '[]\n'
+
+        backups = json.loads(run('backup', 'list'))
+        assert len(backups) == 1
+        assert run('backup', 'list', output_format='jsonl', max_id=0) == ''
+
+
+class MemoryOSClient(MockOSClient):
+    def __init__(self, *args, **kwargs):
+        self.objects = {}
+
+    def object_put(self, namespace, bucket, object_name, file_name, **kwargs):
+        self.objects[object_name] = Path(file_name).read_bytes()
+        return True
+
+    def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+        self.objects[object_name] = data
+        return True
+
+    def object_get(self, namespace, bucket, object_name, file_name, **kwargs):
+        Path(file_name).write_bytes(self.objects[object_name])
+        return True
+
+    def object_put_stream(self, namespace, bucket, object_name, reader, **kwargs):
+        self.objects[object_name] = reader.read()
+        return True
+
+    def object_delete(self, namespace, bucket, object_name):
+        del self.objects[object_name]
+        return True
+
+
+def test_directory_backup_hardlinks(mocker):
+    """Test that each inode is hashed once and restore recreates hardlinks"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MemoryOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        (test_dir / 'snapshot').mkdir(parents=True)
+        (test_dir / 'file1.txt').write_text('linked content')
+        os.link(test_dir / 'file1.txt', test_dir / 'snapshot' / 'file1.txt')
+        (test_dir / 'file2.txt').write_text('content2')
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        metrics_file = Path(tmp_dir) / 'metrics.json'
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'backup',
+            'dir_paths': [str(test_dir)],
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                'relative_path': str(test_dir),
+                'work_directory': str(Path(tmp_dir) / 'work'),
+                'metrics_file': str(metrics_file),
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+        client_cli.run_command()
+
+        stages = json.loads(metrics_file.read_text())['stages']
+        assert stages['scan']['files'] == 3
+        assert stages['md5']['files'] == 2
+        assert stages['upload']['files'] == 2
+
+        files = {item['local_file_path']: item for item in client_cli.client.file_list()}
+        assert len(files) == 3
+        linked = [files['file1.txt'], files['snapshot/file1.txt']]
+        assert linked[0]['backup_entry_id'] == linked[1]['backup_entry_id']
+        first, second = sorted(linked, key=lambda item: item['id'])
+        assert first['hardlink_local_file_id'] is None
+        assert second['hardlink_local_file_id'] == first['id']
+        assert files['file2.txt']['hardlink_local_file_id'] is None
+
+        # Link target is missing, the file is downloaded and the target is not restored along with it
+        first_path = test_dir / first['local_file_path']
+        second_path = test_dir / second['local_file_path']
+        first_path.unlink()
+        second_path.unlink()
+        assert client_cli.client.file_restore(second['id']) == True
+        assert second_path.read_text() == 'linked content'
+        assert not first_path.exists()
+
+        # Restore recreates the link to a target with the expected content instead of writing the data again
+        second_path.unlink()
+        assert client_cli.client.file_restore(first['id']) == True
+        assert client_cli.client.file_restore(second['id']) == True
+        assert first_path.read_text() == 'linked content'
+        assert os.path.samefile(first_path, second_path)
+
+
+def test_directory_backup_rename(mocker):
+    """Test that renamed files move their entries without hashing or uploading"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MemoryOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        (test_dir / 'photos').mkdir(parents=True)
+        (test_dir / 'photos' / 'a.jpg').write_text('picture a')
+        (test_dir / 'photos' / 'b.jpg').write_text('picture b')
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        metrics_file = Path(tmp_dir) / 'metrics.json'
+
+        def backup():
+            client_cli = ClientCLI(**{
+                'module': 'directory',
+                'command': 'backup',
+                'dir_paths': [str(test_dir)],
+                'general': {
+                    'crypto_key_file': str(crypto_key_file),
+                    'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                    'relative_path': str(test_dir),
+                    'work_directory': str(Path(tmp_dir) / 'work'),
+                    'metrics_file': str(metrics_file),
+                },
+                'oci': {
+                    'namespace': 'test-ns',
+                    'bucket': 'test-bucket',
+                },
+            })
+            client_cli.run_command()
+            return client_cli, json.loads(metrics_file.read_text())['stages']
+
+        client_cli, _stages = backup()
+        before = {item['local_file_path']: item for item in client_cli.client.file_list()}
+
+        (test_dir / 'photos').rename(test_dir / 'pictures')
+        client_cli, stages = backup()
+        assert 'md5' not in stages
+        assert 'upload' not in stages
+        assert stages['rename']['files'] == 2
+
+        after = {item['local_file_path']: item for item in client_cli.client.file_list()}
+        assert sorted(after) == ['pictures/a.jpg', 'pictures/b.jpg']
+        assert after['pictures/a.jpg']['id'] == before['photos/a.jpg']['id']
+        assert after['pictures/a.jpg']['backup_entry_id'] == before['photos/a.jpg']['backup_entry_id']
+        assert len(client_cli.client.backup_list()) == 2
+
+
+@pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only available on linux')
+def test_directory_watch(mocker):
+    """Test that watch backs up existing files, then changed files once they settle, through the backup pipeline"""
+    puts = []
+    class RecordingOSClient(MemoryOSClient):
+        def object_put(self, namespace, bucket, object_name, file_name, **kwargs):
+            puts.append('staged')
+            return super().object_put(namespace, bucket, object_name, file_name, **kwargs)
+
+        def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+            puts.append('memory')
+            return super().object_put_bytes(namespace, bucket, object_name, data, **kwargs)
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=RecordingOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        (test_dir / 'existing.txt').write_text('existing')
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'watch',
+            'dir_paths': [str(test_dir)],
+            'debounce': 0.2,
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'relative_path': str(test_dir),
+                'work_directory': str(Path(tmp_dir) / 'work'),
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+
+        # Events are scripted, files change, then stay quiet for the debounce, then watching is interrupted
+        timeouts = []
+        def poll(timeout=None):
+            timeouts.append(timeout)
+            if len(timeouts) == 1:
+                (test_dir / 'new').mkdir()
+                (test_dir / 'new' / 'created.txt').write_text('created')
+                (test_dir / 'existing.txt').write_text('existing changed')
+                return {str((test_dir / 'new' / 'created.txt').resolve()), str((test_dir / 'existing.txt').resolve())}, False
+            if len(timeouts) == 2:
+                time.sleep(timeout)
+                return set(), False
+            raise KeyboardInterrupt()
+        mocker.patch('backup_tool.cli.client.RecursiveWatcher.poll', side_effect=poll)
+        client_cli.run_command()
+
+        # Waits for events without a timeout until something changes, then for the debounce
+        assert timeouts == [None, 0.2, None]
+        files = {item['local_file_path'] for item in client_cli.client.file_list()}
+        assert files == {'existing.txt', 'new/created.txt'}
+        # Existing file uploaded on the initial scan, new file when it settled
+        assert len(client_cli.client.backup_list()) == 2
+        # Small changed files are encrypted in memory like in directory backup, nothing is staged
+        assert puts == ['memory', 'memory']
+        runs = client_cli.client.run_list()
+        assert runs[0]['command'] == 'directory_watch'
+        assert runs[0]['files_uploaded'] == 2
+
+
+def test_serve(mocker):
+    """Test that the server runs requests with its warm client and the cli sends commands to it"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MemoryOSClient())
+    servers = []
+
+    class RecordedServer(BackupServer):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            servers.append(self)
+    mocker.patch('backup_tool.cli.client.BackupServer', RecordedServer)
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        (test_dir / 'file1.txt').write_text('content1')
+        (test_dir / 'file2.txt').write_text('content2')
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        socket_path = Path(tmp_dir) / 'server.sock'
+        general = {
+            'crypto_key_file': str(crypto_key_file),
+            'database_file': str(Path(tmp_dir) / 'backup.sql'),
+            'relative_path': str(test_dir),
+            'work_directory': str(Path(tmp_dir) / 'work'),
+            'server_socket': str(socket_path),
+        }
+        oci = {'namespace': 'test-ns', 'bucket': 'test-bucket'}
+
+        # No server listening, command runs in this process
+        assert run_on_server({'module': 'file', 'command': 'backup', 'general': general}) == False
+
+        server_cli = ClientCLI(module='serve', command='start', general=dict(general), oci=dict(oci))
+        server_thread = threading.Thread(target=server_cli.run_command)
+        server_thread.start()
+        for _ in range(100):
+            if servers and socket_path.is_socket():
+                break
+            time.sleep(0.05)
+        try:
+            # Only the owner may connect, and a running server is not replaced
+            assert socket_path.stat().st_mode & 0o777 == 0o600
+            with pytest.raises(BackupToolException) as error:
+                BackupServer(socket_path, server_cli.client, None)
+            assert 'already running' in str(error.value)
+
+            # Commands not run by the server stay in this process
+            assert run_on_server({'module': 'file', 'command': 'list', 'general': general}) == False
+
+            assert run_on_server({'module': 'directory', 'command': 'backup', 'dir_paths': [str(test_dir)],
+                                  'general': general}) == True
+            # Requests keep their own metrics, the run history only counts what the request did
+            assert 'upload' not in server_cli.client.metrics.summary()['stages']
+            assert server_cli.client.run_list()[0]['files_uploaded'] == 2
+            output = io.StringIO()
+            response = send_request(socket_path, server_request_args({'module': 'file', 'command': 'restore', 'local_file_id': 1}), output)
+            assert response == {'status': 'success'}
+            assert output.getvalue() == 'true\n'
+
+            response = send_request(socket_path, {'module': 'file', 'command': 'list'}, output)
+            assert response['status'] == 'failed'
+            with pytest.raises(CLIException) as error:
+                run_on_server({'module': 'file', 'command': 'backup', 'local_file': str(test_dir / 'missing.txt'),
+                               'general': general})
+            assert 'Server request failed' in str(error.value)
+        finally:
+            servers[0].shutdown()
+            server_thread.join()
+        assert not socket_path.exists()
+        assert len(server_cli.client.file_list()) == 2
+
+        # Socket left by a server that did not shut down cleanly is replaced
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as stale:
+            stale.bind(str(socket_path))
+        with BackupServer(socket_path, server_cli.client, None):
+            assert socket_path.stat().st_mode & 0o777 == 0o600
+        assert not socket_path.exists()
+
+
+def test_directory_backup_workers(mocker):
+    """Test concurrent uploads with size scheduling back up every file, including hardlinks"""
+    os_client = MemoryOSClient()
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=os_client)
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        contents = {f'file{index}.txt': f'content{index}' * (index * 100 + 1) for index in range(10)}
+        for name, content in contents.items():
+            (test_dir / name).write_text(content)
+        os.link(test_dir / 'file9.txt', test_dir / 'link9.txt')
+        contents['link9.txt'] = contents['file9.txt']
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        metrics_file = Path(tmp_dir) / 'metrics.json'
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'backup',
+            'dir_paths': [str(test_dir)],
+            'workers': 3,
+            'schedule_policy': 'balanced',
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                'relative_path': str(test_dir),
+                'work_directory': str(Path(tmp_dir) / 'work'),
+                'metrics_file': str(metrics_file),
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+        client_cli.run_command()
+
+        stages = json.loads(metrics_file.read_text())['stages']
+        assert stages['upload']['files'] == 10
+        assert len(os_client.objects) == 10
+        assert client_cli.cache_json['backup']['pending_upload'] == {}
+        assert list((Path(tmp_dir) / 'work').iterdir()) == []
+
+        files = {item['local_file_path']: item for item in client_cli.client.file_list()}
+        assert set(files) == set(contents)
+        assert files['file9.txt']['backup_entry_id'] == files['link9.txt']['backup_entry_id']
+
+        for name, content in contents.items():
+            (test_dir / name).unlink()
+        for name, content in contents.items():
+            assert client_cli.client.file_restore(files[name]['id']) == True
+            assert (test_dir / name).read_text() == content
+
+
+def test_directory_restore(mocker):
+    """Test bulk restore downloads each backup entry once and fans out to every path"""
+    os_client = MemoryOSClient()
+    downloads = []
+    object_get = os_client.object_get
+    def counting_get(namespace, bucket, object_name, file_name, **kwargs):
+        downloads.append(object_name)
+        return object_get(namespace, bucket, object_name, file_name, **kwargs)
+    os_client.object_get = counting_get
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=os_client)
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        (test_dir / 'sub').mkdir(parents=True)
+        contents = {
+            'same1.txt': 'shared content',
+            'sub/same2.txt': 'shared content',
+            'other.txt': 'other content',
+            'link1.txt': 'linked content',
+        }
+        for name, content in contents.items():
+            (test_dir / name).write_text(content)
+        os.link(test_dir / 'link1.txt', test_dir / 'sub' / 'link2.txt')
+        contents['sub/link2.txt'] = contents['link1.txt']
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'backup',
+            'dir_paths': [str(test_dir)],
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                'relative_path': str(test_dir),
+                'work_directory': str(Path(tmp_dir) / 'work'),
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+        client_cli.run_command()
+        client = client_cli.client
+
+        # Point duplicate content at one backup entry, as backing up a file whose md5 matches does
+        session = client.db_session
+        same1 = session.query(BackupEntryLocalFile).filter(BackupEntryLocalFile.local_file_path == 'same1.txt').one()
+        same2 = session.query(BackupEntryLocalFile).filter(BackupEntryLocalFile.local_file_path == 'sub/same2.txt').one()
+        same2.backup_entry_id = same1.backup_entry_id
+        session.commit()
+
+        for name in contents:
+            (test_dir / name).unlink()
+        counts = client.directory_restore()
+        assert counts['downloaded'] == 3
+        assert counts['hardlink'] == 1
+        assert counts['reflink'] + counts['copy_file_range'] + counts['copy'] == 1
+        assert counts['failed'] == 0
+        assert len(downloads) == 3
+        for name, content in contents.items():
+            assert (test_dir / name).read_text() == content
+        assert os.path.samefile(test_dir / 'link1.txt', test_dir / 'sub' / 'link2.txt')
+        assert not os.path.samefile(test_dir / 'same1.txt', test_dir / 'sub' / 'same2.txt')
+
+        # Files already restored are skipped, missing ones copied from a file on disk without downloading
+        (test_dir / 'sub' / 'same2.txt').unlink()
+        counts = client.directory_restore(hardlink=True)
+        assert counts['skipped'] == 4
+        assert counts['hardlink'] == 1
+        assert counts['downloaded'] == 0
+        assert len(downloads) == 3
+        assert os.path.samefile(test_dir / 'same1.txt', test_dir / 'sub' / 'same2.txt')
+
+        # Prefix limits the files restored
+        (test_dir / 'other.txt').unlink()
+        counts = client.directory_restore(path_prefix='sub/')
+        assert counts['skipped'] == 2
+        assert counts['downloaded'] == 0
+        assert not (test_dir / 'other.txt').exists()
+
+
+def test_restore_preserve_metadata(mocker):
+    """Test restore reapplies mode and mtime, and caches metadata so the next backup skips restored files"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MemoryOSClient())
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        (test_dir / 'file1.txt').write_text('content1')
+        (test_dir / 'file2.txt').write_text('content2')
+        os.chmod(test_dir / 'file1.txt', 0o640)
+        os.utime(test_dir / 'file1.txt', ns=(1_000_000_000_123, 1_000_000_000_123))
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+
+        def run(command, **kwargs):
+            client_cli = ClientCLI(**{
+                'module': 'directory',
+                'command': command,
+                'general': {
+                    'crypto_key_file': str(crypto_key_file),
+                    'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                    'relative_path': str(test_dir),
+                    'work_directory': str(Path(tmp_dir) / 'work'),
+                    'metrics_file': str(Path(tmp_dir) / 'metrics.json'),
+                },
+                'oci': {
+                    'namespace': 'test-ns',
+                    'bucket': 'test-bucket',
+                },
+                **kwargs,
+            })
+            client_cli.run_command()
+            return client_cli.client
+
+        client = run('backup', dir_paths=[str(test_dir)])
+        files = {item['local_file_path']: item for item in client.file_list()}
+        assert files['file1.txt']['original_mode'] == 0o640
+        assert files['file1.txt']['original_mtime_ns'] == 1_000_000_000_123
+
+        (test_dir / 'file1.txt').unlink()
+        (test_dir / 'file2.txt').unlink()
+        client = run('restore', preserve_metadata=True)
+        file1_stat = os.stat(test_dir / 'file1.txt')
+        assert file1_stat.st_mode & 0o777 == 0o640
+        assert file1_stat.st_mtime_ns == 1_000_000_000_123
+        files = {item['local_file_path']: item for item in client.file_list()}
+        assert files['file1.txt']['original_mtime_ns'] == 1_000_000_000_123
+        assert files['file2.txt']['cached_mtime_ns'] == os.stat(test_dir / 'file2.txt').st_mtime_ns
+
+        # Backup right after restore only compares metadata
+        run('backup', dir_paths=[str(test_dir)])
+        stages = json.loads((Path(tmp_dir) / 'metrics.json').read_text())['stages']
+        assert 'md5' not in stages
+        assert stages['skip']['files'] == 2
+        assert 'upload' not in stages
+
+        # Single file restore without preserving metadata still caches it
+        (test_dir / 'file2.txt').unlink()
+        assert client.file_restore(files['file2.txt']['id']) == True
+        local_file = client.db_session.get(BackupEntryLocalFile, files['file2.txt']['id'])
+        assert local_file.cached_mtime_ns == os.stat(test_dir / 'file2.txt').st_mtime_ns
+        assert local_file.original_mtime_ns == files['file2.txt']['original_mtime_ns']
+
+
+def test_file_backup_from_file(mocker, capsys):
+    """Test backing up listed files through the pipeline, with a json line per path"""
+    class FailingOSClient(MemoryOSClient):
+        def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+            if len(data) > 5000:
+                raise ObjectStorageException('Upload failed')
+            return super().object_put_bytes(namespace, bucket, object_name, data, **kwargs)
+    os_client = FailingOSClient()
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=os_client)
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        (test_dir / 'file1.txt').write_text('content1')
+        (test_dir / 'file 2.txt').write_text('content2')
+        (test_dir / 'linked.txt').write_text('linked content')
+        os.link(test_dir / 'linked.txt', test_dir / 'link.txt')
+        (test_dir / 'big.txt').write_text('x' * 10000)
+        (test_dir / 'symlink.txt').symlink_to(test_dir / 'file1.txt')
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        list_file = Path(tmp_dir) / 'files.list'
+        names = ['file1.txt', 'file 2.txt', 'linked.txt', 'link.txt', 'big.txt', 'symlink.txt', 'missing.txt']
+        list_file.write_bytes(b'\0'.join(str(test_dir / name).encode() for name in names) + b'\0')
+
+        def run(from_file, null):
+            client_cli = ClientCLI(**{
+                'module': 'file',
+                'command': 'backup',
+                'from_file': from_file,
+                'null': null,
+                'workers': 2,
+                'general': {
+                    'crypto_key_file': str(crypto_key_file),
+                    'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                    'relative_path': str(test_dir),
+                    'work_directory': str(Path(tmp_dir) / 'work'),
+                },
+                'oci': {
+                    'namespace': 'test-ns',
+                    'bucket': 'test-bucket',
+                },
+            })
+            client_cli.run_command()
+            results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+            return client_cli, {Path(result['path']).name: result for result in results}
+
+        client_cli, results = run(str(list_file), True)
+        assert {name: result['status'] for name, result in results.items()} == {
+            'file1.txt': 'uploaded',
+            'file 2.txt': 'uploaded',
+            'linked.txt': 'uploaded',
+            'link.txt': 'hardlink',
+            'big.txt': 'failed',
+            'symlink.txt': 'ignored',
+            'missing.txt': 'failed',
+        }
+        assert results['big.txt']['error'] == 'Upload failed'
+        assert len(os_client.objects) == 3
+        # Failed upload does not leave its encrypted file behind
+        assert list((Path(tmp_dir) / 'work').iterdir()) == []
+        files = {item['local_file_path']: item for item in client_cli.client.file_list()}
+        assert files['linked.txt']['backup_entry_id'] == files['link.txt']['backup_entry_id']
+        runs = client_cli.client.run_list()
+        assert runs[0]['command'] == 'file_backup'
+
+        # Newline delimited list on stdin, unchanged files are only compared by metadata
+        stdin = io.TextIOWrapper(io.BytesIO(f'{test_dir / "file1.txt"}\n{test_dir / "file 2.txt"}\n'.encode()))
+        mocker.patch('sys.stdin', stdin)
+        _, results = run('-', False)
+        assert {name: result['status'] for name, result in results.items()} == {'file1.txt': 'unchanged', 'file 2.txt': 'unchanged'}
+
+
+def test_file_backup_arguments(mocker):
+    """Test file backup needs exactly one of a local file or a file list"""
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=MemoryOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        for kwargs in ({}, {'local_file': 'file', 'from_file': 'list'}):
+            client_cli = ClientCLI(**{
+                'module': 'file',
+                'command': 'backup',
+                'general': {
+                    'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                    'work_directory': str(Path(tmp_dir) / 'work'),
+                },
+                **kwargs,
+            })
+            with pytest.raises(CLIException):
+                client_cli.run_command()
+        assert server_request_args({'module': 'file', 'command': 'backup', 'from_file': '-'}) is None
+        assert server_request_args({'module': 'file', 'command': 'backup', 'from_file': 'list'})['from_file'] == os.path.abspath('list')
+
+
+def test_file_backup_stdin(mocker):
+    """Test backing up stdin under a logical name, then restoring it"""
+    os_client = MemoryOSClient()
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=os_client)
+
+    with TemporaryDirectory() as tmp_dir:
+        restore_dir = Path(tmp_dir) / 'restore'
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        dump = os.urandom(100000)
+
+        def run(data, **kwargs):
+            mocker.patch('sys.stdin', io.TextIOWrapper(io.BytesIO(data)))
+            client_cli = ClientCLI(**{
+                'module': 'file',
+                'command': 'backup',
+                'stdin': True,
+                'name': 'dumps/db.sql',
+                'general': {
+                    'crypto_key_file': str(crypto_key_file),
+                    'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                    'relative_path': str(restore_dir),
+                    'work_directory': str(Path(tmp_dir) / 'work'),
+                },
+                'oci': {
+                    'namespace': 'test-ns',
+                    'bucket': 'test-bucket',
+                },
+                **kwargs,
+            })
+            client_cli.run_command()
+            return client_cli.client
+
+        client = run(dump)
+        assert len(os_client.objects) == 1
+        # Nothing is staged in the work directory
+        assert not (Path(tmp_dir) / 'work').exists() or list((Path(tmp_dir) / 'work').iterdir()) == []
+        local_file = client.file_list()[0]
+        assert local_file['local_file_path'] == 'dumps/db.sql'
+        assert local_file['from_stream'] == True
+        backup_entry = client.backup_list()[0]
+        assert backup_entry['original_size'] == 100000
+
+        # Stream entries have no file on disk, cleanup keeps them
+        assert client.file_cleanup() == []
+
+        assert client.file_restore(local_file['id']) == True
+        assert (restore_dir / 'dumps' / 'db.sql').read_bytes() == dump
+        assert utils.md5(restore_dir / 'dumps' / 'db.sql') == backup_entry['original_md5_checksum']
+
+        # Replacing needs overwrite, the same content is not stored twice
+        with pytest.raises(BackupToolException):
+            run(dump)
+        run(dump, overwrite=True)
+        assert len(os_client.objects) == 1
+        client = run(b'new dump', overwrite=True)
+        assert len(os_client.objects) == 2
+        assert client.backup_list()[1]['original_size'] == len(b'new dump')
+
+        with pytest.raises(CLIException):
+            run(dump, name=None)
+
+
+def test_directory_backup_staging_budget(mocker):
+    """Test encrypted files staged by the pipeline stay within the budget, and larger files are streamed"""
+    os_client = MemoryOSClient()
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient', return_value=os_client)
+
+    with TemporaryDirectory() as tmp_dir:
+        test_dir = Path(tmp_dir) / 'test_backup'
+        test_dir.mkdir()
+        contents = {f'file{index}.bin': os.urandom(1000) for index in range(6)}
+        contents['large.bin'] = os.urandom(10000)
+        for name, content in contents.items():
+            (test_dir / name).write_bytes(content)
+
+        crypto_key_file = Path(tmp_dir) / 'crypto-key'
+        crypto_key_file.write_text('1234567890123456')
+        work_dir = Path(tmp_dir) / 'work'
+
+        client_cli = ClientCLI(**{
+            'module': 'directory',
+            'command': 'backup',
+            'dir_paths': [str(test_dir)],
+            'workers': 4,
+            'general': {
+                'crypto_key_file': str(crypto_key_file),
+                'database_file': str(Path(tmp_dir) / 'backup.sql'),
+                'relative_path': str(test_dir),
+                'work_directory': str(work_dir),
+                'staging_budget': 2500,
+                'staging_reserve': 0,
+                'small_file_threshold': 0,
+            },
+            'oci': {
+                'namespace': 'test-ns',
+                'bucket': 'test-bucket',
+            },
+        })
+        staged_counts = []
+        encrypt = client_cli.client._file_backup_encrypt
+        def counting_encrypt(*args, **kwargs):
+            result = encrypt(*args, **kwargs)
+            staged_counts.append(len(list(work_dir.iterdir())))
+            return result
+        client_cli.client._file_backup_encrypt = counting_encrypt
+        stream = client_cli.client._file_backup_put_stream
+        streamed = []
+        def recording_stream(local_file_path, *args, **kwargs):
+            streamed.append(local_file_path.name)
+            return stream(local_file_path, *args, **kwargs)
+        client_cli.client._file_backup_put_stream = recording_stream
+        client_cli.run_command()
+
+        # Each encrypted copy of 1000 bytes takes 1032, two fit the budget
+        assert len(staged_counts) == 6
+        assert max(staged_counts) <= 2
+        assert streamed == ['large.bin']
+        assert len(os_client.objects) == 7
+        assert list(work_dir.iterdir()) == []
+
+        files = {item['local_file_path']: item for item in client_cli.client.file_list()}
+        for name, content in contents.items():
+            (test_dir / name).unlink()
+            assert client_cli.client.file_restore(files[name]['id']) == True
+            assert (test_dir / name).read_bytes() == content
@@ -1,9 +1,13 @@
 import os
+from pathlib import Path
 from tempfile import TemporaryDirectory
+import pytest
 from sqlalchemy import create_engine
 
+from backup_tool import database
 from backup_tool import utils
 from backup_tool.client import BackupClient
+from backup_tool.exception import BackupToolClientException, ObjectStorageException
 from backup_tool.oci_client import ObjectStorageClient
 
 # Needs to be 16 chars long
@@ -20,12 +24,15 @@ class MockOSClient():
     def object_put(self, *args, **kwargs):
         return True
 
+    def object_put_bytes(self, *args, **kwargs):
+        return True
+
     def object_delete(self, *args, **kwargs):
         return True
 
 
 def test_object_list(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -44,7 +51,7 @@ def test_object_list(mocker):
 
 
 def test_file_backup_overwrite(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -75,13 +82,16 @@ def test_file_restore(mocker):
         def object_put(self, *args, **kwargs):
             return True
 
+        def object_put_bytes(*args, **kwargs):
+            return True
+
         def object_get(_namespace, _bucket, _object_name, file_name, **kwargs):
             with open(file_name, 'w') as writer:
                 # 'foo' encrypted
                 writer.write('07BzhNET7exJ6qYjitX/AA==')
             return True
 
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSGet)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -101,7 +111,7 @@ def test_file_restore(mocker):
                 client.file_restore(local_file['id'])
 
 def test_file_encrypt(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -118,7 +128,7 @@ def test_file_encrypt(mocker):
                     assert result['original_md5'] == 'q+rAfTwowb755zAALHU+1A=='
 
 def test_file_decrypt(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -136,7 +146,7 @@ def test_file_decrypt(mocker):
                     assert read_data == '1234567890123456'
 
 def test_file_cleanup(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -159,7 +169,7 @@ def test_file_cleanup(mocker):
             assert len(backup_list) == 1
 
 def test_backup_cleanup(mocker):
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -186,7 +196,7 @@ def test_backup_cleanup(mocker):
 
 def test_metadata_caching(mocker):
     '''Test that metadata caching speeds up backups for unchanged files'''
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -221,7 +231,7 @@ def test_metadata_caching(mocker):
 def test_metadata_cache_detects_changes(mocker):
     '''Test that metadata cache detects when files change'''
     import time
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -250,7 +260,7 @@ def test_metadata_cache_detects_changes(mocker):
 
 def test_force_checksum_flag(mocker):
     '''Test that force_checksum flag forces MD5 calculation'''
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -276,7 +286,7 @@ def test_force_checksum_flag(mocker):
 def test_metadata_cache_updates_after_backup(mocker):
     '''Test that metadata cache is updated after successful backup'''
     import time
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -310,7 +320,7 @@ def test_metadata_cache_updates_after_backup(mocker):
 def test_metadata_cache_populated_when_none(mocker):
     '''Test that metadata cache is populated even when initially None'''
     from backup_tool.database import BackupEntryLocalFile
-    mocker.patch('backup_tool.client.OCIObjectStorageClient',
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
                  return_value=MockOSClient)
     with TemporaryDirectory() as tmp_dir:
         with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
@@ -345,4 +355,620 @@ def test_metadata_cache_populated_when_none(mocker):
                 # Verify metadata was populated
                 file_list = client.file_list()
                 assert file_list[0]['cached_mtime'] is not None
-                assert file_list[0]['cached_size'] is not None
\ No newline at end of file
+                assert file_list[0]['cached_size'] is not None
+
+
+def test_file_cleanup_directory_grouping(mocker):
+    '''Test cleanup removes missing files and whole missing subtrees in bulk'''
+    import shutil
+    from pathlib import Path
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            data_dir = Path(tmp_dir) / 'data'
+            (data_dir / 'keep').mkdir(parents=True)
+            (data_dir / 'gone' / 'nested').mkdir(parents=True)
+            files = [
+                data_dir / 'keep' / 'one.txt',
+                data_dir / 'keep' / 'two.txt',
+                data_dir / 'gone' / 'three.txt',
+                data_dir / 'gone' / 'nested' / 'four.txt',
+            ]
+            for count, file_path in enumerate(files):
+                file_path.write_text(f'content {count}')
+                client.file_backup(str(file_path))
+            (data_dir / 'keep' / 'two.txt').unlink()
+            shutil.rmtree(data_dir / 'gone')
+
+            list_directory = mocker.spy(client, '_list_directory')
+            cleaned = client.file_cleanup(dry_run=True, workers=2)
+            assert len(cleaned) == 3
+            # Nested directory is known missing from its parent, never listed
+            listed = [call.args[0] for call in list_directory.call_args_list]
+            assert data_dir / 'gone' / 'nested' not in listed
+            assert len(client.file_list()) == 4
+
+            cleaned = client.file_cleanup()
+            assert len(cleaned) == 3
+            file_list = client.file_list()
+            assert len(file_list) == 1
+            assert file_list[0]['local_file_path'] == str(data_dir / 'keep' / 'one.txt')
+
+def test_file_cleanup_unreadable_directory(mocker):
+    '''Test cleanup keeps local files of directories it cannot list'''
+    from pathlib import Path
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            locked_dir = Path(tmp_dir) / 'locked'
+            locked_dir.mkdir()
+            locked_file = locked_dir / 'one.txt'
+            locked_file.write_text('content')
+            client.file_backup(str(locked_file))
+
+            scandir = os.scandir
+            def locked_scandir(path):
+                if not isinstance(path, int) and Path(path) == locked_dir:
+                    raise PermissionError(13, 'Permission denied', str(path))
+                return scandir(path)
+            mocker.patch('backup_tool.client.os.scandir', side_effect=locked_scandir)
+            assert client.file_cleanup() == []
+            assert len(client.file_list()) == 1
+
+def test_backup_verify_quick(mocker):
+    '''Test quick verify reports missing, mismatched and unknown objects from the listing'''
+    from backup_tool.database import BackupEntry
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            for name, md5 in [('b-object', 'md5b'), ('c-object', 'md5c'), ('d-object', 'md5d'), ('f-object', 'md5f')]:
+                client.db_session.add(BackupEntry(uploaded_file_path=name, uploaded_md5_checksum=md5,
+                                                  original_md5_checksum=md5))
+            client.db_session.commit()
+
+            pages = [
+                [{'name': 'a-object', 'md5': 'md5a'}, {'name': 'b-object', 'md5': 'md5b'}],
+                [{'name': 'c-object', 'md5': 'wrong'}, {'name': 'e-object', 'md5': 'md5e'}],
+                [{'name': 'f-object', 'md5': 'abcd-3'}],
+            ]
+            client.os_client.object_list_pages = lambda *_args, **_kwargs: iter(pages)
+            result = client.backup_verify(quick=True)
+            assert result['checked'] == 3
+            assert result['unknown'] == ['a-object', 'e-object']
+            assert [item['uploaded_file_path'] for item in result['missing']] == ['d-object']
+            assert [item['uploaded_file_path'] for item in result['md5_mismatch']] == ['c-object']
+            assert result['unverified_multipart'] == 1
+            with pytest.raises(BackupToolClientException):
+                client.backup_verify(quick=True, deep=True)
+
+def test_backup_verify_deep(mocker):
+    '''Test deep verify decrypts objects in memory and resumes from progress file'''
+    import io
+    import json
+    from contextlib import contextmanager
+    from pathlib import Path
+    from backup_tool import crypto
+    from backup_tool.database import BackupEntry
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            objects = {}
+            for count in range(3):
+                plain_file = Path(tmp_dir) / f'plain-{count}'
+                plain_file.write_bytes(os.urandom(30000 + count))
+                encrypted_file = Path(tmp_dir) / f'encrypted-{count}'
+                original_md5, encrypted_md5 = crypto.encrypt_file(str(plain_file), str(encrypted_file), FAKE_CRYPTO_KEY)
+                objects[f'object-{count}'] = encrypted_file.read_bytes()
+                # Last entry is corrupt in the database
+                if count == 2:
+                    original_md5 = 'not-the-md5'
+                client.db_session.add(BackupEntry(uploaded_file_path=f'object-{count}', uploaded_md5_checksum=encrypted_md5,
+                                                  original_md5_checksum=original_md5))
+            client.db_session.commit()
+
+            @contextmanager
+            def object_get_stream(_namespace, _bucket, object_name):
+                yield io.BytesIO(objects[object_name])
+            client.os_client.object_get_stream = object_get_stream
+
+            progress_file = Path(tmp_dir) / 'progress.json'
+            progress_file.write_text(json.dumps({'checked_through': 1}))
+            result = client.backup_verify(deep=True, progress_file=str(progress_file), bandwidth_limit=10 ** 9, workers=2)
+            assert result['skipped'] == 1
+            assert result['verified'] == 1
+            assert [item['uploaded_file_path'] for item in result['failed']] == ['object-2']
+            # Full pass completed, progress is reset
+            assert not progress_file.exists()
+
+            result = client.backup_verify(deep=True, sample_rate=0)
+            assert result['sampled_out'] == 3
+
+            # Interrupted run keeps entries checked before the interrupted one
+            @contextmanager
+            def interrupted_get_stream(_namespace, _bucket, object_name):
+                if object_name == 'object-2':
+                    raise KeyboardInterrupt()
+                yield io.BytesIO(objects[object_name])
+            client.os_client.object_get_stream = interrupted_get_stream
+            with pytest.raises(KeyboardInterrupt):
+                client.backup_verify(deep=True, progress_file=str(progress_file), workers=1)
+            assert json.loads(progress_file.read_text()) == {'checked_through': 2}
+            assert not Path(f'{progress_file}.tmp').exists()
+
+            client.os_client.object_get_stream = object_get_stream
+            result = client.backup_verify(deep=True, progress_file=str(progress_file), workers=1)
+            assert result['skipped'] == 2
+            assert [item['uploaded_file_path'] for item in result['failed']] == ['object-2']
+            assert not progress_file.exists()
+
+def test_run_history(mocker):
+    '''Test that file backups are recorded in run history with throughput statistics'''
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            with utils.temp_file(tmp_dir) as temp_file:
+                with open(temp_file, 'w') as writer:
+                    writer.write('test content')
+                client.file_backup(temp_file)
+                client.file_backup(temp_file)
+
+            runs = client.run_list()
+            assert len(runs) == 2
+            # Newest first, second run skipped on metadata
+            assert runs[0]['files_skipped'] == 1
+            assert runs[0]['files_uploaded'] == 0
+            assert runs[1]['files_scanned'] == 1
+            assert runs[1]['files_hashed'] == 1
+            assert runs[1]['files_uploaded'] == 1
+            assert runs[1]['bytes_read'] > 0
+            assert runs[1]['bytes_uploaded'] > 0
+            assert 'upload' in runs[1]['stage_durations']
+            assert runs[1]['status'] == 'success'
+
+            assert len(client.run_list(run_command='directory_backup')) == 0
+            assert len(client.run_list(limit=1)) == 1
+
+            stats = client.run_stats()
+            assert stats['file_backup']['runs'] == 2
+            assert 'upload' in stats['file_backup']['mean_stage_seconds']
+            assert client.run_stats(limit=1)['file_backup']['runs'] == 1
+
+def test_lazy_client_construction(mocker):
+    os_client = mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                             return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            # Nothing opened until used
+            assert client._db_session is None
+            assert os_client.call_count == 0
+            assert client.file_list() == []
+            assert os_client.call_count == 0
+            assert client.os_client == MockOSClient
+            assert client.os_client == MockOSClient
+            assert os_client.call_count == 1
+
+            # Schema version recorded, second session skips create_all
+            engine = create_engine(f'sqlite:///{temp_db}')
+            with engine.connect() as connection:
+                assert connection.exec_driver_sql('PRAGMA user_version').scalar() == database.SCHEMA_VERSION
+            create_all = mocker.patch.object(database.BASE.metadata, 'create_all')
+            BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir).file_list()
+            assert create_all.call_count == 0
+
+def test_os_client_requires_bucket(mocker):
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', None, None, tmp_dir)
+        with pytest.raises(BackupToolClientException) as error:
+            client.os_client # pylint:disable=pointless-statement
+        assert 'namespace and bucket required' in str(error.value)
+
+def test_file_duplicates(mocker):
+    '''Test duplicate groups from the database and from disk'''
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            files_dir = os.path.join(tmp_dir, 'files')
+            os.makedirs(os.path.join(files_dir, 'nested'))
+            contents = {
+                'a.txt': 'duplicate content',
+                'nested/b.txt': 'duplicate content',
+                'c.txt': 'unique content 17',
+                'd.txt': 'other',
+            }
+            for name, content in contents.items():
+                with open(os.path.join(files_dir, name), 'w') as writer:
+                    writer.write(content)
+            # Hardlink is the same file, not a duplicate
+            os.link(os.path.join(files_dir, 'd.txt'), os.path.join(files_dir, 'e.txt'))
+            assert client.file_duplicates() == []
+
+            for name in contents:
+                client.file_backup(os.path.join(files_dir, name))
+
+            duplicates = client.file_duplicates()
+            assert len(duplicates) == 1
+            assert duplicates[0]['count'] == 2
+            assert duplicates[0]['size'] == len('duplicate content')
+            assert duplicates[0]['bytes_saveable'] == len('duplicate content')
+            assert len(duplicates[0]['backup_entry_ids']) == 2
+            assert [item['local_file_path'] for item in duplicates[0]['local_files']] == \
+                [os.path.join(files_dir, 'a.txt'), os.path.join(files_dir, 'nested/b.txt')]
+
+            # Disk mode only hashes files with colliding sizes
+            md5_calls = mocker.spy(client, '_local_file_md5')
+            duplicates = client.file_duplicates(dir_paths=[files_dir])
+            assert md5_calls.call_count == 3
+            assert len(duplicates) == 1
+            assert duplicates[0]['bytes_saveable'] == len('duplicate content')
+            assert [item['local_file_path'] for item in duplicates[0]['local_files']] == \
+                [os.path.join(files_dir, 'a.txt'), os.path.join(files_dir, 'nested/b.txt')]
+
+def test_metadata_policies(mocker):
+    '''Test metadata comparison policies and legacy float mtime fallback'''
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        with pytest.raises(BackupToolClientException) as error:
+            BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir, metadata_policy='foo')
+        assert str(error.value).startswith('Invalid metadata policy "foo"')
+
+        nfs_dir = os.path.join(tmp_dir, 'nfs')
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir,
+                              metadata_policy='inode', metadata_policies={tmp_dir: 'strict', nfs_dir: 'mtime'})
+        assert client._get_metadata_policy(os.path.join(nfs_dir, 'foo')) == 'mtime'
+        assert client._get_metadata_policy(os.path.join(tmp_dir, 'foo')) == 'strict'
+        assert client._get_metadata_policy('/somewhere/else') == 'inode'
+
+        temp_file = os.path.join(tmp_dir, 'data.txt')
+        with open(temp_file, 'w') as writer:
+            writer.write('original')
+        assert client.file_backup(temp_file) == True
+        local_file = client.file_list()[0]
+        assert local_file['cached_mtime_ns'] == os.stat(temp_file).st_mtime_ns
+        assert local_file['cached_inode'] == os.stat(temp_file).st_ino
+        assert client.file_backup(temp_file) == False
+
+        # Replace file with same size and mtime, only inode comparison notices
+        mtime_ns = os.stat(temp_file).st_mtime_ns
+        replacement = os.path.join(tmp_dir, 'replacement.txt')
+        with open(replacement, 'w') as writer:
+            writer.write('replaced')
+        os.utime(replacement, ns=(mtime_ns, mtime_ns))
+        os.replace(replacement, temp_file)
+        local_backup_file = client.db_session.get(database.BackupEntryLocalFile, local_file['id'])
+        assert client._check_metadata_changed(temp_file, local_backup_file) == True
+        client.metadata_policies = []
+        client.metadata_policy = 'mtime_ns'
+        assert client._check_metadata_changed(temp_file, local_backup_file) == False
+
+        # Ctime only changes with strict
+        client._update_metadata_cache(temp_file, local_backup_file)
+        local_backup_file.cached_ctime_ns -= 1
+        assert client._check_metadata_changed(temp_file, local_backup_file) == False
+        client.metadata_policy = 'strict'
+        assert client._check_metadata_changed(temp_file, local_backup_file) == True
+
+        # Entries cached before nanosecond columns fall back to float mtime, and get upgraded
+        client._update_metadata_cache(temp_file, local_backup_file)
+        for column in ['cached_mtime_ns', 'cached_ctime_ns', 'cached_inode', 'cached_dev']:
+            setattr(local_backup_file, column, None)
+        client.db_session.commit()
+        assert client._check_metadata_changed(temp_file, local_backup_file) == False
+        assert local_backup_file.cached_mtime_ns == os.stat(temp_file).st_mtime_ns
+        assert local_backup_file.cached_inode == os.stat(temp_file).st_ino
+
+def test_file_restore_metadata_cache(mocker):
+    '''Test restore skips files whose metadata matches the cache without hashing them, unless verify'''
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+        temp_file = os.path.join(tmp_dir, 'data.txt')
+        with open(temp_file, 'w') as writer:
+            writer.write('original')
+        assert client.file_backup(temp_file) == True
+        local_file_id = client.file_list()[0]['id']
+
+        def md5_count():
+            return client.metrics.summary()['stages']['md5']['files']
+        hashed = md5_count()
+        assert client.file_restore(local_file_id) == True
+        assert md5_count() == hashed
+        assert client.file_restore(local_file_id, verify=True) == True
+        assert md5_count() == hashed + 1
+
+        # Changed metadata falls back to comparing md5
+        os.utime(temp_file, ns=(0, 0))
+        assert client.file_restore(local_file_id) == True
+        assert md5_count() == hashed + 2
+
+def test_file_restore_ignored_change(mocker):
+    '''Test a change ignored by backup without overwrite is not trusted by the cache, restore brings back the backed up content'''
+    objects = {}
+    class MemoryOSClient(MockOSClient):
+        def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+            objects[object_name] = data
+            return True
+
+        def object_get(self, namespace, bucket, object_name, file_name, **kwargs):
+            with open(file_name, 'wb') as writer:
+                writer.write(objects[object_name])
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MemoryOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, os.path.join(tmp_dir, 'work'))
+            temp_file = os.path.join(tmp_dir, 'data.txt')
+            with open(temp_file, 'w') as writer:
+                writer.write('original')
+            assert client.file_backup(temp_file) == True
+            with open(temp_file, 'w') as writer:
+                writer.write('modified content')
+            assert client.file_backup(temp_file) == False
+            local_file_id = client.file_list()[0]['id']
+            assert client.file_list()[0]['cached_size'] is None
+
+            def download_count():
+                return client.metrics.summary()['stages'].get('download', {}).get('files', 0)
+            assert client.file_restore(local_file_id) == True
+            assert download_count() == 1
+            with open(temp_file) as reader:
+                assert reader.read() == 'original'
+            # Restored content is cached, so the next restore trusts it
+            assert client.file_restore(local_file_id) == True
+            assert download_count() == 1
+
+def test_staging_decision(mocker):
+    '''Test files are staged, wait or are streamed depending on budget and free space'''
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    disk_usage = mocker.patch('backup_tool.client.shutil.disk_usage')
+    disk_usage.return_value.free = 100000
+    with TemporaryDirectory() as tmp_dir:
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir,
+                              staging_budget=10000, staging_reserve=50000, small_file_threshold=100)
+        assert client._staging_decision(100) == 'memory'
+        # Encrypted copy of 1000 bytes takes 1032
+        assert client._staging_decision(1000) == 'stage'
+        assert client._staging_decision(1000, staged=9000) == 'wait'
+        assert client._staging_decision(20000) == 'stream'
+        client.staging_budget = None
+        assert client._staging_decision(40000) == 'stage'
+        # Staged files still encrypting will take free space
+        assert client._staging_decision(40000, staged=30000, unwritten=30000) == 'wait'
+        # Fits once staged files written to disk are deleted
+        disk_usage.return_value.free = 70000
+        assert client._staging_decision(40000, staged=30000, unwritten=0) == 'wait'
+        # Never fits, even once staged files are deleted
+        assert client._staging_decision(40000, staged=30000, unwritten=30000) == 'stream'
+        assert client._staging_decision(60000) == 'stream'
+
+        # No reserve by default, files fitting the free space are staged
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir, small_file_threshold=100)
+        assert client.staging_reserve == 0
+        assert client._staging_decision(60000) == 'stage'
+
+def test_file_backup_streams_without_staging_space(mocker):
+    '''Test a file larger than the free space of the work directory is encrypted while uploaded'''
+    uploads = {}
+    class StreamOSClient(MockOSClient):
+        def object_put(self, *args, **kwargs):
+            raise AssertionError('File should not be staged')
+
+        def object_put_stream(self, namespace, bucket, object_name, reader, **kwargs):
+            uploads[object_name] = reader.read()
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=StreamOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        work_dir = os.path.join(tmp_dir, 'work')
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, work_dir, staging_budget=100,
+                              small_file_threshold=0)
+        temp_file = os.path.join(tmp_dir, 'data.bin')
+        with open(temp_file, 'wb') as writer:
+            writer.write(os.urandom(5000))
+        assert client.file_backup(temp_file) == True
+        assert os.listdir(work_dir) == []
+        backup_entry = client.backup_list()[0]
+        assert backup_entry['original_size'] == 5000
+        assert backup_entry['original_md5_checksum'] == utils.md5(temp_file)
+        encrypted_file = os.path.join(tmp_dir, 'data.enc')
+        with open(encrypted_file, 'wb') as writer:
+            writer.write(uploads[backup_entry['uploaded_file_path']])
+        decrypted_file = os.path.join(tmp_dir, 'data.out')
+        client.file_decrypt(encrypted_file, decrypted_file)
+        assert utils.md5(decrypted_file) == backup_entry['original_md5_checksum']
+
+def test_file_backup_small_file_in_memory(mocker):
+    '''Test small files are encrypted in memory and uploaded with one put, larger ones are staged'''
+    puts = []
+    class RecordingOSClient(MockOSClient):
+        def object_put(self, namespace, bucket, object_name, file_name, **kwargs):
+            puts.append(('file', object_name))
+            return True
+
+        def object_put_bytes(self, namespace, bucket, object_name, data, md5_sum=None):
+            puts.append(('bytes', object_name))
+            assert md5_sum
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=RecordingOSClient())
+    mocker.patch('backup_tool.client.utils.temp_file', side_effect=AssertionError('Small file should not be staged'))
+    with TemporaryDirectory() as tmp_dir:
+        work_dir = os.path.join(tmp_dir, 'work')
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, work_dir, small_file_threshold=1000)
+        small_file = os.path.join(tmp_dir, 'small.txt')
+        with open(small_file, 'w') as writer:
+            writer.write('small')
+        assert client.file_backup(small_file) == True
+        assert puts[0][0] == 'bytes'
+        backup_entry = client.backup_list()[0]
+        assert backup_entry['original_size'] == 5
+        assert backup_entry['uploaded_file_path'] == puts[0][1]
+
+def test_file_backup_resumes_pending_upload(mocker):
+    '''Test interrupted multipart upload state is kept in the database, and the next backup resumes it from the same encrypted file'''
+    puts = []
+    class InterruptedOSClient(MockOSClient):
+        def object_put(self, namespace, bucket, object_name, file_name, upload_state=None, **kwargs):
+            puts.append((object_name, file_name, upload_state.upload_id, dict(upload_state.parts)))
+            if len(puts) == 1:
+                upload_state.started('upload-1', 10)
+                upload_state.part_uploaded(1, 'etag-1')
+                raise ObjectStorageException('Connection lost')
+            upload_state.part_uploaded(2, 'etag-2')
+            upload_state.clear()
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=InterruptedOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir, small_file_threshold=0)
+            local_file = os.path.join(tmp_dir, 'large.txt')
+            with open(local_file, 'w') as writer:
+                writer.write(utils.random_string(length=124))
+            with pytest.raises(ObjectStorageException):
+                client.file_backup(local_file)
+            pending_upload = client.db_session.query(database.PendingUpload).one()
+            assert pending_upload.upload_id == 'upload-1'
+            assert pending_upload.local_file_path == local_file
+            assert os.path.exists(pending_upload.encrypted_file_path)
+
+            assert client.file_backup(local_file) == True
+            # Same object and encrypted file, with the recorded parts
+            assert puts[1] == (puts[0][0], puts[0][1], 'upload-1', {1: 'etag-1'})
+            assert client.db_session.query(database.PendingUpload).count() == 0
+            assert client.db_session.query(database.PendingUploadPart).count() == 0
+            assert not os.path.exists(puts[0][1])
+            assert client.backup_list()[0]['uploaded_file_path'] == puts[0][0]
+
+def test_upload_session(mocker):
+    '''Test upload state is only kept for databases on disk, and worker threads release their session'''
+    from concurrent.futures import ThreadPoolExecutor
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=MockOSClient)
+    with TemporaryDirectory() as tmp_dir:
+        client = BackupClient(None, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+        assert client.upload_session is None
+        client = BackupClient(':memory:', FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+        assert client.upload_session is None
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, tmp_dir)
+            def use_session():
+                client.upload_session.query(database.PendingUpload).count()
+                assert client.upload_session.registry.has()
+                client.remove_upload_session()
+                return client.upload_session.registry.has()
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                sessions = {id(executor.submit(lambda: client.upload_session).result()) for _ in range(8)}
+                assert not any(executor.map(lambda _: use_session(), range(8)))
+            # Created once, even when first used from several threads
+            assert len(sessions) == 1
+
+def test_file_restore_keeps_interrupted_download(mocker):
+    '''Test a failed download stays in the work directory under the object name, so the next restore resumes it'''
+    objects = {}
+    downloads = []
+    class InterruptedOSClient(MockOSClient):
+        def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+            objects[object_name] = data
+            return True
+
+        def object_get(self, namespace, bucket, object_name, file_name, **kwargs):
+            downloads.append(file_name)
+            if len(downloads) == 1:
+                with open(file_name, 'wb') as writer:
+                    writer.write(objects[object_name][:10])
+                raise ObjectStorageException('Connection lost')
+            with open(file_name, 'wb') as writer:
+                writer.write(objects[object_name])
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=InterruptedOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            work_dir = os.path.join(tmp_dir, 'work')
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, work_dir)
+            local_file = os.path.join(tmp_dir, 'restored.txt')
+            with open(local_file, 'w') as writer:
+                writer.write('restore me')
+            client.file_backup(local_file)
+            os.remove(local_file)
+            local_file_id = client.file_list()[0]['id']
+
+            with pytest.raises(ObjectStorageException):
+                client.file_restore(local_file_id)
+            assert os.path.exists(downloads[0])
+            assert os.path.basename(downloads[0]) == f'{client.backup_list()[0]["uploaded_file_path"]}.download'
+
+            assert client.file_restore(local_file_id) == True
+            assert downloads[1] == downloads[0]
+            assert not os.path.exists(downloads[0])
+            with open(local_file) as reader:
+                assert reader.read() == 'restore me'
+
+def test_file_restore_download_concurrent(mocker):
+    '''Test restores of the same object from several threads take turns with its download file in the work directory'''
+    import threading
+    import time
+    from concurrent.futures import ThreadPoolExecutor
+    objects = {}
+    active = []
+    overlapped = []
+    class SlowOSClient(MockOSClient):
+        def object_put_bytes(self, namespace, bucket, object_name, data, **kwargs):
+            objects[object_name] = data
+            return True
+
+        def object_get(self, namespace, bucket, object_name, file_name, **kwargs):
+            if active:
+                overlapped.append(file_name)
+            active.append(file_name)
+            with open(file_name, 'wb') as writer:
+                writer.write(objects[object_name][:10])
+                time.sleep(0.1)
+                writer.write(objects[object_name][10:])
+            active.remove(file_name)
+            return True
+
+    mocker.patch('backup_tool.oci_client.OCIObjectStorageClient',
+                 return_value=SlowOSClient())
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir, suffix='.sql') as temp_db:
+            client = BackupClient(temp_db, FAKE_CRYPTO_KEY, '', '', FAKE_NAMESPACE, FAKE_BUCKET, os.path.join(tmp_dir, 'work'))
+            local_file = os.path.join(tmp_dir, 'restored.txt')
+            with open(local_file, 'w') as writer:
+                writer.write('restore me twice')
+            client.file_backup(local_file)
+            backup_entry = client.db_session.query(database.BackupEntry).one()
+            targets = [Path(tmp_dir) / f'copy-{count}.txt' for count in range(3)]
+            barrier = threading.Barrier(len(targets))
+            def restore(target):
+                barrier.wait()
+                return client._file_restore_download(backup_entry, target, False)
+            with ThreadPoolExecutor(max_workers=len(targets)) as executor:
+                assert list(executor.map(restore, targets)) == [True] * len(targets)
+            assert not overlapped
+            assert [target.read_text() for target in targets] == ['restore me twice'] * len(targets)
+            assert not client._download_locks
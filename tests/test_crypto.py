@@ -1,8 +1,12 @@
 import os
+import struct
 from tempfile import TemporaryDirectory
 
+import pytest
+
 from backup_tool import crypto
 from backup_tool import utils
+from backup_tool.exception import BackupToolException
 
 
 def test_encyrpt_file_md5():
@@ -218,4 +222,85 @@ def test_encyrpt_file_md5_trail_spaces():
                     decrypted_md5 = utils.md5(decrypted)
                     assert decrypted_md5 == orig_md5_sum, 'MD5 of decrypted file does not match original'
                     assert en_md5 == encrypted_md5, 'Decryption returns wrong md5 value for original file'
-                    assert or_md5 == orig_md5_sum, 'Decryption returns wrong md5 value for decrypted file'
\ No newline at end of file
+                    assert or_md5 == orig_md5_sum, 'Decryption returns wrong md5 value for decrypted file'
+
+def test_decrypt_stream_short_reads():
+    # Network streams can return fewer bytes than asked for, decryption should not depend on read sizes
+    import io
+    passphrase = utils.random_string(length=16)
+
+    class ShortReader():
+        def __init__(self, data):
+            self.stream = io.BytesIO(data)
+
+        def read(self, size=-1):
+            return self.stream.read(min(size, 7))
+
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir) as input_temp:
+            with open(input_temp, 'wb') as writer:
+                writer.write(os.urandom(50001))
+            with utils.temp_file(tmp_dir) as encrypted:
+                or_md5, en_md5 = crypto.encrypt_file(input_temp, encrypted, passphrase)
+                with open(encrypted, 'rb') as reader:
+                    data = reader.read()
+                output = io.BytesIO()
+                check_en_md5, check_or_md5 = crypto.decrypt_stream(ShortReader(data), output, passphrase)
+                assert check_en_md5 == en_md5
+                assert check_or_md5 == or_md5
+                assert len(output.getvalue()) == 50001
+
+def test_encrypting_reader():
+    # Streams of unknown size keep their size in a trailer, and decrypt like files
+    import io
+    passphrase = utils.random_string(length=16)
+    for size in [0, 15, 16, 17, 64 * 1024, 3 * 64 * 1024 + 5]:
+        original = os.urandom(size)
+        reader = crypto.EncryptingReader(io.BytesIO(original), passphrase)
+        chunks = []
+        while True:
+            chunk = reader.read(1000)
+            if not chunk:
+                break
+            chunks.append(chunk)
+        encrypted = b''.join(chunks)
+        assert reader.original_size == size
+        assert reader.encrypted_size == len(encrypted)
+        with TemporaryDirectory() as tmp_dir:
+            with utils.temp_file(tmp_dir) as input_temp:
+                input_temp.write_bytes(original)
+                assert reader.original_md5 == utils.md5(input_temp)
+        output = io.BytesIO()
+        check_en_md5, check_or_md5 = crypto.decrypt_stream(io.BytesIO(encrypted), output, passphrase, chunksize=48)
+        assert output.getvalue() == original
+        assert check_en_md5 == reader.encrypted_md5
+        assert check_or_md5 == reader.original_md5
+
+def test_encrypting_reader_truncated():
+    # Streams of unknown size cut short or with a wrong trailer are reported, not decrypted with a garbage size
+    import io
+    passphrase = utils.random_string(length=16)
+    encrypted = crypto.EncryptingReader(io.BytesIO(os.urandom(1000)), passphrase).read()
+    header_size = struct.calcsize(crypto.SIZE_FORMAT) + 16
+    for data in [encrypted[:-3], encrypted[:-16], encrypted[:header_size + 3], encrypted[:header_size]]:
+        with pytest.raises(BackupToolException) as error:
+            crypto.decrypt_stream(io.BytesIO(data), io.BytesIO(), passphrase, chunksize=48)
+        assert 'truncated' in str(error.value)
+    corrupt = encrypted[:-struct.calcsize(crypto.SIZE_FORMAT)] + struct.pack(crypto.SIZE_FORMAT, 5000)
+    with pytest.raises(BackupToolException) as error:
+        crypto.decrypt_stream(io.BytesIO(corrupt), io.BytesIO(), passphrase)
+    assert 'does not match' in str(error.value)
+
+def test_encrypt_bytes():
+    # In memory encryption writes the format of encrypt_file
+    import io
+    passphrase = utils.random_string(length=16)
+    for size in [0, 15, 16, 1000]:
+        original = os.urandom(size)
+        encrypted, or_md5, en_md5 = crypto.encrypt_bytes(original, passphrase)
+        assert len(encrypted) == crypto.encrypted_size(size)
+        output = io.BytesIO()
+        check_en_md5, check_or_md5 = crypto.decrypt_stream(io.BytesIO(encrypted), output, passphrase)
+        assert output.getvalue() == original
+        assert check_en_md5 == en_md5
+        assert check_or_md5 == or_md5
@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pytest
+
+from backup_tool import governor
+from backup_tool.exception import ObjectStorageException
+from backup_tool.metrics import RunMetrics
+
+
+class ThrottleError(Exception):
+    pass
+
+def classify(error):
+    return 'throttle' if isinstance(error, ThrottleError) else None
+
+def test_governor_retries_throttling():
+    '''
+    Throttled requests are retried after jittered backoff, halving the limit, which grows back on success
+    '''
+    metrics = RunMetrics()
+    sleeps = []
+    request_governor = governor.RequestGovernor(classify, metrics=metrics, initial_limit=8, sleep=sleeps.append)
+    assert metrics.summary()['gauges'][governor.LIMIT_GAUGE] == 8
+
+    attempts = []
+    def request():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise ThrottleError('429')
+        return 'done'
+    assert request_governor.call('put', request) == 'done'
+    assert len(attempts) == 3
+    assert len(sleeps) == 2
+    assert 0 <= sleeps[0] <= governor.BACKOFF_BASE['throttle']
+    assert 0 <= sleeps[1] <= governor.BACKOFF_BASE['throttle'] * 2
+    assert request_governor.current_limit == 2
+    summary = metrics.summary()
+    assert summary['gauges'][governor.LIMIT_GAUGE] == 2
+    assert summary['stages']['storage']['retries'] == 2
+
+    for _ in range(10):
+        request_governor.call('list', lambda: None)
+    assert request_governor.current_limit > 2
+
+def test_governor_reporting_to():
+    '''
+    Views share the limit of the governor, retries and the limit are recorded in the metrics of the view only
+    '''
+    shared_metrics = RunMetrics()
+    request_governor = governor.RequestGovernor(classify, metrics=shared_metrics, initial_limit=8, sleep=lambda _seconds: None)
+    request_metrics = RunMetrics()
+    view = request_governor.reporting_to(request_metrics)
+    assert request_metrics.summary()['gauges'][governor.LIMIT_GAUGE] == 8
+
+    attempts = []
+    def request():
+        attempts.append(1)
+        if len(attempts) < 2:
+            raise ThrottleError('429')
+        return 'done'
+    assert view.wrap('put', request)() == 'done'
+    assert request_governor.current_limit == view.current_limit == 4
+    assert request_metrics.summary()['stages']['storage']['retries'] == 1
+    assert request_metrics.summary()['gauges'][governor.LIMIT_GAUGE] == 4
+    assert 'storage' not in shared_metrics.summary()['stages']
+    assert shared_metrics.summary()['gauges'][governor.LIMIT_GAUGE] == 8
+
+def test_governor_errors():
+    '''
+    Errors that are not retryable are raised at once, retryable ones after max attempts
+    '''
+    request_governor = governor.RequestGovernor(classify, max_attempts=3, sleep=lambda _seconds: None)
+    def fail():
+        raise ValueError('bad request')
+    with pytest.raises(ValueError):
+        request_governor.call('get', fail)
+    assert request_governor.in_flight == 0
+
+    def throttle():
+        raise ThrottleError('429')
+    with pytest.raises(ObjectStorageException) as error:
+        request_governor.call('get', throttle)
+    assert str(error.value) == 'Object storage get failed after 3 attempts: 429'
+    assert request_governor.current_limit == 1
+    assert request_governor.in_flight == 0
+
+def test_governor_limit():
+    '''
+    No more requests than the limit run at the same time, slow requests shrink the limit
+    '''
+    request_governor = governor.RequestGovernor(classify, initial_limit=2, max_limit=2)
+    lock = threading.Lock()
+    running = [0, 0]
+    def request():
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.01)
+        with lock:
+            running[0] -= 1
+    threads = [threading.Thread(target=request_governor.call, args=('put', request)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert running[1] == 2
+
+    request_governor = governor.RequestGovernor(classify, initial_limit=10, latency_target=0.001)
+    request_governor.call('list', time.sleep, 0.01)
+    assert request_governor.limit == 9
+    request_governor.call('put', time.sleep, 0.01, latency_sensitive=False)
+    assert request_governor.limit > 9
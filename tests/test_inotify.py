@@ -0,0 +1,58 @@
+import os
+from pathlib import Path
+import sys
+from tempfile import TemporaryDirectory
+
+import pytest
+
+from backup_tool import inotify
+
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason='inotify is only available on linux')
+
+
+def test_recursive_watcher():
+    '''
+    Watch tree, new files and directories are reported, moved out directories unwatched
+    '''
+    with TemporaryDirectory() as tmp_dir:
+        (Path(tmp_dir) / 'existing').mkdir()
+        with inotify.Inotify() as notifier:
+            watcher = inotify.RecursiveWatcher(notifier)
+            assert watcher.watch(tmp_dir) == []
+            assert len(watcher.directories) == 2
+
+            (Path(tmp_dir) / 'existing' / 'foo.txt').write_text('foo')
+            changed, overflow = watcher.poll(timeout=1)
+            assert not overflow
+            assert changed == {os.path.join(tmp_dir, 'existing', 'foo.txt')}
+
+            # Directory moved in with files already in it
+            with TemporaryDirectory() as other_dir:
+                (Path(other_dir) / 'moved').mkdir()
+                (Path(other_dir) / 'moved' / 'bar.txt').write_text('bar')
+                os.rename(Path(other_dir) / 'moved', Path(tmp_dir) / 'moved')
+            changed, overflow = watcher.poll(timeout=1)
+            assert changed == {os.path.join(tmp_dir, 'moved', 'bar.txt')}
+            assert os.path.join(tmp_dir, 'moved') in watcher.watches
+
+            # Directory renamed, old path unwatched and new path watched
+            os.rename(Path(tmp_dir) / 'moved', Path(tmp_dir) / 'renamed')
+            changed, overflow = watcher.poll(timeout=1)
+            assert os.path.join(tmp_dir, 'moved') not in watcher.watches
+            assert os.path.join(tmp_dir, 'renamed') in watcher.watches
+            assert changed == {os.path.join(tmp_dir, 'renamed', 'bar.txt')}
+
+            assert watcher.poll(timeout=0) == (set(), False)
+
+def test_recursive_watcher_overflow(mocker):
+    '''
+    Queue overflow is reported so the caller can rescan
+    '''
+    with TemporaryDirectory() as tmp_dir:
+        with inotify.Inotify() as notifier:
+            watcher = inotify.RecursiveWatcher(notifier)
+            watcher.watch(tmp_dir)
+            mocker.patch.object(notifier, 'read_events',
+                                return_value=[inotify.InotifyEvent(-1, inotify.IN_Q_OVERFLOW, 0, '')])
+            assert watcher.poll(timeout=0) == (set(), True)
@@ -0,0 +1,66 @@
+import json
+from tempfile import TemporaryDirectory
+from pathlib import Path
+
+import pytest
+
+from backup_tool.metrics import LATENCY_BUCKETS, RunMetrics, StageMetrics
+
+
+def test_stage_timing():
+    metrics = RunMetrics()
+    for _ in range(10):
+        with metrics.time('md5', size=100):
+            pass
+    with metrics.time('upload') as observation:
+        observation.size = 2048
+    metrics.increment('skip', files=3)
+    metrics.set_gauge('storage_concurrency_limit', 4)
+
+    summary = metrics.summary()
+    assert summary['stages']['md5']['files'] == 10
+    assert summary['stages']['md5']['bytes'] == 1000
+    assert summary['stages']['md5']['p50_seconds'] in LATENCY_BUCKETS
+    assert summary['stages']['md5']['p99_seconds'] in LATENCY_BUCKETS
+    assert summary['stages']['upload']['bytes'] == 2048
+    assert summary['stages']['skip']['files'] == 3
+    assert summary['stages']['skip']['p50_seconds'] is None
+    assert summary['gauges']['storage_concurrency_limit'] == 4
+    assert any(line.startswith('md5: files=10') for line in metrics.format_summary())
+
+def test_stage_percentiles():
+    stage = StageMetrics()
+    for seconds in [0.002] * 98 + [0.07, 0.2]:
+        stage.observe(seconds)
+    assert stage.percentile(0.5) == 0.005
+    assert stage.percentile(0.99) == 0.1
+    assert StageMetrics().percentile(0.5) is None
+
+def test_stage_errors():
+    metrics = RunMetrics()
+    with pytest.raises(ValueError):
+        with metrics.time('encrypt', size=100):
+            raise ValueError('bad file')
+    assert metrics.summary()['stages']['encrypt']['errors'] == 1
+    # Failed operations are not counted as processed
+    assert metrics.summary()['stages']['encrypt']['files'] == 0
+    assert metrics.summary()['stages']['encrypt']['bytes'] == 0
+
+def test_write_files():
+    metrics = RunMetrics()
+    with metrics.time('md5', size=10):
+        pass
+    metrics.set_gauge('storage_concurrency_limit', 2)
+    with TemporaryDirectory() as tmp_dir:
+        json_file = Path(tmp_dir) / 'metrics.json'
+        metrics.write_json(json_file)
+        assert json.loads(json_file.read_text())['stages']['md5']['bytes'] == 10
+
+        prom_file = Path(tmp_dir) / 'backup.prom'
+        metrics.write_prometheus(prom_file, 'directory_backup')
+        lines = prom_file.read_text().splitlines()
+        assert 'backup_tool_stage_bytes_total{command="directory_backup",stage="md5"} 10' in lines
+        assert 'backup_tool_stage_duration_seconds_bucket{command="directory_backup",stage="md5",le="+Inf"} 1' in lines
+        assert 'backup_tool_storage_concurrency_limit{command="directory_backup"} 2' in lines
+        # Temp file is renamed into place
+        assert list(Path(tmp_dir).glob('.*')) == []
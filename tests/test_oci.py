@@ -1,3 +1,4 @@
+import io
 import os
 import pytest
 from tempfile import TemporaryDirectory
@@ -8,7 +9,8 @@ from oci.object_storage import ObjectStorageClient
 
 from backup_tool import utils
 from backup_tool.exception import ObjectStorageException
-from backup_tool.oci_client import OCIObjectStorageClient
+from backup_tool.metrics import RunMetrics
+from backup_tool.oci_client import MultipartUploadState, OCIObjectStorageClient, classify_error
 
 FAKE_CONFIG = 'faker_config'
 FAKE_SECTION = 'default'
@@ -25,6 +27,7 @@ class MockResponse():
     def __init__(self, status, data):
         self.status = status
         self.data = data
+        self.headers = {}
 
 class MockListData():
     def __init__(self, objects):
@@ -327,3 +330,325 @@ def test_object_put_invalid_status(mocker):
             with pytest.raises(ObjectStorageException) as error:
                 client.object_put(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', temp_file)
             assert str(error.value) == 'Error uploading object, Reponse code 400'
+
+def test_object_list_pages(mocker):
+    class MockPageData():
+        def __init__(self, objects, next_start_with):
+            self.objects = objects
+            self.next_start_with = next_start_with
+
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def list_objects(_namespace, _bucket, start=None, **kwargs):
+            if start is None:
+                return MockResponse(200, MockPageData([MockObject('a', 1, 'md5-a')], 'b'))
+            return MockResponse(200, MockPageData([MockObject('b', 2, 'md5-b')], None))
+
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=MockOCI)
+    mocker.patch('backup_tool.oci_client.to_dict',
+                 side_effect=to_dict_mock)
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    pages = list(client.object_list_pages(FAKE_NAMESPACE, FAKE_BUCKET))
+    assert len(pages) == 2
+    assert pages[0][0]['name'] == 'a'
+    assert pages[1][0]['name'] == 'b'
+
+def test_object_get_stream(mocker):
+    class MockStreamData():
+        def __init__(self):
+            self.raw = io.BytesIO(b'01234')
+            self.closed = False
+
+        def close(self):
+            self.closed = True
+
+    stream_data = MockStreamData()
+
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def get_object(self, *args, **kwargs):
+            return MockResponse(200, stream_data)
+
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=MockOCI)
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    with client.object_get_stream(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name') as reader:
+        assert reader.read() == b'01234'
+    assert stream_data.closed
+
+def test_classify_error():
+    assert classify_error(ServiceError(429, 'TooManyRequests', {}, 'slow down')) == 'throttle'
+    assert classify_error(ServiceError(503, 'ServiceUnavailable', {}, 'busy')) == 'unavailable'
+    assert classify_error(ServiceError(404, 'NotFound', {}, 'missing')) == None
+    assert classify_error(TimeoutError()) == 'timeout'
+    assert classify_error(ValueError()) == None
+
+def test_object_put_retry(mocker):
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def list_multipart_uploads(self, *args, **kwargs):
+            return MockResponse(200, MockMultiUploadList([]))
+
+    calls = []
+    class MockUploadManager():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def upload_file(self, *args, **kwargs):
+            calls.append(1)
+            if len(calls) == 1:
+                raise ServiceError(503, 'ServiceUnavailable', {}, 'busy')
+            return MockResponse(200, None)
+
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=MockOCI)
+    mocker.patch('backup_tool.oci_client.UploadManager',
+                 return_value=MockUploadManager)
+    mocker.patch('backup_tool.oci_client.list_call_get_all_results',
+                 side_effect=list_all_mock)
+    shared_metrics = RunMetrics()
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION, metrics=shared_metrics)
+    client.governor.sleep = lambda _seconds: None
+    # Retries are recorded in the metrics of the caller
+    request_metrics = RunMetrics()
+    request_client = client.with_metrics(request_metrics)
+    with TemporaryDirectory() as tmp_dir:
+        with utils.temp_file(tmp_dir) as temp_file:
+            temp_file.write_text(utils.random_string())
+            assert request_client.object_put(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', temp_file) == True
+    assert len(calls) == 2
+    assert request_metrics.summary()['stages']['storage']['retries'] == 1
+    assert 'storage' not in shared_metrics.summary()['stages']
+
+def test_object_put_stream(mocker):
+    parts = {}
+    calls = []
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def create_multipart_upload(self, namespace, bucket, details):
+            calls.append('create')
+            return MockResponse(200, MockMultipartUpload(details.object, 'upload-1'))
+
+        def upload_part(self, namespace, bucket, object_name, upload_id, part_num, data):
+            calls.append('part')
+            if calls.count('part') == 2:
+                raise ServiceError(503, 'ServiceUnavailable', {}, 'busy')
+            parts[part_num] = data
+            response = MockResponse(200, None)
+            response.headers = {'etag': f'etag-{part_num}'}
+            return response
+
+        def commit_multipart_upload(self, namespace, bucket, object_name, upload_id, details):
+            calls.append('commit')
+            assert [(part.part_num, part.etag) for part in details.parts_to_commit] == [(1, 'etag-1'), (2, 'etag-2'), (3, 'etag-3')]
+            return MockResponse(200, None)
+
+        def abort_multipart_upload(self, *args, **kwargs):
+            calls.append('abort')
+            return MockResponse(204, None)
+
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=MockOCI())
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    client.governor.sleep = lambda _seconds: None
+    data = os.urandom(25)
+    assert client.object_put_stream(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', io.BytesIO(data), part_size=10) == True
+    # Failed part is retried with the same data
+    assert b''.join(parts[part_num] for part_num in sorted(parts)) == data
+    assert calls == ['create', 'part', 'part', 'part', 'part', 'commit']
+
+    class FailingReader():
+        def read(self, size=-1):
+            raise OSError('Broken pipe')
+
+    calls.clear()
+    with pytest.raises(OSError):
+        client.object_put_stream(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', FailingReader(), part_size=10)
+    assert calls == ['create', 'abort']
+
+def test_object_put_bytes(mocker):
+    calls = []
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def put_object(self, namespace, bucket, object_name, data, content_md5=None):
+            calls.append((object_name, data, content_md5))
+            if len(calls) == 1:
+                raise ServiceError(429, 'TooManyRequests', {}, 'slow down')
+            return MockResponse(200, None)
+
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=MockOCI())
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    client.governor.sleep = lambda _seconds: None
+    assert client.object_put_bytes(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', b'data', md5_sum='md5') == True
+    assert calls == [('some-object-name', b'data', 'md5')] * 2
+
+def test_object_put_upload_state(mocker):
+    uploaded = {}
+    calls = []
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            self.fail_part = 3
+            self.missing_upload = None
+            self.created = 0
+
+        def create_multipart_upload(self, namespace, bucket, details):
+            calls.append('create')
+            self.created += 1
+            return MockResponse(200, MockMultipartUpload(details.object, f'upload-{self.created}'))
+
+        def upload_part(self, namespace, bucket, object_name, upload_id, part_num, data, content_md5=None):
+            calls.append(part_num)
+            assert content_md5 == utils.md5_bytes(data)
+            if upload_id == self.missing_upload:
+                raise ServiceError(404, 'NoSuchUpload', {}, 'gone')
+            if part_num == self.fail_part:
+                raise ServiceError(400, 'InvalidParameter', {}, 'bad part')
+            uploaded[(upload_id, part_num)] = data
+            response = MockResponse(200, None)
+            response.headers = {'etag': f'etag-{upload_id}-{part_num}'}
+            return response
+
+        def commit_multipart_upload(self, namespace, bucket, object_name, upload_id, details):
+            calls.append('commit')
+            assert [part.part_num for part in details.parts_to_commit] == [1, 2, 3, 4]
+            assert b''.join(uploaded[(upload_id, part.part_num)] for part in details.parts_to_commit) == data
+            return MockResponse(200, None)
+
+    mock_oci = MockOCI()
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=mock_oci)
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    data = os.urandom(35)
+    with TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'upload')
+        with open(file_name, 'wb') as writer:
+            writer.write(data)
+        # Interrupted upload keeps the parts that finished
+        upload_state = MultipartUploadState()
+        with pytest.raises(ServiceError):
+            client.object_put(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, upload_state=upload_state, part_size=10)
+        assert upload_state.upload_id == 'upload-1'
+        assert upload_state.part_size == 10
+        assert 3 not in upload_state.parts
+        assert upload_state.parts == {part_num: f'etag-upload-1-{part_num}' for part_num in upload_state.parts}
+
+        # Resume only uploads missing parts, without listing uploads or creating a new one
+        mock_oci.fail_part = None
+        resumed_parts = upload_state.parts.copy()
+        calls.clear()
+        assert client.object_put(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, upload_state=upload_state, part_size=10) == True
+        assert sorted(calls[:-1]) == [part_num for part_num in [1, 2, 3, 4] if part_num not in resumed_parts]
+        assert calls[-1] == 'commit'
+        assert upload_state.upload_id is None
+
+        # Upload that no longer exists is started over
+        mock_oci.missing_upload = 'upload-1'
+        upload_state = MultipartUploadState(upload_id='upload-1', part_size=10, parts={1: 'etag-upload-1-1'})
+        calls.clear()
+        assert client.object_put(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, upload_state=upload_state, part_size=10) == True
+        assert calls.count('create') == 1
+        assert sorted(calls[calls.index('create') + 1:-1]) == [1, 2, 3, 4]
+        assert upload_state.upload_id is None
+
+def test_object_get_ranges(mocker):
+    data = os.urandom(35)
+    calls = []
+    class MockBody():
+        def __init__(self, body):
+            self.raw = io.BytesIO(body)
+
+        def close(self):
+            pass
+
+    class MockOCI():
+        def __init__(self, *args, **kwargs):
+            self.etag = 'etag-1'
+            self.fail_range = 'bytes=20-29'
+            self.short_range = 'bytes=10-19'
+
+        def get_object(self, namespace, bucket, object_name, range=None, if_match=None):
+            calls.append(range)
+            if range is None:
+                response = MockResponse(200, MockBody(data))
+                response.headers = {'content-length': str(len(data)), 'etag': self.etag}
+                return response
+            if if_match != self.etag:
+                raise ServiceError(412, 'IfMatchFailed', {}, 'etag changed')
+            if range == self.fail_range:
+                raise ServiceError(400, 'InvalidParameter', {}, 'bad range')
+            start, end = [int(value) for value in range[len('bytes='):].split('-')]
+            body = data[start:end + 1]
+            if range == self.short_range:
+                # Connection dropped part way, retried
+                self.short_range = None
+                body = body[:3]
+            return MockResponse(206, MockBody(body))
+
+    mock_oci = MockOCI()
+    mocker.patch('backup_tool.oci_client.from_file',
+                 return_value='')
+    mocker.patch('backup_tool.oci_client.ObjectStorageClient',
+                 return_value=mock_oci)
+    client = OCIObjectStorageClient(FAKE_CONFIG, FAKE_SECTION)
+    client.governor.sleep = lambda _seconds: None
+    with TemporaryDirectory() as tmp_dir:
+        file_name = os.path.join(tmp_dir, 'download')
+        ranges_file = f'{file_name}.ranges'
+        # Failed range leaves the allocated file and finished ranges behind
+        assert client.object_get(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, range_size=10) == False
+        assert os.path.getsize(file_name) == len(data)
+        with open(ranges_file, encoding='utf-8') as reader:
+            lines = reader.read().splitlines()
+        done = [int(line) for line in lines[1:]]
+        assert 2 not in done
+
+        # Resume only fetches missing ranges, without the first request
+        mock_oci.fail_range = None
+        calls.clear()
+        assert client.object_get(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, range_size=10) == True
+        expected = [f'bytes={index * 10}-{min(index * 10 + 9, 34)}' for index in range(4) if index not in done]
+        assert sorted(set(calls)) == sorted(expected)
+        with open(file_name, 'rb') as reader:
+            assert reader.read() == data
+        assert not os.path.exists(ranges_file)
+
+        # Object changed since download was interrupted, start over
+        with open(ranges_file, 'w', encoding='utf-8') as writer:
+            writer.write('{"etag": "etag-0", "size": 35, "range_size": 10}\n0\n1\n')
+        calls.clear()
+        assert client.object_get(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name, range_size=10) == True
+        assert calls.count(None) == 1
+        with open(file_name, 'rb') as reader:
+            assert reader.read() == data
+        assert not os.path.exists(ranges_file)
+
+        # Object that fits one range is written from the first request
+        calls.clear()
+        assert client.object_get(FAKE_NAMESPACE, FAKE_BUCKET, 'some-object-name', file_name) == True
+        assert calls == [None]
+        with open(file_name, 'rb') as reader:
+            assert reader.read() == data
@@ -0,0 +1,16 @@
+from backup_tool import scheduler
+
+
+FILES = [('a', None, 5), ('b', None, 100), ('c', None, 1), ('d', None, 50), ('e', None, 10)]
+
+def test_schedule_policies():
+    '''
+    Each policy returns every file once, in its own order
+    '''
+    def names(policy):
+        return [item[0] for item in scheduler.schedule(FILES, policy)]
+    assert names('fifo') == ['a', 'b', 'c', 'd', 'e']
+    assert names('largest-first') == ['b', 'd', 'e', 'a', 'c']
+    assert names('smallest-first') == ['c', 'a', 'e', 'd', 'b']
+    assert names('balanced') == ['b', 'c', 'd', 'a', 'e']
+    assert scheduler.schedule([], 'balanced') == []
@@ -1,4 +1,8 @@
+import io
+from pathlib import Path
+import sys
 from tempfile import TemporaryDirectory
+from unittest import mock
 
 from backup_tool import utils
 
@@ -24,3 +28,34 @@ def test_setup_logger():
         with utils.temp_file(tmp_dir) as temp:
             log = utils.setup_logger('test', 10, logging_file=temp)
         log.debug(f'Running log test with log file {temp}')
+
+def test_read_delimited():
+    '''
+    Entries split across reads are joined, empty entries skipped
+    '''
+    reader = io.BytesIO(b'first\0second file\0\0last')
+    assert list(utils.read_delimited(reader, b'\0', chunksize=4)) == [b'first', b'second file', b'last']
+    assert list(utils.read_delimited(io.BytesIO(b'one\ntwo\n'))) == [b'one', b'two']
+    assert not list(utils.read_delimited(io.BytesIO(b'')))
+
+def test_copy_file():
+    with TemporaryDirectory() as tmp_dir:
+        source = Path(tmp_dir) / 'source'
+        destination = Path(tmp_dir) / 'destination'
+        source.write_bytes(b'0123456789' * 1000)
+        destination.write_bytes(b'old content that is longer than nothing')
+        assert utils.copy_file(source, destination) in ('reflink', 'copy_file_range', 'copy')
+        assert destination.read_bytes() == source.read_bytes()
+        # No fcntl, as on windows, skips the reflink
+        destination.unlink()
+        with mock.patch.dict(sys.modules, {'fcntl': None}):
+            assert utils.copy_file(source, destination) in ('copy_file_range', 'copy')
+        assert destination.read_bytes() == source.read_bytes()
+
+def test_prefix_upper_bound():
+    assert utils.prefix_upper_bound('abc') == 'abd'
+    assert utils.prefix_upper_bound('') is None
+    # Surrogates are skipped, the bound must encode as utf-8
+    bound = utils.prefix_upper_bound('a\ud7ff')
+    assert bound == 'a\ue000'
+    bound.encode('utf-8')